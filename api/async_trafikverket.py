@@ -0,0 +1,279 @@
+import asyncio
+import time
+
+import aiohttp
+
+from api import codec, exceptions
+from api.cache import ResponseCache
+from api.governor import RateGovernor
+from api.metrics import Metrics
+from api.trafikverket import (BASE_URL, create_default_params, create_headers,
+                              create_request_body, decode_payload,
+                              is_batch_rejection, parse_bundles, select_dates,
+                              split_bundles)
+
+# Exceptions raised by aiohttp for failed requests, the asyncio counterpart of
+# `requests.exceptions.RequestException`
+REQUEST_EXCEPTIONS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+# Exceptions raised by aiohttp that are worth retrying
+RETRYABLE_EXCEPTIONS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError)
+
+
+class AsyncTrafikverketAPI:
+    """An asyncio class for interfacing with the Trafikverket API.
+
+    This class sends the same requests as `TrafikverketAPI`, but all calls
+    share one `aiohttp.ClientSession` and its connection pool, so a single
+    event loop can keep hundreds of requests in flight without a thread per
+    request. The object must be used as an async context manager, or be
+    opened with `open` and closed with `close`.
+
+    Attributes:
+        proxy: The URL of the HTTP proxy to use, or None.
+        session: The `aiohttp.ClientSession` used for the API calls. It is
+            created when entering the context manager.
+        default_params: A dictionary containing the default parameters for the API calls.
+        base_url: The URL of the server to send the API calls to.
+        cache: The optional cache of the bundles of each location.
+        metrics: The metrics of the requests.
+        governor: The optional governor pacing the requests.
+        batching: Whether several locations may be queried in one request.
+    """
+
+    def __init__(
+        self,
+        cookies,
+        proxy: dict,
+        useragent: str,
+        ssn: str,
+        max_connections: int = 100,
+        base_url: str = BASE_URL,
+        cache: ResponseCache = None,
+        metrics: Metrics = None,
+        governor: RateGovernor = None,
+        **query_options
+    ) -> None:
+        """
+        Initialize an AsyncTrafikverketAPI object.
+
+        Args:
+            cookies: A dictionary containing the cookies for the session.
+            proxy: A dictionary containing the proxy settings for the session.
+                Only HTTP proxies are supported by aiohttp, so SOCKS proxies
+                such as TOR can not be used.
+            useragent: A string containing the user agent for the session.
+            ssn: A string containing the user's SSN.
+            max_connections: The maximum number of connections in the pool.
+                Defaults to 100.
+            base_url: The URL of the server to send the API calls to.
+            cache: An optional cache shared by all calls for the same examination
+                type and location. Must only be used from one event loop.
+            metrics: The metrics recording the latency, status and rides of every
+                request. Defaults to a new Metrics object.
+            governor: An optional governor shared by all calls, adapting the
+                request rate to the responses of the server.
+            **query_options: The remaining query options accepted by
+                `TrafikverketAPI.__init__`, such as examination_type_id.
+        """
+        # Use the same proxy for all requests, aiohttp only accepts a single URL
+        self.proxy = (proxy or {}).get('https')
+
+        # Set the server to send the API calls to
+        self.base_url = base_url
+
+        # Set the optional response cache
+        self.cache = cache
+
+        # Record the metrics of the requests
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        # Set the optional request pacing
+        self.governor = governor
+
+        # Query several locations at once until the server rejects it
+        self.batching = True
+
+        # Set the default parameters for the API calls
+        self.default_params = create_default_params(ssn=ssn, **query_options)
+
+        # Serialize the request bodies once per examination type and date window
+        self._templates: dict[tuple, codec.RequestTemplate] = {}
+
+        self._cookies = cookies
+        self._max_connections = max_connections
+
+        # aiohttp computes the content length itself, and sending the static
+        # placeholder would truncate the request body
+        self._headers = create_headers(useragent)
+        del self._headers['Content-Length']
+
+        self.session = None
+
+    async def __aenter__(self) -> 'AsyncTrafikverketAPI':
+        """Open the session and its connection pool."""
+        await self.open()
+        return self
+
+    async def open(self) -> None:
+        """Open the session and its connection pool.
+
+        Must be called from the event loop that will run the API calls.
+        """
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._max_connections, ssl=False),
+            cookies=self._cookies,
+            headers=self._headers,
+            timeout=aiohttp.ClientTimeout(total=60),
+        )
+
+    async def __aexit__(self, *exc_info) -> None:
+        """Close the session and its connection pool."""
+        await self.close()
+
+    async def close(self) -> None:
+        """Close the session and its connection pool."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get_available_dates(
+        self,
+        location_id: int,
+        extended_information: bool = False,
+        examination_type_id: int = None,
+        starting_date: str = None,
+        searched_months: int = None,
+    ) -> list[dict] | list[str]:
+        """
+        Retrieve a list of available dates for the given location.
+
+        Args:
+            location_id: The ID of the location to query.
+            extended_information: See `TrafikverketAPI.get_available_dates`.
+            examination_type_id: See `TrafikverketAPI.get_available_dates`.
+            starting_date: See `TrafikverketAPI.get_available_dates`.
+            searched_months: See `TrafikverketAPI.get_available_dates`.
+
+        Returns:
+            See `TrafikverketAPI.get_available_dates`.
+
+        Raises:
+            HTTPStatus: If the server returns an unexpected response code.
+        """
+        if examination_type_id is None:
+            examination_type_id = self.default_params['occasionBundleQuery']['examinationTypeId']
+
+        # Look up the bundles in the cache, sharing any request already in flight
+        if self.cache is not None:
+            available_rides = await self.cache.get_or_load_async(
+                (examination_type_id, location_id, starting_date, searched_months),
+                lambda: self._request_bundles(
+                    location_id, examination_type_id, starting_date=starting_date, searched_months=searched_months
+                ),
+            )
+        else:
+            available_rides = await self._request_bundles(
+                location_id, examination_type_id, starting_date=starting_date, searched_months=searched_months
+            )
+
+        return select_dates(available_rides, extended_information)
+
+    async def get_available_dates_batch(
+        self,
+        location_ids: list[int],
+        extended_information: bool = False,
+        examination_type_id: int = None,
+    ) -> dict[int, list[dict] | list[str]]:
+        """
+        Retrieve the available dates for several locations in one request.
+
+        See `TrafikverketAPI.get_available_dates_batch`.
+        """
+        if examination_type_id is None:
+            examination_type_id = self.default_params['occasionBundleQuery']['examinationTypeId']
+
+        try:
+            bundles = await self._request_bundles(location_ids[0], examination_type_id, location_ids[1:])
+        except exceptions.HTTPStatus as e:
+            if is_batch_rejection(e):
+                raise exceptions.BatchRejected(location_ids, e) from e
+            raise
+
+        bundles_by_location = split_bundles(bundles, location_ids)
+        for location_id, location_bundles in bundles_by_location.items():
+            self.metrics.rides.set(len(location_bundles), location_id, examination_type_id)
+
+        return {
+            location_id: select_dates(location_bundles, extended_information)
+            for location_id, location_bundles in bundles_by_location.items()
+        }
+
+    async def _request_bundles(
+        self,
+        location_id: int,
+        examination_type_id: int,
+        nearby_location_ids: list[int] = None,
+        starting_date: str = None,
+        searched_months: int = None,
+    ) -> list[dict]:
+        """Request the bundles of a location from the server.
+
+        Args:
+            location_id: The ID of the location to query.
+            examination_type_id: The examination type to query.
+            nearby_location_ids: The IDs of other locations to query in the
+                same request.
+            starting_date: The first date to query, or None for the default.
+            searched_months: The number of months to query, or None for the default.
+
+        Returns:
+            The list of bundle dictionaries.
+
+        Raises:
+            HTTPStatus: If the server returns an unexpected response code.
+        """
+        # Create the body of the request for this location
+        body = create_request_body(
+            self.default_params, self._templates,
+            location_id, examination_type_id, nearby_location_ids, starting_date, searched_months,
+        )
+
+        # Wait until the governor lets another request through
+        if self.governor is not None:
+            await self.governor.acquire_async()
+
+        with self.metrics.track_request(location_id, examination_type_id):
+            # Send request to server
+            start_time = time.perf_counter()
+            try:
+                response = await self.session.post(
+                    f'{self.base_url}/Boka/occasion-bundles',
+                    data=body,
+                    proxy=self.proxy,
+                )
+            except REQUEST_EXCEPTIONS:
+                self._record_response(start_time, None)
+                raise
+
+            async with response as r:
+                self._record_response(start_time, r.status)
+                self.metrics.responses.inc(r.status)
+
+                # Handle response
+                bundles = parse_bundles(
+                    r.status,
+                    decode_payload(r.status, await r.read()) if r.status == 200 else None,
+                )
+
+        if not nearby_location_ids:
+            self.metrics.rides.set(len(bundles), location_id, examination_type_id)
+        return bundles
+
+    def _record_response(self, start_time: float, status_code: int | None) -> None:
+        """Let the governor adapt the request rate to a response.
+
+        See `TrafikverketAPI._record_response`.
+        """
+        if self.governor is not None:
+            self.governor.record(time.perf_counter() - start_time, status_code)
@@ -0,0 +1,177 @@
+"""In-process response cache with single-flight request coalescing.
+
+The cache keeps the bundles of recently requested locations for a limited
+time, evicting the least recently used entries when it is full. Concurrent
+callers that miss the cache for the same key share a single in-flight
+request instead of each sending their own.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class ResponseCache:
+    """A TTL and LRU cache with single-flight loading.
+
+    Attributes:
+        ttl: The number of seconds an entry stays valid.
+        max_entries: The maximum number of entries kept.
+        hits: The number of lookups answered from the cache.
+        misses: The number of lookups that sent a request.
+        coalesced: The number of lookups that waited for a request already
+            in flight for the same key.
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 1024, clock: Callable[[], float] = time.monotonic) -> None:
+        """Initialize the ResponseCache object.
+
+        Args:
+            ttl: The number of seconds an entry stays valid.
+            max_entries: The maximum number of entries kept.
+            clock: The function used to read the current time.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        # Maps each key to (expiry time, value), least recently used first
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+        # Requests in flight for each key, for threads and for event loops
+        self._in_flight: dict[Hashable, Future] = {}
+        self._in_flight_async: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        """Return the number of entries in the cache, including expired ones."""
+        return len(self._entries)
+
+    def stats(self) -> dict[str, int]:
+        """Return the hit, miss and coalesced counters."""
+        return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced}
+
+    def _lookup(self, key: Hashable) -> tuple[bool, Any]:
+        """Look up a valid entry. Must be called with the lock held.
+
+        Returns:
+            A tuple of whether the entry was found and its value.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return False, None
+
+        # Mark the entry as recently used
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, value
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        """Store an entry, evicting the least recently used ones if full."""
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Return the cached value of a key, loading it if needed.
+
+        Only successful loads are cached. If the load fails, every caller
+        waiting for it gets the same exception.
+
+        Args:
+            key: The key of the value.
+            loader: A function that loads the value.
+
+        Returns:
+            The value of the key.
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+
+            # Share the request that is already in flight for this key
+            future = self._in_flight.get(key)
+            is_loader = future is None
+            if is_loader:
+                self.misses += 1
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not is_loader:
+            return future.result()
+
+        try:
+            value = loader()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            self._store(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    async def get_or_load_async(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value of a key, awaiting the loader if needed.
+
+        This is the asyncio counterpart of `get_or_load`. It must always be
+        called from the same event loop.
+
+        Args:
+            key: The key of the value.
+            loader: A coroutine function that loads the value.
+
+        Returns:
+            The value of the key.
+        """
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                return value
+
+            # Share the request that is already in flight for this key
+            task = self._in_flight_async.get(key)
+            if task is not None:
+                self.coalesced += 1
+            else:
+                self.misses += 1
+
+                # Load in a task of its own, so that cancelling the first caller
+                # does not cancel the request shared with the others
+                task = self._in_flight_async[key] = asyncio.ensure_future(self._load_async(key, loader))
+                task.add_done_callback(retrieve_exception)
+
+        # Shield the shared request from the cancellation of a single waiter
+        return await asyncio.shield(task)
+
+    async def _load_async(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Await the loader of a key and store its value if successful."""
+        try:
+            value = await loader()
+            self._store(key, value)
+            return value
+        finally:
+            del self._in_flight_async[key]
+
+
+def retrieve_exception(task: asyncio.Task) -> None:
+    """Mark the exception of a load as retrieved in case every waiter was cancelled."""
+    if not task.cancelled():
+        task.exception()
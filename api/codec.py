@@ -0,0 +1,86 @@
+"""Encoding of the request bodies and decoding of the responses.
+
+The body of an occasion-bundles request only differs in the queried
+location between the calls of a sweep, so a `RequestTemplate` serializes the
+rest of it once and splices the location ID into the bytes of every request,
+instead of copying and serializing the whole nested parameters each time.
+
+The JSON is encoded and decoded with orjson when it is installed, which is
+several times faster than the standard library for the bundle payloads, and
+with the standard library otherwise. The responses are decoded straight from
+their bytes, skipping the encoding detection and text decoding of
+`requests.Response.json`.
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The name of the JSON library in use, reported by the benchmarks
+BACKEND = 'orjson' if orjson is not None else 'json'
+
+# A location ID that never occurs in a request, marking where the real one goes
+PLACEHOLDER_LOCATION_ID = -7253918046
+
+
+def dumps(data: Any) -> bytes:
+    """Encode data as compact JSON.
+
+    Args:
+        data: The data to encode.
+
+    Returns:
+        The UTF-8 encoded JSON.
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(data: bytes) -> Any:
+    """Decode UTF-8 encoded JSON.
+
+    Args:
+        data: The JSON to decode.
+
+    Returns:
+        The decoded data.
+
+    Raises:
+        ValueError: If the data is not valid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class RequestTemplate:
+    """The serialized body of a request with a slot for the location ID.
+
+    Example:
+        template = RequestTemplate(create_request_params(default_params, PLACEHOLDER_LOCATION_ID))
+        body = template.render(1000137)
+    """
+
+    def __init__(self, params: dict) -> None:
+        """Serialize the parameters of a request.
+
+        Args:
+            params: The parameters of the request, with the location ID set
+                to `PLACEHOLDER_LOCATION_ID`.
+
+        Raises:
+            ValueError: If the placeholder does not occur exactly once.
+        """
+        parts = dumps(params).split(str(PLACEHOLDER_LOCATION_ID).encode())
+        if len(parts) != 2:
+            raise ValueError('The parameters must contain the placeholder location ID exactly once')
+
+        self._prefix, self._suffix = parts
+
+    def render(self, location_id: int) -> bytes:
+        """Return the body of the request for a location."""
+        return b'%s%d%s' % (self._prefix, location_id, self._suffix)
@@ -16,3 +16,103 @@ class HTTPStatus(Exception):
     def __str__(self):
         """Return a string representation of the HTTPStatus exception."""
         return f"Unexpected status code from server: {self.status_code}"
+
+
+class PayloadStatus(HTTPStatus):
+    """Exception raised when the server answers with an unexpected status in the payload.
+
+    The HTTP request itself succeeded, but the `status` field of the returned
+    JSON payload was not 200, which means the server rejected the query.
+
+    Attributes:
+        status_code: The HTTP status code that was returned by the server.
+        payload_status: The status found in the payload.
+    """
+
+    def __init__(self, status_code, payload_status):
+        """Initialize the PayloadStatus exception.
+
+        Args:
+            status_code: The HTTP status code that was returned by the server.
+            payload_status: The status found in the payload.
+        """
+        super().__init__(status_code)
+        self.payload_status = payload_status
+
+    def __str__(self):
+        """Return a string representation of the PayloadStatus exception."""
+        return f"Unexpected status in payload from server: {self.payload_status}"
+
+
+class InvalidPayload(HTTPStatus):
+    """Exception raised when the body of a successful response is not valid JSON.
+
+    The server answered, but with something else than the API, for example a
+    maintenance page.
+
+    Attributes:
+        status_code: The HTTP status code that was returned by the server.
+        error: The error raised when decoding the body.
+    """
+
+    def __init__(self, status_code, error):
+        """Initialize the InvalidPayload exception.
+
+        Args:
+            status_code: The HTTP status code that was returned by the server.
+            error: The error raised when decoding the body.
+        """
+        super().__init__(status_code)
+        self.error = error
+
+    def __str__(self):
+        """Return a string representation of the InvalidPayload exception."""
+        return f"Invalid JSON payload from server: {self.error}"
+
+
+class CircuitOpen(Exception):
+    """Exception raised when a call is skipped because its circuit is open.
+
+    Attributes:
+        key: The key of the circuit, usually a location ID.
+        retry_in: The number of seconds until the circuit lets a call through again.
+    """
+
+    def __init__(self, key, retry_in):
+        """Initialize the CircuitOpen exception.
+
+        Args:
+            key: The key of the circuit, usually a location ID.
+            retry_in: The number of seconds until the circuit lets a call through again.
+        """
+        self.key = key
+        self.retry_in = retry_in
+
+    def __str__(self):
+        """Return a string representation of the CircuitOpen exception."""
+        return f"Circuit for {self.key} is open for another {self.retry_in:.0f}s"
+
+
+class BatchRejected(Exception):
+    """Exception raised when the server rejects a query for several locations at once.
+
+    The locations can still be queried one by one.
+
+    Attributes:
+        location_ids: The IDs of the locations in the batch.
+        error: The error the server answered the batch with.
+    """
+
+    def __init__(self, location_ids, error):
+        """Initialize the BatchRejected exception.
+
+        Args:
+            location_ids: The IDs of the locations in the batch.
+            error: The error the server answered the batch with.
+        """
+        self.location_ids = location_ids
+        self.error = error
+
+    def __str__(self):
+        """Return a string representation of the BatchRejected exception."""
+        return f"Batch of {len(self.location_ids)} locations rejected: {self.error}"
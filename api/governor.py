@@ -0,0 +1,207 @@
+"""Adaptive pacing of the requests to the server.
+
+A `RateGovernor` is a token bucket shared by every caller of an API client:
+a request may only be sent once a token is available, and the tokens are
+refilled at the current target rate. The target rate adapts to the feedback
+of the server, additive increase and multiplicative decrease (AIMD) like TCP
+congestion control:
+
+- every fast successful response raises the rate, by `additive_increase`
+  requests per second for every second of requests at the current rate
+- a 429 or 5xx response, a failed request or a latency rising above
+  `latency_tolerance` times its baseline cuts the rate by `decrease_factor`
+
+The rate is cut at most once per `decrease_interval`, so a burst of errors
+from requests that were already in flight only counts once. The rate stays
+between `min_rate` and `max_rate`, so the script runs close to what the
+server tolerates without getting rate limited or banned.
+"""
+import asyncio
+import threading
+import time
+from typing import Callable
+
+# The weight of the latest response in the recent and baseline latency
+RECENT_LATENCY_SMOOTHING = 0.3
+BASELINE_LATENCY_SMOOTHING = 0.02
+
+
+def is_overload(status_code: int | None) -> bool:
+    """Check whether a response tells that the server is overloaded.
+
+    Args:
+        status_code: The HTTP status code, or None if the request failed
+            without a response, for example because it timed out.
+
+    Returns:
+        True for failed requests and 429 and 5xx responses.
+    """
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class RateGovernor:
+    """A token bucket whose rate adapts to the responses of the server.
+
+    Attributes:
+        rate: The current target rate in requests per second.
+        min_rate: The lowest rate in requests per second.
+        max_rate: The highest rate in requests per second.
+        additive_increase: The increase of the rate per second of successful requests.
+        decrease_factor: The factor applied to the rate on overload.
+        latency_tolerance: The factor by which the recent latency may exceed
+            its baseline before the rate is cut.
+        decrease_interval: The minimum number of seconds between two cuts.
+        burst: The number of requests that may be sent at once after an idle period.
+        decreases: The number of times the rate was cut.
+    """
+
+    def __init__(
+        self,
+        initial_rate: float = 5,
+        min_rate: float = 0.5,
+        max_rate: float = 50,
+        additive_increase: float = 0.5,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        decrease_interval: float = 1.0,
+        burst: float = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize the RateGovernor object.
+
+        Args:
+            initial_rate: The rate in requests per second to start at.
+            min_rate: The lowest rate in requests per second.
+            max_rate: The highest rate in requests per second.
+            additive_increase: The increase of the rate per second of successful requests.
+            decrease_factor: The factor applied to the rate on overload.
+            latency_tolerance: The factor by which the recent latency may
+                exceed its baseline before the rate is cut.
+            decrease_interval: The minimum number of seconds between two cuts.
+            burst: The number of requests that may be sent at once after an
+                idle period.
+            clock: The function used to read the current time.
+
+        Raises:
+            ValueError: If the rates are not positive or out of order.
+        """
+        if not 0 < min_rate <= initial_rate <= max_rate:
+            raise ValueError('The rates must satisfy 0 < min_rate <= initial_rate <= max_rate')
+
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.decrease_interval = decrease_interval
+        self.burst = burst
+        self.decreases = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        # Start with a full bucket. The tokens go negative when callers have
+        # reserved tokens that are not refilled yet.
+        self._tokens = burst
+        self._refilled_at = clock()
+        self._waiting = 0
+
+        # Recent and baseline latency of the successful responses, or None
+        # before the first one
+        self._latency: float | None = None
+        self._baseline_latency: float | None = None
+        self._decreased_at = float('-inf')
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of callers waiting for a token."""
+        return self._waiting
+
+    def stats(self) -> dict:
+        """Return the current rate, queue depth, latencies and number of cuts."""
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'queue_depth': self._waiting,
+                'latency': self._latency,
+                'baseline_latency': self._baseline_latency,
+                'decreases': self.decreases,
+            }
+
+    def _reserve(self) -> float:
+        """Take a token, reserving one that is not refilled yet if needed.
+
+        Returns:
+            The number of seconds to wait before the token is available.
+        """
+        with self._lock:
+            # Refill the tokens at the current rate, up to the burst size
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+
+            self._waiting += 1
+            return -self._tokens / self.rate
+
+    def _done_waiting(self) -> None:
+        """Remove a caller from the queue once its token is available."""
+        with self._lock:
+            self._waiting -= 1
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        delay = self._reserve()
+        if delay:
+            try:
+                time.sleep(delay)
+            finally:
+                self._done_waiting()
+
+    async def acquire_async(self) -> None:
+        """Wait until a request may be sent, without blocking the event loop."""
+        delay = self._reserve()
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._done_waiting()
+
+    def record(self, latency: float, status_code: int | None) -> None:
+        """Adapt the rate to the outcome of a request.
+
+        Args:
+            latency: The number of seconds until the response arrived.
+            status_code: The HTTP status code, or None if the request failed
+                without a response.
+        """
+        with self._lock:
+            if is_overload(status_code):
+                self._decrease()
+                return
+
+            # Compare the recent latency with its slowly moving baseline
+            if self._latency is None:
+                self._latency = self._baseline_latency = latency
+            else:
+                self._latency += RECENT_LATENCY_SMOOTHING * (latency - self._latency)
+                self._baseline_latency += BASELINE_LATENCY_SMOOTHING * (latency - self._baseline_latency)
+
+            if self._latency > self.latency_tolerance * self._baseline_latency:
+                self._decrease()
+            else:
+                # Grow by additive_increase for every second of requests at the current rate
+                self.rate = min(self.max_rate, self.rate + self.additive_increase / self.rate)
+
+    def _decrease(self) -> None:
+        """Cut the rate, unless it was cut recently. Must be called with the lock held."""
+        now = self._clock()
+        if now - self._decreased_at < self.decrease_interval:
+            return
+
+        self._decreased_at = now
+        self.decreases += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
@@ -0,0 +1,477 @@
+"""Metrics of the API calls and sweeps in the Prometheus text format.
+
+The metrics are kept in memory by small thread-safe counters, gauges and
+histograms, and rendered on demand in the text format that Prometheus
+scrapes. They are exposed on a `/metrics` endpoint, either by the web server
+or by a `MetricsServer` running in a background thread:
+
+- the latency of the requests of every location, as a histogram
+- the responses by status code and the failed requests by exception
+- the retries of every location
+- the duration of every sweep
+- the number of rides in every location
+- the cache lookups by result
+- the added, removed and changed rides
+- the requests, failures and health of every exit of a proxy pool
+- the request rate and queue depth of the rate governors
+- the delivered, dropped and failed notifications of every sink, their
+  latency and the queue depth of every sink
+
+No client library is needed, the format is simple enough to write directly.
+"""
+import contextlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Hashable, Iterable, Iterator
+
+from api.cache import ResponseCache
+
+# The content type of the Prometheus text format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# The upper bounds in seconds of the request latency buckets
+REQUEST_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# The upper bounds in seconds of the sweep duration buckets
+SWEEP_DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# The upper bounds in seconds of the notification latency buckets
+NOTIFICATION_LATENCY_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# A sample of a metric: the name suffix, the label names and values, and the value
+Sample = tuple[str, tuple[tuple[str, str], ...], float]
+
+
+def escape_label_value(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_value(value: float) -> str:
+    """Format a sample value, writing whole numbers without a decimal point."""
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """A metric with one value for every combination of label values.
+
+    Attributes:
+        name: The name of the metric.
+        documentation: The help text of the metric.
+        label_names: The names of the labels of every value.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = ()) -> None:
+        """Initialize the Metric object.
+
+        Args:
+            name: The name of the metric.
+            documentation: The help text of the metric.
+            label_names: The names of the labels of every value.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def _key(self, labels: tuple) -> tuple[str, ...]:
+        """Convert the label values to strings, checking that all are given."""
+        if len(labels) != len(self.label_names):
+            raise ValueError(f'{self.name} takes the labels {self.label_names}, got {labels}')
+        return tuple(map(str, labels))
+
+    def value(self, *labels: Hashable) -> float:
+        """Return the value for a combination of label values."""
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[Sample]:
+        """Iterate over the samples of the metric, in order of their label values."""
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for key, value in values:
+            yield '', tuple(zip(self.label_names, key)), value
+
+    def render(self) -> str:
+        """Render the metric in the Prometheus text format."""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            if labels:
+                label_text = ','.join(f'{name}="{escape_label_value(value)}"' for name, value in labels)
+                lines.append(f'{self.name}{suffix}{{{label_text}}} {format_value(value)}')
+            else:
+                lines.append(f'{self.name}{suffix} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """A value that only goes up, such as the number of requests."""
+
+    type = 'counter'
+
+    def inc(self, *labels: Hashable, amount: float = 1) -> None:
+        """Increase the value for a combination of label values."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, such as the number of rides."""
+
+    type = 'gauge'
+
+    def set(self, value: float, *labels: Hashable) -> None:
+        """Set the value for a combination of label values."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class FunctionCounter(Metric):
+    """A counter whose values are read from a function when rendered.
+
+    Used for counters that are already kept elsewhere, such as the hits of
+    the response cache.
+    """
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str], read: Callable[[], dict[tuple, float]]) -> None:
+        """Initialize the FunctionCounter object.
+
+        Args:
+            name: The name of the metric.
+            documentation: The help text of the metric.
+            label_names: The names of the labels of every value.
+            read: A function returning the value of every combination of label values.
+        """
+        super().__init__(name, documentation, label_names)
+        self._read = read
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, value in sorted(self._read().items()):
+            yield '', tuple(zip(self.label_names, self._key(labels))), value
+
+
+class FunctionGauge(FunctionCounter):
+    """A gauge whose values are read from a function when rendered."""
+
+    type = 'gauge'
+
+
+class Histogram(Metric):
+    """The distribution of observed values, such as the latency of requests.
+
+    Every combination of label values counts its observations in cumulative
+    buckets, and keeps their sum and count.
+
+    Attributes:
+        buckets: The upper bounds of the buckets, in increasing order.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Iterable[str] = (), buckets: Iterable[float] = REQUEST_DURATION_BUCKETS) -> None:
+        """Initialize the Histogram object.
+
+        Args:
+            name: The name of the metric.
+            documentation: The help text of the metric.
+            label_names: The names of the labels of every value.
+            buckets: The upper bounds of the buckets. A bucket for all
+                values is added.
+        """
+        super().__init__(name, documentation, label_names)
+        self.buckets = (*sorted(buckets), float('inf'))
+
+        # The count of every bucket, followed by the sum of the observations
+        self._observations: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: Hashable) -> None:
+        """Record an observation for a combination of label values."""
+        key = self._key(labels)
+        with self._lock:
+            observations = self._observations.get(key)
+            if observations is None:
+                observations = self._observations[key] = [0] * (len(self.buckets) + 1)
+
+            # Only count the observation in its own bucket, the counts are
+            # accumulated when rendered
+            for position, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    observations[position] += 1
+                    break
+            observations[-1] += value
+
+    def value(self, *labels: Hashable) -> float:
+        """Return the number of observations for a combination of label values."""
+        with self._lock:
+            observations = self._observations.get(self._key(labels))
+            return sum(observations[:-1]) if observations else 0
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            observations = sorted((key, list(values)) for key, values in self._observations.items())
+
+        for key, values in observations:
+            labels = tuple(zip(self.label_names, key))
+            count = 0
+            for upper_bound, bucket_count in zip(self.buckets, values):
+                count += bucket_count
+                yield '_bucket', (*labels, ('le', format_value(upper_bound))), count
+            yield '_sum', labels, values[-1]
+            yield '_count', labels, count
+
+
+class Metrics:
+    """The metrics of the script, shared by the API clients, sweeps and modes.
+
+    Attributes:
+        request_duration: The latency of the requests of every location.
+        responses: The responses by HTTP status code.
+        request_errors: The failed requests of every location by exception.
+        retries: The retried requests of every location.
+        sweep_duration: The duration of the sweeps over all locations.
+        rides: The number of rides in every location.
+        diff_events: The added, removed and changed rides.
+        notifications: The notifications of every sink by result.
+        notification_latency: The time from finding a change to delivering
+            its notification, for every sink.
+    """
+
+    def __init__(self) -> None:
+        """Create the metrics."""
+        self.request_duration = Histogram(
+            'trafikverket_request_duration_seconds',
+            'Latency of the requests for the rides of a location.',
+            ('location_id', 'examination_type_id'),
+            buckets=REQUEST_DURATION_BUCKETS,
+        )
+        self.responses = Counter(
+            'trafikverket_responses_total',
+            'Responses from the server by HTTP status code.',
+            ('status_code',),
+        )
+        self.request_errors = Counter(
+            'trafikverket_request_errors_total',
+            'Failed requests for the rides of a location by exception.',
+            ('location_id', 'examination_type_id', 'exception'),
+        )
+        self.retries = Counter(
+            'trafikverket_retries_total',
+            'Retried requests for the rides of a location.',
+            ('location_id', 'examination_type_id'),
+        )
+        self.sweep_duration = Histogram(
+            'trafikverket_sweep_duration_seconds',
+            'Duration of the sweeps over all locations.',
+            buckets=SWEEP_DURATION_BUCKETS,
+        )
+        self.rides = Gauge(
+            'trafikverket_rides',
+            'Number of available rides in a location when it was last requested.',
+            ('location_id', 'examination_type_id'),
+        )
+        self.diff_events = Counter(
+            'trafikverket_diff_events_total',
+            'Rides that were added, removed or changed.',
+            ('examination_type_id', 'type'),
+        )
+        self.notifications = Counter(
+            'trafikverket_notifications_total',
+            'Notifications of a sink by result: delivered, dropped or failed.',
+            ('sink', 'result'),
+        )
+        self.notification_latency = Histogram(
+            'trafikverket_notification_latency_seconds',
+            'Time from finding a change to delivering its notification.',
+            ('sink',),
+            buckets=NOTIFICATION_LATENCY_BUCKETS,
+        )
+        self._metrics: list[Metric] = [
+            self.request_duration,
+            self.responses,
+            self.request_errors,
+            self.retries,
+            self.sweep_duration,
+            self.rides,
+            self.diff_events,
+            self.notifications,
+            self.notification_latency,
+        ]
+
+    def register(self, metric: Metric) -> None:
+        """Add a metric to the rendered metrics."""
+        self._metrics.append(metric)
+
+    def watch_cache(self, cache: ResponseCache) -> None:
+        """Expose the lookup counters of a response cache.
+
+        Args:
+            cache: The response cache.
+        """
+        self.register(FunctionCounter(
+            'trafikverket_cache_lookups_total',
+            'Lookups of the response cache by result.',
+            ('result',),
+            lambda: {(result,): count for result, count in cache.stats().items()},
+        ))
+
+    def watch_proxy_pool(self, read_stats: Callable[[], dict[str, dict]]) -> None:
+        """Expose the counters and health of the exits of a proxy pool.
+
+        Args:
+            read_stats: A function returning the stats of every exit, such
+                as `ProxyPool.stats`.
+        """
+        def read(field: str) -> Callable[[], dict[tuple, float]]:
+            return lambda: {(name,): stats[field] for name, stats in read_stats().items()}
+
+        self.register(FunctionCounter(
+            'trafikverket_proxy_requests_total', 'Requests sent through an exit of the proxy pool.',
+            ('exit',), read('requests'),
+        ))
+        self.register(FunctionCounter(
+            'trafikverket_proxy_failures_total', 'Failed requests sent through an exit of the proxy pool.',
+            ('exit',), read('failures'),
+        ))
+        self.register(FunctionCounter(
+            'trafikverket_proxy_ejections_total', 'Times an exit of the proxy pool was ejected.',
+            ('exit',), read('ejections'),
+        ))
+        self.register(FunctionGauge(
+            'trafikverket_proxy_healthy', 'Whether an exit of the proxy pool is admitted.',
+            ('exit',), read('healthy'),
+        ))
+        self.register(FunctionGauge(
+            'trafikverket_proxy_latency_seconds', 'Average latency of the recent requests through an exit.',
+            ('exit',), read('latency'),
+        ))
+
+    def watch_governors(self, read_stats: Callable[[], dict[str, dict]]) -> None:
+        """Expose the rate and queue depth of the rate governors.
+
+        Args:
+            read_stats: A function returning the stats of the governor of
+                every exit, such as `RateGovernor.stats`, by exit name.
+        """
+        def read(field: str) -> Callable[[], dict[tuple, float]]:
+            return lambda: {(name,): stats[field] for name, stats in read_stats().items()}
+
+        self.register(FunctionGauge(
+            'trafikverket_governor_rate', 'Target request rate of the rate governor in requests per second.',
+            ('exit',), read('rate'),
+        ))
+        self.register(FunctionGauge(
+            'trafikverket_governor_queue_depth', 'Requests waiting for the rate governor.',
+            ('exit',), read('queue_depth'),
+        ))
+        self.register(FunctionCounter(
+            'trafikverket_governor_decreases_total', 'Times the rate governor cut the request rate.',
+            ('exit',), read('decreases'),
+        ))
+
+    def watch_notifier(self, read_stats: Callable[[], dict[str, dict]]) -> None:
+        """Expose the queue depth of the notification sinks.
+
+        Args:
+            read_stats: A function returning the stats of every sink by name,
+                such as `Notifier.stats`.
+        """
+        self.register(FunctionGauge(
+            'trafikverket_notification_queue_depth', 'Notifications waiting to be delivered to a sink.',
+            ('sink',), lambda: {(name,): stats['queue_depth'] for name, stats in read_stats().items()},
+        ))
+
+    @contextlib.contextmanager
+    def track_request(self, location_id: int, examination_type_id: int) -> Iterator[None]:
+        """Measure the latency of a request, and count it if it fails.
+
+        Args:
+            location_id: The ID of the requested location.
+            examination_type_id: The requested examination type.
+        """
+        start_time = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.request_errors.inc(location_id, examination_type_id, type(e).__name__)
+            raise
+        finally:
+            self.request_duration.observe(time.perf_counter() - start_time, location_id, examination_type_id)
+
+    def record_events(self, events: Iterable, examination_type_id: int) -> None:
+        """Count the change events of a location.
+
+        Args:
+            events: The `RideEvent` objects of the location.
+            examination_type_id: The examination type of the location.
+        """
+        for event in events:
+            self.diff_events.inc(examination_type_id, event.type.value)
+
+    def render(self) -> bytes:
+        """Render all metrics in the Prometheus text format."""
+        return ''.join(metric.render() for metric in self._metrics).encode()
+
+
+class MetricsServer:
+    """Serve the metrics on `/metrics` from a background thread.
+
+    Used by the modes that do not run the web server, so that the metrics
+    can be scraped while sweeping or polling.
+    """
+
+    def __init__(self, metrics: Metrics, host: str, port: int) -> None:
+        """Initialize the MetricsServer object.
+
+        Args:
+            metrics: The metrics to serve.
+            host: The address to listen on.
+            port: The port to listen on.
+        """
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = metrics.render()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                # Skip the access log, the endpoint is scraped continuously
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """The address and port the server listens on."""
+        return self._server.server_address[:2]
+
+    def start(self) -> None:
+        """Start serving in the background."""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,420 @@
+"""A pool of proxies with per-exit sessions and health tracking.
+
+Every exit of the pool (a proxy, or the direct connection) has its own API
+client, so its own session, connection pool and cookie jar. The requests
+for the locations are spread over the healthy exits: every request goes to
+the exit with the lowest expected completion time, the number of its
+requests in flight times its average latency. A rate limit on one exit
+therefore no longer caps the throughput of the whole sweep.
+
+Every exit keeps track of its latency and error rate. An exit is ejected
+after a number of consecutive failures, or when its error rate gets too
+high, and is left alone for a cooldown. After the cooldown a single trial
+request is sent through it: if it succeeds the exit is admitted again,
+otherwise it is ejected for another cooldown. If every exit is ejected, the
+one whose cooldown ends first is used anyway, so a sweep never stalls.
+
+The pools have the same `get_available_dates` and `get_available_dates_batch`
+methods as the API clients, so the sweeps can use them in place of a single
+client.
+"""
+import threading
+import time
+from typing import Callable
+
+from api import exceptions
+from api.cache import ResponseCache
+from api.trafikverket import TrafikverketAPI, select_dates
+
+# The weight of the latest request in the average latency and error rate
+LATENCY_SMOOTHING = 0.2
+ERROR_RATE_SMOOTHING = 0.1
+
+# The assumed latency in seconds of an exit that has not answered yet
+INITIAL_LATENCY = 1.0
+
+
+def is_exit_failure(error: Exception) -> bool:
+    """Check whether a failed request counts against the health of its exit.
+
+    Args:
+        error: The error raised by the request.
+
+    Returns:
+        False if the server rejected the query itself, which would have
+        happened through any exit, True otherwise.
+    """
+    return not isinstance(error, (exceptions.PayloadStatus, exceptions.BatchRejected))
+
+
+class ProxyExit:
+    """A proxy or direct connection with its own API client and health.
+
+    Attributes:
+        name: The name of the exit, for example 'http://10.0.0.1:3128'.
+        api: The API client sending the requests through the exit.
+        in_flight: The number of requests in flight.
+        latency: The average latency in seconds of the recent requests.
+        error_rate: The share of failed requests among the recent ones.
+        requests: The number of requests since the exit was admitted.
+        consecutive_failures: The number of failed requests in a row.
+        ejected_until: The time until which the exit is ejected, or None
+            if it is healthy.
+        total_requests: The number of requests sent through the exit.
+        total_failures: The number of failed requests.
+        ejections: The number of times the exit was ejected.
+    """
+
+    def __init__(self, name: str, api: TrafikverketAPI) -> None:
+        """Initialize the ProxyExit object.
+
+        Args:
+            name: The name of the exit.
+            api: The API client sending the requests through the exit, an
+                `AsyncTrafikverketAPI` for an `AsyncProxyPool`. It should not
+                have a cache, the pool has one for all exits.
+        """
+        self.name = name
+        self.api = api
+        self.in_flight = 0
+        self.latency = INITIAL_LATENCY
+        self.error_rate = 0.0
+        self.requests = 0
+        self.consecutive_failures = 0
+        self.ejected_until: float | None = None
+        self.total_requests = 0
+        self.total_failures = 0
+        self.ejections = 0
+
+    @property
+    def healthy(self) -> bool:
+        """Whether the exit is admitted."""
+        return self.ejected_until is None
+
+    def stats(self) -> dict:
+        """Return the health and counters of the exit."""
+        return {
+            'healthy': self.healthy,
+            'in_flight': self.in_flight,
+            'latency': self.latency,
+            'error_rate': self.error_rate,
+            'requests': self.total_requests,
+            'failures': self.total_failures,
+            'ejections': self.ejections,
+        }
+
+
+class ProxyPool:
+    """Spread the requests over the healthy exits of a pool.
+
+    Attributes:
+        exits: The exits of the pool.
+        cache: The optional cache shared by all exits.
+        examination_type_id: The examination type queried by default.
+        failure_threshold: The number of consecutive failures that eject an exit.
+        max_error_rate: The error rate above which an exit is ejected.
+        min_requests: The number of requests an exit must have answered
+            since it was admitted before its error rate is considered.
+        cooldown: The number of seconds an exit stays ejected.
+        batching: Whether several locations may be queried in one request.
+    """
+
+    def __init__(
+        self,
+        exits: list[ProxyExit],
+        cache: ResponseCache = None,
+        examination_type_id: int = 12,
+        failure_threshold: int = 3,
+        max_error_rate: float = 0.5,
+        min_requests: int = 10,
+        cooldown: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize the ProxyPool object.
+
+        Args:
+            exits: The exits of the pool.
+            cache: An optional cache shared by all exits, in front of the pool.
+            examination_type_id: The examination type queried by default.
+            failure_threshold: The number of consecutive failures that eject an exit.
+            max_error_rate: The error rate above which an exit is ejected.
+            min_requests: The number of requests an exit must have answered
+                since it was admitted before its error rate is considered.
+            cooldown: The number of seconds an exit stays ejected.
+            clock: The function used to read the current time.
+
+        Raises:
+            ValueError: If there are no exits.
+        """
+        if not exits:
+            raise ValueError('A proxy pool needs at least one exit')
+
+        self.exits = exits
+        self.cache = cache
+        self.examination_type_id = examination_type_id
+        self.failure_threshold = failure_threshold
+        self.max_error_rate = max_error_rate
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.batching = True
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of exits."""
+        return len(self.exits)
+
+    def healthy_exits(self) -> list[ProxyExit]:
+        """Return the exits that are currently admitted."""
+        with self._lock:
+            return [proxy_exit for proxy_exit in self.exits if proxy_exit.healthy]
+
+    def stats(self) -> dict[str, dict]:
+        """Return the health and counters of every exit."""
+        with self._lock:
+            return {proxy_exit.name: proxy_exit.stats() for proxy_exit in self.exits}
+
+    def _acquire(self) -> ProxyExit:
+        """Choose the exit for a request and count the request as in flight."""
+        with self._lock:
+            now = self._clock()
+
+            # Healthy exits, and ejected exits whose cooldown has passed and
+            # that are not already running their trial request
+            candidates = [
+                proxy_exit for proxy_exit in self.exits
+                if proxy_exit.healthy or (proxy_exit.ejected_until <= now and not proxy_exit.in_flight)
+            ]
+
+            if candidates:
+                # Pick the exit that is expected to answer first
+                chosen = min(candidates, key=lambda proxy_exit: (proxy_exit.in_flight + 1) * proxy_exit.latency)
+            else:
+                # Every exit is ejected, use the one that will be readmitted first
+                chosen = min(self.exits, key=lambda proxy_exit: proxy_exit.ejected_until)
+
+            chosen.in_flight += 1
+            return chosen
+
+    def _release(self, proxy_exit: ProxyExit, latency: float, error: Exception | None) -> None:
+        """Record the outcome of a request, ejecting or readmitting its exit.
+
+        Args:
+            proxy_exit: The exit of the request.
+            latency: The number of seconds the request took.
+            error: The error raised by the request, or None if it succeeded.
+        """
+        failed = error is not None and is_exit_failure(error)
+
+        with self._lock:
+            proxy_exit.in_flight -= 1
+            proxy_exit.total_requests += 1
+
+            if not failed:
+                if not proxy_exit.healthy:
+                    # The trial request succeeded, admit the exit with a clean slate
+                    proxy_exit.ejected_until = None
+                    proxy_exit.error_rate = 0.0
+                    proxy_exit.requests = 0
+
+                proxy_exit.requests += 1
+                proxy_exit.consecutive_failures = 0
+                proxy_exit.latency += LATENCY_SMOOTHING * (latency - proxy_exit.latency)
+                proxy_exit.error_rate *= 1 - ERROR_RATE_SMOOTHING
+                return
+
+            proxy_exit.requests += 1
+            proxy_exit.total_failures += 1
+            proxy_exit.consecutive_failures += 1
+            proxy_exit.error_rate += ERROR_RATE_SMOOTHING * (1 - proxy_exit.error_rate)
+
+            if (
+                not proxy_exit.healthy
+                or proxy_exit.consecutive_failures >= self.failure_threshold
+                or (proxy_exit.requests >= self.min_requests and proxy_exit.error_rate > self.max_error_rate)
+            ):
+                if proxy_exit.healthy:
+                    proxy_exit.ejections += 1
+                proxy_exit.ejected_until = self._clock() + self.cooldown
+
+    def _cancel(self, proxy_exit: ProxyExit) -> None:
+        """Forget a cancelled request, which says nothing about the health of its exit."""
+        with self._lock:
+            proxy_exit.in_flight -= 1
+
+    def get_available_dates(
+        self,
+        location_id: int,
+        extended_information: bool = False,
+        examination_type_id: int = None,
+        starting_date: str = None,
+        searched_months: int = None,
+    ) -> list[dict] | list[str]:
+        """Retrieve a list of available dates for the given location through an exit.
+
+        See `TrafikverketAPI.get_available_dates`.
+        """
+        if examination_type_id is None:
+            examination_type_id = self.examination_type_id
+
+        # Look up the bundles in the cache, sharing any request already in flight
+        if self.cache is not None:
+            available_rides = self.cache.get_or_load(
+                (examination_type_id, location_id, starting_date, searched_months),
+                lambda: self._request_bundles(location_id, examination_type_id, starting_date, searched_months),
+            )
+        else:
+            available_rides = self._request_bundles(location_id, examination_type_id, starting_date, searched_months)
+
+        return select_dates(available_rides, extended_information)
+
+    def _request_bundles(self, location_id: int, examination_type_id: int, starting_date: str = None, searched_months: int = None) -> list[dict]:
+        """Request the bundles of a location through the best exit."""
+        proxy_exit = self._acquire()
+        start_time = time.perf_counter()
+        try:
+            bundles = proxy_exit.api.get_available_dates(
+                location_id,
+                extended_information=True,
+                examination_type_id=examination_type_id,
+                starting_date=starting_date,
+                searched_months=searched_months,
+            )
+        except Exception as e:
+            self._release(proxy_exit, time.perf_counter() - start_time, e)
+            raise
+
+        self._release(proxy_exit, time.perf_counter() - start_time, None)
+        return bundles
+
+    def get_available_dates_batch(
+        self,
+        location_ids: list[int],
+        extended_information: bool = False,
+        examination_type_id: int = None,
+    ) -> dict[int, list[dict] | list[str]]:
+        """Retrieve the available dates for several locations in one request through an exit.
+
+        See `TrafikverketAPI.get_available_dates_batch`.
+        """
+        if examination_type_id is None:
+            examination_type_id = self.examination_type_id
+
+        proxy_exit = self._acquire()
+        start_time = time.perf_counter()
+        try:
+            dates = proxy_exit.api.get_available_dates_batch(location_ids, extended_information, examination_type_id)
+        except Exception as e:
+            self._release(proxy_exit, time.perf_counter() - start_time, e)
+            raise
+
+        self._release(proxy_exit, time.perf_counter() - start_time, None)
+        return dates
+
+
+class AsyncProxyPool(ProxyPool):
+    """The asyncio counterpart of `ProxyPool`, with an `AsyncTrafikverketAPI` per exit.
+
+    The sessions of the exits must be opened with `open` or by using the pool
+    as an async context manager.
+    """
+
+    async def __aenter__(self) -> 'AsyncProxyPool':
+        """Open the sessions of all exits."""
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        """Close the sessions of all exits."""
+        await self.close()
+
+    async def open(self) -> None:
+        """Open the sessions of all exits."""
+        for proxy_exit in self.exits:
+            await proxy_exit.api.open()
+
+    async def close(self) -> None:
+        """Close the sessions of all exits."""
+        for proxy_exit in self.exits:
+            await proxy_exit.api.close()
+
+    async def get_available_dates(
+        self,
+        location_id: int,
+        extended_information: bool = False,
+        examination_type_id: int = None,
+        starting_date: str = None,
+        searched_months: int = None,
+    ) -> list[dict] | list[str]:
+        """Retrieve a list of available dates for the given location through an exit.
+
+        See `TrafikverketAPI.get_available_dates`.
+        """
+        if examination_type_id is None:
+            examination_type_id = self.examination_type_id
+
+        # Look up the bundles in the cache, sharing any request already in flight
+        if self.cache is not None:
+            available_rides = await self.cache.get_or_load_async(
+                (examination_type_id, location_id, starting_date, searched_months),
+                lambda: self._request_bundles(location_id, examination_type_id, starting_date, searched_months),
+            )
+        else:
+            available_rides = await self._request_bundles(location_id, examination_type_id, starting_date, searched_months)
+
+        return select_dates(available_rides, extended_information)
+
+    async def _request_bundles(
+        self,
+        location_id: int,
+        examination_type_id: int,
+        starting_date: str = None,
+        searched_months: int = None,
+    ) -> list[dict]:
+        """Request the bundles of a location through the best exit."""
+        proxy_exit = self._acquire()
+        start_time = time.perf_counter()
+        try:
+            bundles = await proxy_exit.api.get_available_dates(
+                location_id,
+                extended_information=True,
+                examination_type_id=examination_type_id,
+                starting_date=starting_date,
+                searched_months=searched_months,
+            )
+        except Exception as e:
+            self._release(proxy_exit, time.perf_counter() - start_time, e)
+            raise
+        except BaseException:
+            self._cancel(proxy_exit)
+            raise
+
+        self._release(proxy_exit, time.perf_counter() - start_time, None)
+        return bundles
+
+    async def get_available_dates_batch(
+        self,
+        location_ids: list[int],
+        extended_information: bool = False,
+        examination_type_id: int = None,
+    ) -> dict[int, list[dict] | list[str]]:
+        """Retrieve the available dates for several locations in one request through an exit.
+
+        See `TrafikverketAPI.get_available_dates_batch`.
+        """
+        if examination_type_id is None:
+            examination_type_id = self.examination_type_id
+
+        proxy_exit = self._acquire()
+        start_time = time.perf_counter()
+        try:
+            dates = await proxy_exit.api.get_available_dates_batch(location_ids, extended_information, examination_type_id)
+        except Exception as e:
+            self._release(proxy_exit, time.perf_counter() - start_time, e)
+            raise
+        except BaseException:
+            self._cancel(proxy_exit)
+            raise
+
+        self._release(proxy_exit, time.perf_counter() - start_time, None)
+        return dates
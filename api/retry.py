@@ -0,0 +1,244 @@
+"""Retry policy and circuit breaker for the API calls.
+
+A `RetryPolicy` retries a failed call with exponential backoff and full
+jitter, but only if the error is worth retrying: timeouts, connection errors,
+5xx and 429 responses. Other 4xx responses and payloads with an unexpected
+status are treated as fatal and raised immediately.
+
+An optional `CircuitBreaker` keeps track of the calls for each key (usually a
+location ID). After a number of consecutive failed calls the circuit opens
+and further calls for that key are skipped until a cooldown has passed.
+"""
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+import requests
+
+from api import exceptions
+
+# Errors that are handled by the retry policy of the synchronous client
+REQUEST_ERRORS = (exceptions.HTTPStatus, requests.exceptions.RequestException)
+
+# Errors worth retrying for the synchronous client, besides 5xx and 429 responses
+RETRYABLE_ERRORS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError)
+
+
+class CircuitBreaker:
+    """A per-key circuit breaker.
+
+    A circuit opens after `failure_threshold` consecutive failed calls. While
+    it is open, calls are rejected. Once the cooldown has passed, a single
+    trial call is let through: if it succeeds the circuit closes, otherwise
+    it opens again for another cooldown.
+
+    Attributes:
+        failure_threshold: The number of consecutive failures that open a circuit.
+        cooldown: The number of seconds a circuit stays open.
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 600, clock: Callable[[], float] = time.monotonic) -> None:
+        """Initialize the CircuitBreaker object.
+
+        Args:
+            failure_threshold: The number of consecutive failures that open a circuit.
+            cooldown: The number of seconds a circuit stays open.
+            clock: The function used to read the current time.
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        # Consecutive failures and the time the circuit opened, for each key
+        self._failures: dict[Hashable, int] = {}
+        self._opened_at: dict[Hashable, float] = {}
+
+    def check(self, key: Hashable) -> None:
+        """Make sure a call for the key may be made.
+
+        Args:
+            key: The key of the circuit.
+
+        Raises:
+            CircuitOpen: If the circuit of the key is open.
+        """
+        with self._lock:
+            if key not in self._opened_at:
+                return
+
+            retry_in = self._opened_at[key] + self.cooldown - self._clock()
+            if retry_in > 0:
+                raise exceptions.CircuitOpen(key, retry_in)
+
+            # Let one trial call through, and keep the others out until it completes
+            self._opened_at[key] = self._clock()
+
+    def record_success(self, key: Hashable) -> None:
+        """Close the circuit of a key after a successful call."""
+        with self._lock:
+            self._failures.pop(key, None)
+            self._opened_at.pop(key, None)
+
+    def record_failure(self, key: Hashable) -> None:
+        """Count a failed call, opening the circuit of the key if needed."""
+        with self._lock:
+            self._failures[key] = self._failures.get(key, 0) + 1
+
+            if self._failures[key] >= self.failure_threshold:
+                self._opened_at[key] = self._clock()
+
+    def open_circuits(self) -> list[Hashable]:
+        """Return the keys whose circuit is currently open or half-open."""
+        with self._lock:
+            return list(self._opened_at)
+
+
+class RetryPolicy:
+    """Retry failed calls with exponential backoff and jitter.
+
+    Attributes:
+        max_attempts: The maximum number of attempts for each call.
+        base_delay: The upper bound in seconds of the delay before the first retry.
+        max_delay: The maximum upper bound in seconds of any delay.
+        breaker: The optional circuit breaker consulted before each call.
+        errors: The exception types handled by the policy. Any other
+            exception is raised immediately and does not count as a failure.
+        retryable_errors: The exception types worth retrying, besides
+            `HTTPStatus` errors for 5xx and 429 responses.
+        on_retry: An optional function called before every retry with the
+            key, the failed attempt number, the delay and the error.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 8,
+        breaker: CircuitBreaker = None,
+        errors: tuple[type[Exception], ...] = REQUEST_ERRORS,
+        retryable_errors: tuple[type[Exception], ...] = RETRYABLE_ERRORS,
+        on_retry: Callable[[Hashable, int, float, Exception], None] = None,
+    ) -> None:
+        """Initialize the RetryPolicy object.
+
+        Args:
+            max_attempts: The maximum number of attempts for each call.
+            base_delay: The upper bound in seconds of the delay before the first retry.
+            max_delay: The maximum upper bound in seconds of any delay.
+            breaker: An optional circuit breaker consulted before each call.
+            errors: The exception types handled by the policy.
+            retryable_errors: The exception types worth retrying.
+            on_retry: An optional function called before every retry.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.errors = errors
+        self.retryable_errors = retryable_errors
+        self.on_retry = on_retry
+
+    def is_retryable(self, error: Exception) -> bool:
+        """Classify an error as retryable or fatal.
+
+        Args:
+            error: The error raised by a call.
+
+        Returns:
+            True if the call should be retried, False if the error is fatal.
+        """
+        # The server understood the query and rejected it
+        if isinstance(error, exceptions.PayloadStatus):
+            return False
+
+        # A maintenance page or a cut-off body is a temporary fault
+        if isinstance(error, exceptions.InvalidPayload):
+            return True
+
+        # Retry when the server is overloaded or rate limiting us
+        if isinstance(error, exceptions.HTTPStatus):
+            return error.status_code == 429 or error.status_code >= 500
+
+        return isinstance(error, self.retryable_errors)
+
+    def backoff(self, attempt: int) -> float:
+        """Return the delay before retrying after a failed attempt.
+
+        Args:
+            attempt: The number of the failed attempt, starting at 1.
+
+        Returns:
+            A random delay in seconds between zero and the exponential bound.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _handle_error(self, key: Hashable, attempt: int, error: Exception) -> float:
+        """Decide what to do with a failed attempt.
+
+        Returns:
+            The delay before the next attempt.
+
+        Raises:
+            Exception: The error itself if it should not be retried.
+        """
+        if not self.is_retryable(error) or attempt == self.max_attempts:
+            # Give up without waiting, the call has failed
+            if self.breaker is not None:
+                self.breaker.record_failure(key)
+            raise error
+
+        delay = self.backoff(attempt)
+        if self.on_retry is not None:
+            self.on_retry(key, attempt, delay, error)
+
+        return delay
+
+    def call(self, func: Callable[..., Any], *args, key: Hashable = None, **kwargs) -> Any:
+        """Call a function, retrying it according to the policy.
+
+        Args:
+            func: The function to call.
+            *args: The positional arguments for the function.
+            key: The key of the circuit breaker for this call.
+            **kwargs: The keyword arguments for the function.
+
+        Returns:
+            The return value of the function.
+
+        Raises:
+            CircuitOpen: If the circuit of the key is open.
+            Exception: The last error if the call failed.
+        """
+        if self.breaker is not None:
+            self.breaker.check(key)
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                result = func(*args, **kwargs)
+            except self.errors as e:
+                time.sleep(self._handle_error(key, attempt, e))
+            else:
+                if self.breaker is not None:
+                    self.breaker.record_success(key)
+                return result
+
+    async def call_async(self, func: Callable[..., Awaitable[Any]], *args, key: Hashable = None, **kwargs) -> Any:
+        """Await a coroutine function, retrying it according to the policy.
+
+        See `call` for a description of the arguments.
+        """
+        if self.breaker is not None:
+            self.breaker.check(key)
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                result = await func(*args, **kwargs)
+            except self.errors as e:
+                await asyncio.sleep(self._handle_error(key, attempt, e))
+            else:
+                if self.breaker is not None:
+                    self.breaker.record_success(key)
+                return result
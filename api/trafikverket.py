@@ -1,5 +1,302 @@
+import time
+
 import requests
-from api import exceptions
+from requests.adapters import HTTPAdapter
+
+from api import codec, exceptions
+from api.cache import ResponseCache
+from api.governor import RateGovernor
+from api.metrics import Metrics
+
+BASE_URL = 'https://fp.trafikverket.se'
+
+
+def create_default_params(
+    ssn: str,
+    licence_id: int = 5,
+    booking_mode_id: int = 0,
+    ignore_debt: bool = False,
+    ignore_booking_hindrance: bool = False,
+    examination_type_id: int = 12,
+    exclude_examination_categories: list = [],
+    reschedule_type_id: int = 0,
+    payment_is_active: bool = False,
+    payment_refrence: str = None,
+    payment_url: str = None,
+    searched_months: int = 0,
+    starting_date: str = "1970-01-01T00:00:00.000Z",
+    nearby_location_ids: list = [],
+    vehicle_type_id: int = 2,
+    tachograph_id: int = 1,
+    occasion_choice_id: int = 1
+) -> dict:
+    """Create the default parameters for the API calls.
+
+    See `TrafikverketAPI.__init__` for a description of the arguments.
+
+    Returns:
+        A dictionary containing the default parameters for the API calls, with
+        no location ID set.
+    """
+    return {
+        "bookingSession": {
+            "socialSecurityNumber": ssn,
+            "licenceId": licence_id,
+            "bookingModeId": booking_mode_id,
+            "ignoreDebt": ignore_debt,
+            "ignoreBookingHindrance": ignore_booking_hindrance,
+            "examinationTypeId": examination_type_id,
+            "excludeExaminationCategories": exclude_examination_categories,
+            "rescheduleTypeId": reschedule_type_id,
+            "paymentIsActive": payment_is_active,
+            "paymentReference": payment_refrence,
+            "paymentUrl": payment_url,
+            "searchedMonths": searched_months
+        },
+        "occasionBundleQuery": {
+            "startDate": starting_date,
+            "searchedMonths": searched_months,
+            "locationId": None,
+            "nearbyLocationIds": nearby_location_ids,
+            "vehicleTypeId": vehicle_type_id,
+            "tachographTypeId": tachograph_id,
+            "occasionChoiceId": occasion_choice_id,
+            "examinationTypeId": examination_type_id
+        }
+    }
+
+
+def create_headers(useragent: str) -> dict:
+    """Create the headers sent with every API call.
+
+    Args:
+        useragent: A string containing the user agent for the session.
+
+    Returns:
+        A dictionary containing the headers.
+    """
+    return {
+        'Host': 'fp.trafikverket.se',
+        'Connection': 'keep-alive',
+        'Content-Length': '0',
+        'Accept': 'application/json, text/javascript, */*; q=0.01',
+        'X-Requested-With': 'XMLHttpRequest',
+        'User-Agent': useragent,
+        'Content-Type': 'application/json',
+        'Origin': 'https://fp.trafikverket.se',
+        'Sec-Fetch-Site': 'same-origin',
+        'Sec-Fetch-Mode': 'cors',
+        'Sec-Fetch-Dest': 'empty',
+        'Referer': 'https://fp.trafikverket.se/Boka/',
+        'Accept-Encoding': 'gzip, deflate',
+        'Accept-Language': 'en-US,en;q=0.9',
+    }
+
+
+def create_request_params(
+    default_params: dict,
+    location_id: int,
+    examination_type_id: int = None,
+    nearby_location_ids: list[int] = None,
+    starting_date: str = None,
+    searched_months: int = None,
+) -> dict:
+    """Create the parameters for a request for a location.
+
+    The default parameters are copied rather than updated in place, so that
+    concurrent calls never share state.
+
+    Args:
+        default_params: The default parameters for the API calls.
+        location_id: The ID of the location to query.
+        examination_type_id: The examination type to query. Defaults to the
+            one in the default parameters.
+        nearby_location_ids: The IDs of other locations to query in the same
+            request. Defaults to the ones in the default parameters.
+        starting_date: The first date to query, in the format
+            "YYYY-MM-DDTHH:MM:SS.000Z". Defaults to the one in the default parameters.
+        searched_months: The number of months to query from the starting
+            date, 0 for all. Defaults to the one in the default parameters.
+
+    Returns:
+        A dictionary containing the parameters for the request.
+    """
+    params = {
+        **default_params,
+        'occasionBundleQuery': {
+            **default_params['occasionBundleQuery'],
+            'locationId': location_id,
+        },
+    }
+
+    if nearby_location_ids:
+        params['occasionBundleQuery']['nearbyLocationIds'] = list(nearby_location_ids)
+
+    if examination_type_id is not None:
+        params['bookingSession'] = {
+            **default_params['bookingSession'],
+            'examinationTypeId': examination_type_id,
+        }
+        params['occasionBundleQuery']['examinationTypeId'] = examination_type_id
+
+    # Only ask for the rides within a date window
+    if starting_date is not None:
+        params['occasionBundleQuery']['startDate'] = starting_date
+    if searched_months is not None:
+        params['bookingSession'] = {
+            **params['bookingSession'],
+            'searchedMonths': searched_months,
+        }
+        params['occasionBundleQuery']['searchedMonths'] = searched_months
+
+    return params
+
+
+def create_request_body(
+    default_params: dict,
+    templates: dict[tuple, codec.RequestTemplate],
+    location_id: int,
+    examination_type_id: int = None,
+    nearby_location_ids: list[int] = None,
+    starting_date: str = None,
+    searched_months: int = None,
+) -> bytes:
+    """Serialize the parameters for a request for a location.
+
+    The parameters of a single location only differ in the location ID, so
+    they are serialized once per examination type and date window into a
+    template that the location ID is spliced into. Batched queries are
+    serialized in full, since their nearby locations differ every time.
+
+    Args:
+        default_params: The default parameters for the API calls.
+        templates: The templates serialized so far, updated in place.
+        location_id: See `create_request_params`.
+        examination_type_id: See `create_request_params`.
+        nearby_location_ids: See `create_request_params`.
+        starting_date: See `create_request_params`.
+        searched_months: See `create_request_params`.
+
+    Returns:
+        The JSON body of the request.
+    """
+    if nearby_location_ids:
+        return codec.dumps(create_request_params(
+            default_params, location_id, examination_type_id, nearby_location_ids, starting_date, searched_months
+        ))
+
+    key = (examination_type_id, starting_date, searched_months)
+    template = templates.get(key)
+    if template is None:
+        template = templates[key] = codec.RequestTemplate(create_request_params(
+            default_params, codec.PLACEHOLDER_LOCATION_ID, examination_type_id,
+            starting_date=starting_date, searched_months=searched_months,
+        ))
+
+    return template.render(location_id)
+
+
+def decode_payload(status_code: int, content: bytes) -> dict | None:
+    """Decode the JSON body of a response from the server.
+
+    Args:
+        status_code: The HTTP status code of the response.
+        content: The body of the response.
+
+    Returns:
+        The decoded body, or None if the response was not successful.
+
+    Raises:
+        InvalidPayload: If the body of a successful response is not valid
+            JSON, for example a maintenance page.
+    """
+    if status_code != 200:
+        return None
+
+    try:
+        return codec.loads(content)
+    except ValueError as e:
+        raise exceptions.InvalidPayload(status_code, e) from e
+
+
+def parse_bundles(status_code: int, response_data: dict | None) -> list[dict]:
+    """Extract the bundles from a response from the server.
+
+    Args:
+        status_code: The HTTP status code of the response.
+        response_data: The decoded JSON body of the response, or None if the
+            response was not successful.
+
+    Returns:
+        The list of bundle dictionaries in the response.
+
+    Raises:
+        HTTPStatus: If the server returned an unexpected response code.
+        PayloadStatus: If the payload contained an unexpected status.
+    """
+    if status_code != 200 or response_data is None:
+        raise exceptions.HTTPStatus(status_code)
+    if response_data['status'] != 200:
+        raise exceptions.PayloadStatus(status_code, response_data['status'])
+
+    # Extract data from response
+    return response_data['data']['bundles']
+
+
+def is_batch_rejection(error: exceptions.HTTPStatus) -> bool:
+    """Check whether the error of a batched query means the server refused the batch.
+
+    Args:
+        error: The error raised for the batched query.
+
+    Returns:
+        True if the server rejected the query, False if the error is
+        temporary, such as a 429 or 5xx response.
+    """
+    if isinstance(error, exceptions.PayloadStatus):
+        return True
+    return 400 <= error.status_code < 500 and error.status_code != 429
+
+
+def split_bundles(bundles: list[dict], location_ids: list[int]) -> dict[int, list[dict]]:
+    """Split the bundles of a batched query by location.
+
+    Every bundle belongs to the location of its occasions, identified by
+    their `locationId`. Bundles of locations that were not queried are dropped.
+
+    Args:
+        bundles: The bundles in the response.
+        location_ids: The IDs of the queried locations.
+
+    Returns:
+        The bundles of every queried location, an empty list for the
+        locations without any.
+    """
+    bundles_by_location = {location_id: [] for location_id in location_ids}
+    for bundle in bundles:
+        location_bundles = bundles_by_location.get(bundle['occasions'][0]['locationId'])
+        if location_bundles is not None:
+            location_bundles.append(bundle)
+
+    return bundles_by_location
+
+
+def select_dates(available_rides: list[dict], extended_information: bool) -> list[dict] | list[str]:
+    """Return the bundles or only their dates.
+
+    Args:
+        available_rides: The list of bundle dictionaries.
+        extended_information: See `TrafikverketAPI.get_available_dates`.
+
+    Returns:
+        See `TrafikverketAPI.get_available_dates`.
+    """
+    # Return the dates found or the full list of available rides,
+    # depending on the value of the extended_information flag.
+    if extended_information:
+        return available_rides
+    else:
+        return [ride['occasions'][0]['date'] for ride in available_rides]
 
 
 class TrafikverketAPI:
@@ -13,6 +310,12 @@ class TrafikverketAPI:
         proxy: A dictionary containing the proxy settings for the session.
         session: A `requests.Session` object for making API calls.
         default_params: A dictionary containing the default parameters for the API calls.
+        base_url: The URL of the server to send the API calls to.
+        cache: The optional cache of the bundles of each location.
+        metrics: The metrics of the requests.
+        governor: The optional governor pacing the requests.
+        batching: Whether several locations may be queried in one request.
+            Turned off once the server is known to reject batched queries.
 
     """
 
@@ -37,7 +340,12 @@ class TrafikverketAPI:
         nearby_location_ids: list = [],
         vehicle_type_id: int = 2,
         tachograph_id: int = 1,
-        occasion_choice_id: int = 1
+        occasion_choice_id: int = 1,
+        pool_maxsize: int = 10,
+        base_url: str = BASE_URL,
+        cache: ResponseCache = None,
+        metrics: Metrics = None,
+        governor: RateGovernor = None
     ) -> None:
         """
         Initialize a TrafikverketAPI object.
@@ -51,7 +359,7 @@ class TrafikverketAPI:
             booking_mode_id: An integer specifying the booking mode ID. Defaults to 0.
             ignore_debt: A boolean indicating whether to ignore any outstanding debts. Defaults to False.
             ignore_booking_hindrance: A boolean indicating whether to ignore any booking hindrances. Defaults to False.
-            examination_type_id: An integer specifying the examination type ID. Defaults to 12.
+            examination_type_id: An integer specifying the default examination type ID. Defaults to 12.
             exclude_examination_categories: A list of integers specifying the examination categories to exclude. Defaults to an empty list.
             reschedule_type_id: An integer specifying the reschedule type ID. Defaults to 0.
             payment_is_active: A boolean indicating whether payment is active. Defaults to False.
@@ -63,64 +371,83 @@ class TrafikverketAPI:
             vehicle_type_id: An integer specifying the vehicle type ID. Defaults to 2.
             tachograph_id: An integer specifying the tachograph type ID. Defaults to 1.
             occasion_choice_id: An integer specifying the occasion choice ID. Defaults to 1.
+            pool_maxsize: The number of connections to keep open to the server.
+                Should be at least the number of threads sharing this object. Defaults to 10.
+            base_url: The URL of the server to send the API calls to. Defaults to the
+                Trafikverket server, but can point to a local stand-in server.
+            cache: An optional cache shared by all calls for the same examination
+                type and location. Defaults to None, which sends every call to the server.
+            metrics: The metrics recording the latency, status and rides of every
+                request. Defaults to a new Metrics object.
+            governor: An optional governor shared by all calls, adapting the
+                request rate to the responses of the server. Defaults to None,
+                which sends every call as soon as it is made.
         """
 
         # Set the proxy settings
         self.proxy = proxy
 
+        # Set the server to send the API calls to
+        self.base_url = base_url
+
+        # Set the optional response cache
+        self.cache = cache
+
+        # Record the metrics of the requests
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        # Set the optional request pacing
+        self.governor = governor
+
+        # Query several locations at once until the server rejects it
+        self.batching = True
+
         # Create a new session
         self.session = requests.session()
 
+        # Keep enough pooled connections for every thread sharing the session
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
         # Set the default parameters for the API calls
-        self.default_params = {
-            "bookingSession": {
-                "socialSecurityNumber": ssn,
-                "licenceId": licence_id,
-                "bookingModeId": booking_mode_id,
-                "ignoreDebt": ignore_debt,
-                "ignoreBookingHindrance": ignore_booking_hindrance,
-                "examinationTypeId": examination_type_id,
-                "excludeExaminationCategories": exclude_examination_categories,
-                "rescheduleTypeId": reschedule_type_id,
-                "paymentIsActive": payment_is_active,
-                "paymentReference": payment_refrence,
-                "paymentUrl": payment_url,
-                "searchedMonths": searched_months
-            },
-            "occasionBundleQuery": {
-                "startDate": starting_date,
-                "searchedMonths": searched_months,
-                "locationId": None,
-                "nearbyLocationIds": nearby_location_ids,
-                "vehicleTypeId": vehicle_type_id,
-                "tachographTypeId": tachograph_id,
-                "occasionChoiceId": occasion_choice_id,
-                "examinationTypeId": examination_type_id
-            }
-        }
+        self.default_params = create_default_params(
+            ssn=ssn,
+            licence_id=licence_id,
+            booking_mode_id=booking_mode_id,
+            ignore_debt=ignore_debt,
+            ignore_booking_hindrance=ignore_booking_hindrance,
+            examination_type_id=examination_type_id,
+            exclude_examination_categories=exclude_examination_categories,
+            reschedule_type_id=reschedule_type_id,
+            payment_is_active=payment_is_active,
+            payment_refrence=payment_refrence,
+            payment_url=payment_url,
+            searched_months=searched_months,
+            starting_date=starting_date,
+            nearby_location_ids=nearby_location_ids,
+            vehicle_type_id=vehicle_type_id,
+            tachograph_id=tachograph_id,
+            occasion_choice_id=occasion_choice_id,
+        )
 
         # Add the cookies to the session's cookiejar
         requests.utils.add_dict_to_cookiejar(self.session.cookies, cookies)
 
         # Set the headers for the session
-        self.session.headers = {
-            'Host': 'fp.trafikverket.se',
-            'Connection': 'keep-alive',
-            'Content-Length': '0',
-            'Accept': 'application/json, text/javascript, */*; q=0.01',
-            'X-Requested-With': 'XMLHttpRequest',
-            'User-Agent': useragent,
-            'Content-Type': 'application/json',
-            'Origin': 'https://fp.trafikverket.se',
-            'Sec-Fetch-Site': 'same-origin',
-            'Sec-Fetch-Mode': 'cors',
-            'Sec-Fetch-Dest': 'empty',
-            'Referer': 'https://fp.trafikverket.se/Boka/',
-            'Accept-Encoding': 'gzip, deflate',
-            'Accept-Language': 'en-US,en;q=0.9',
-        }
+        self.session.headers = create_headers(useragent)
+
+        # Serialize the request bodies once per examination type and date window
+        self._templates: dict[tuple, codec.RequestTemplate] = {}
 
-    def get_available_dates(self, location_id: int, extended_information: bool = False) -> list[dict] | list[str]:
+    def get_available_dates(
+        self,
+        location_id: int,
+        extended_information: bool = False,
+        examination_type_id: int = None,
+        starting_date: str = None,
+        searched_months: int = None,
+    ) -> list[dict] | list[str]:
         """
         Retrieve a list of available dates for the given location.
 
@@ -129,6 +456,14 @@ class TrafikverketAPI:
             extended_information: If True, return detailed information about the
                 available dates, including the time and the occasion ID. Otherwise,
                 return only the date as a string in the format 'YYYY-MM-DD'.
+            examination_type_id: The examination type to query. Defaults to the
+                one the object was created with, so that one session can query
+                every examination type.
+            starting_date: The first date to query, in the format
+                "YYYY-MM-DDTHH:MM:SS.000Z". Defaults to the one the object was
+                created with.
+            searched_months: The number of months to query from the starting
+                date, 0 for all. Defaults to the one the object was created with.
 
         Returns:
             If extended_information is True, a list of dictionaries containing the
@@ -138,32 +473,136 @@ class TrafikverketAPI:
         Raises:
             HTTPStatus: If the server returns an unexpected response code.
         """
-        # Update location ID from default params
-        params = self.default_params
-        params['occasionBundleQuery']['locationId'] = location_id
-
-        # Send request to server
-        r = self.session.post(
-            url='https://fp.trafikverket.se/Boka/occasion-bundles',
-            json=params,
-            verify=False,
-            proxies=self.proxy,
-            timeout=60
-        )
+        if examination_type_id is None:
+            examination_type_id = self.default_params['occasionBundleQuery']['examinationTypeId']
 
-        # Handle response
-        if r.status_code == 200 and (response_data := r.json())['status'] == 200:
-            # Extract data from response
-            available_rides = response_data['data']['bundles']
-            dates_found = [
-                ride['occasions'][0]['date'] for ride in available_rides
-            ]
-
-            # Return the dates found or the full list of available rides,
-            # depending on the value of the extended_information flag.
-            if extended_information:
-                return available_rides
-            else:
-                return dates_found
+        # Look up the bundles in the cache, sharing any request already in flight
+        if self.cache is not None:
+            available_rides = self.cache.get_or_load(
+                (examination_type_id, location_id, starting_date, searched_months),
+                lambda: self._request_bundles(
+                    location_id, examination_type_id, starting_date=starting_date, searched_months=searched_months
+                ),
+            )
         else:
-            raise exceptions.HTTPStatus(r.status_code)
+            available_rides = self._request_bundles(
+                location_id, examination_type_id, starting_date=starting_date, searched_months=searched_months
+            )
+
+        return select_dates(available_rides, extended_information)
+
+    def get_available_dates_batch(
+        self,
+        location_ids: list[int],
+        extended_information: bool = False,
+        examination_type_id: int = None,
+    ) -> dict[int, list[dict] | list[str]]:
+        """
+        Retrieve the available dates for several locations in one request.
+
+        The first location is queried through `locationId` and the others
+        through `nearbyLocationIds`, and the bundles in the response are split
+        back by location. The bundles are always requested from the server,
+        the cache is only used for single locations.
+
+        Args:
+            location_ids: The IDs of the locations to query.
+            extended_information: See `get_available_dates`.
+            examination_type_id: See `get_available_dates`.
+
+        Returns:
+            The result of `get_available_dates` for every location.
+
+        Raises:
+            BatchRejected: If the server rejected the batched query. The
+                locations can still be queried one by one.
+            HTTPStatus: If the server returns an unexpected response code.
+        """
+        if examination_type_id is None:
+            examination_type_id = self.default_params['occasionBundleQuery']['examinationTypeId']
+
+        try:
+            bundles = self._request_bundles(location_ids[0], examination_type_id, location_ids[1:])
+        except exceptions.HTTPStatus as e:
+            if is_batch_rejection(e):
+                raise exceptions.BatchRejected(location_ids, e) from e
+            raise
+
+        bundles_by_location = split_bundles(bundles, location_ids)
+        for location_id, location_bundles in bundles_by_location.items():
+            self.metrics.rides.set(len(location_bundles), location_id, examination_type_id)
+
+        return {
+            location_id: select_dates(location_bundles, extended_information)
+            for location_id, location_bundles in bundles_by_location.items()
+        }
+
+    def _request_bundles(
+        self,
+        location_id: int,
+        examination_type_id: int,
+        nearby_location_ids: list[int] = None,
+        starting_date: str = None,
+        searched_months: int = None,
+    ) -> list[dict]:
+        """Request the bundles of a location from the server.
+
+        Args:
+            location_id: The ID of the location to query.
+            examination_type_id: The examination type to query.
+            nearby_location_ids: The IDs of other locations to query in the
+                same request. The metrics of the request are labelled with
+                the first location only.
+            starting_date: The first date to query, or None for the default.
+            searched_months: The number of months to query, or None for the default.
+
+        Returns:
+            The list of bundle dictionaries.
+
+        Raises:
+            HTTPStatus: If the server returns an unexpected response code.
+        """
+        # Create the body of the request for this location
+        body = create_request_body(
+            self.default_params, self._templates,
+            location_id, examination_type_id, nearby_location_ids, starting_date, searched_months,
+        )
+
+        # Wait until the governor lets another request through
+        if self.governor is not None:
+            self.governor.acquire()
+
+        with self.metrics.track_request(location_id, examination_type_id):
+            # Send request to server
+            start_time = time.perf_counter()
+            try:
+                r = self.session.post(
+                    url=f'{self.base_url}/Boka/occasion-bundles',
+                    data=body,
+                    verify=False,
+                    proxies=self.proxy,
+                    timeout=60
+                )
+            except requests.exceptions.RequestException:
+                self._record_response(start_time, None)
+                raise
+
+            self._record_response(start_time, r.status_code)
+            self.metrics.responses.inc(r.status_code)
+
+            # Handle response
+            bundles = parse_bundles(r.status_code, decode_payload(r.status_code, r.content))
+
+        if not nearby_location_ids:
+            self.metrics.rides.set(len(bundles), location_id, examination_type_id)
+        return bundles
+
+    def _record_response(self, start_time: float, status_code: int | None) -> None:
+        """Let the governor adapt the request rate to a response.
+
+        Args:
+            start_time: The time the request was sent, from `time.perf_counter`.
+            status_code: The HTTP status code, or None if the request failed.
+        """
+        if self.governor is not None:
+            self.governor.record(time.perf_counter() - start_time, status_code)
@@ -0,0 +1,105 @@
+"""Microbenchmark of the encoding of the requests and decoding of the responses.
+
+The request bodies of every valid location are encoded, and the response
+bodies of the stand-in server (recorded fixtures where available, synthetic
+bundles otherwise) are decoded and stripped into rides, along three paths:
+
+- stdlib: the parameters serialized with `json.dumps`, and the responses
+  decoded to text and then parsed, like `requests` does with `json=` and `.json()`
+- codec: the same, with `api.codec` encoding and decoding the bytes directly
+- template: the request bodies rendered from a `RequestTemplate`
+
+    $ python -m benchmarks.codec --rounds 20
+    $ python -m benchmarks.codec --bundles 200
+
+The codec runs on orjson when it is installed, and the standard library
+otherwise; the backend in use is printed first.
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Callable
+
+from api import codec
+from api.trafikverket import (create_default_params, create_request_body,
+                              create_request_params, parse_bundles)
+from benchmarks.stand_in_server import load_fixtures
+from helpers import helpers
+
+
+def measure(function: Callable[[], object], rounds: int) -> float:
+    """Run a function a number of times.
+
+    Returns:
+        The median duration of a run, in seconds.
+    """
+    durations = []
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start_time)
+    return statistics.median(durations)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=10, help='number of runs over all locations')
+    parser.add_argument('--bundles', type=int, default=20, help='bundles per location without a recorded fixture')
+    args = parser.parse_args()
+
+    bodies = load_fixtures(bundle_count=args.bundles)
+    location_ids = list(bodies)
+    default_params = create_default_params(ssn='19700101-0000')
+    templates = {}
+
+    encoders = {
+        'stdlib': lambda: [
+            json.dumps(create_request_params(default_params, location_id)).encode()
+            for location_id in location_ids
+        ],
+        'codec': lambda: [
+            codec.dumps(create_request_params(default_params, location_id))
+            for location_id in location_ids
+        ],
+        'template': lambda: [
+            create_request_body(default_params, templates, location_id)
+            for location_id in location_ids
+        ],
+    }
+    decoders = {
+        'stdlib': lambda: [
+            helpers.strip_useless_info(parse_bundles(200, json.loads(body.decode())))
+            for body in bodies.values()
+        ],
+        'codec': lambda: [
+            helpers.strip_useless_info(parse_bundles(200, codec.loads(body)))
+            for body in bodies.values()
+        ],
+    }
+
+    # Every path must produce the same requests and rides
+    requests = [[json.loads(body) for body in encoder()] for encoder in encoders.values()]
+    assert all(other == requests[0] for other in requests)
+    rides = [decoder() for decoder in decoders.values()]
+    assert all(other == rides[0] for other in rides)
+
+    size = sum(map(len, bodies.values()))
+    print(f'backend: {codec.BACKEND}')
+    print(f'{len(bodies)} locations, {size / 1024:.0f} KiB of responses')
+
+    for title, paths in (('encode requests', encoders), ('decode responses', decoders)):
+        print(f'{title}:')
+        baseline = None
+        for name, function in paths.items():
+            duration = measure(function, args.rounds)
+            baseline = baseline or duration
+            print(
+                f'  {name:<10}{duration * 1000:8.2f} ms'
+                f'{duration / len(bodies) * 1e6:8.1f} µs/location'
+                f'{baseline / duration:6.1f}x'
+            )
+
+
+if __name__ == '__main__':
+    main()
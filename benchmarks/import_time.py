@@ -0,0 +1,95 @@
+"""Import time of the entry point, with and without the interactive dependencies.
+
+Headless runs (`python main.py sweep`, `watch` or `serve`) only import what
+they need, while interactive runs also import questionary, tqdm, termcolor
+and coloredlogs. Every measurement runs in a fresh interpreter with
+`-X importtime`, and the median over a number of runs is reported:
+
+    $ python -m benchmarks.import_time --runs 10
+
+The slowest imports of the entry point are listed to show where
+the remaining startup time goes.
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+
+from variables import paths
+
+# The modules only imported by interactive runs
+INTERACTIVE_MODULES = ['questionary', 'tqdm', 'termcolor', 'coloredlogs', 'user_agent']
+
+# A line of the `-X importtime` output: self time, cumulative time and module
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def measure_imports(statement: str) -> tuple[float, dict[str, int]]:
+    """Import modules in a fresh interpreter.
+
+    Args:
+        statement: The import statement to run.
+
+    Returns:
+        The total import time in milliseconds, and the cumulative import time
+        in microseconds of every module imported directly by the imported
+        modules.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=paths.project_directory,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    total = 0
+    direct_imports = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+
+        # The imports are indented by two spaces for every level of nesting
+        depth = (len(match.group(3)) - 1) // 2
+        if depth == 0:
+            total += int(match.group(2))
+        elif depth == 1:
+            direct_imports[match.group(4)] = int(match.group(2))
+
+    return total / 1000, direct_imports
+
+
+def median_total(statement: str, runs: int) -> tuple[float, dict[str, int]]:
+    """Measure an import statement a number of times.
+
+    Returns:
+        The median total import time in milliseconds, and the direct import
+        times of the last run.
+    """
+    totals = []
+    for _ in range(runs):
+        total, direct_imports = measure_imports(statement)
+        totals.append(total)
+    return statistics.median(totals), direct_imports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to list')
+    args = parser.parse_args()
+
+    headless, times = median_total('import main', args.runs)
+    interactive, _ = median_total(f'import main, {", ".join(INTERACTIVE_MODULES)}', args.runs)
+
+    print(f'headless import:    {headless:.1f} ms')
+    print(f'interactive import: {interactive:.1f} ms (+{", ".join(INTERACTIVE_MODULES)})')
+    print('slowest imports of the headless entry point:')
+    for module, microseconds in sorted(times.items(), key=lambda item: -item[1])[:args.top]:
+        print(f'  {microseconds / 1000:8.1f} ms  {module}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Record the current bundles of every location as fixtures for the stand-in server.
+
+The bundles are requested once from Trafikverket, using the SSN and proxy in
+`config.json`, and saved to `benchmarks/fixtures/<location_id>.json`:
+
+    $ python -m benchmarks.record_fixtures --exam-type Körprov
+"""
+import argparse
+import json
+
+from api.exceptions import HTTPStatus
+from api.trafikverket import TrafikverketAPI
+from benchmarks.stand_in_server import FIXTURES_DIRECTORY
+from helpers import helpers, io
+from variables import constants
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--exam-type', choices=list(constants.examination_dict), default='Körprov')
+    args = parser.parse_args()
+
+    config = io.load_config()
+
+    # Use the proxy from the configuration, if any
+    proxy = constants.proxy_select['None']
+    if 'proxy' in config:
+        proxy = helpers.create_requests_proxy(
+            host=config['proxy']['host'],
+            port=config['proxy']['port'],
+            protocol=config['proxy'].get('protocol', 'http'),
+        )
+
+    api = TrafikverketAPI(
+        cookies=constants.cookies,
+        proxy=proxy,
+        useragent='Mozilla/5.0',
+        ssn=config['swedish_ssn'],
+        examination_type_id=constants.examination_dict[args.exam_type],
+    )
+
+    FIXTURES_DIRECTORY.mkdir(parents=True, exist_ok=True)
+
+    for location_id in io.load_location_ids()[args.exam_type]:
+        try:
+            bundles = api.get_available_dates(location_id, extended_information=True)
+        except HTTPStatus as e:
+            print(f'Skipping {location_id}: {e}')
+            continue
+
+        # Save the body in the same format as the server returned it
+        io.safe_write(
+            json.dumps({'status': 200, 'data': {'bundles': bundles}}),
+            str(FIXTURES_DIRECTORY / f'{location_id}.json'),
+        )
+        print(f'Recorded {len(bundles)} bundles for {location_id}')
+
+
+if __name__ == '__main__':
+    main()
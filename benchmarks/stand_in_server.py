@@ -0,0 +1,323 @@
+"""A local stand-in for the Trafikverket occasion-bundles endpoint.
+
+The server answers `POST /Boka/occasion-bundles` for every location ID in
+`data/valid_locations.json`, so that the request path of the script can be
+measured without sending any traffic to Trafikverket. The bundles are
+replayed from recorded fixtures (see `benchmarks.record_fixtures`) when a
+fixture exists for the location, and are synthetic otherwise. Unknown
+location IDs are rejected with a payload status of 400. The bundles of the
+`nearbyLocationIds` of a query are answered along with its location, and
+batches over an optional size are rejected with a payload status of 400.
+Queries with a `startDate` or `searchedMonths` only get the bundles within
+those months.
+
+Latency, server errors and rate limiting can be injected to see how the
+client behaves under load, either as a random fraction of the requests or
+above a tolerated request rate. It can be started on its own:
+
+    $ python -m benchmarks.stand_in_server --port 8080 --latency 0.2 --error-rate 0.01
+
+or from a benchmark through `StandInServer`.
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import multiprocessing
+import random
+import time
+from pathlib import Path
+
+from aiohttp import web
+
+from helpers import io
+from variables import paths
+
+# Directory with the recorded response bodies, one `<location_id>.json` per location
+FIXTURES_DIRECTORY = paths.project_directory / 'benchmarks' / 'fixtures'
+
+# The start date of the queries that are not limited to a date window
+DEFAULT_START_DATE = '1970-01-01T00:00:00.000Z'
+
+
+def make_bundles(location_id: int, count: int = 20) -> list[dict]:
+    """Create synthetic bundles for a location.
+
+    The bundles only depend on the location ID, so repeated requests for the
+    same location return the same data.
+
+    Args:
+        location_id: The ID of the location.
+        count: The number of bundles to create.
+
+    Returns:
+        A list of bundle dictionaries in the format returned by the server.
+    """
+    rng = random.Random(location_id)
+    first_date = datetime.date.today()
+
+    bundles = []
+    for _ in range(count):
+        date = first_date + datetime.timedelta(days=rng.randrange(180))
+        bundles.append({
+            'occasions': [{
+                'examinationTypeId': 12,
+                'locationId': location_id,
+                'locationName': f'Location {location_id}',
+                'name': 'Körprov B',
+                'date': date.isoformat(),
+                'time': f'{rng.randrange(8, 17):02d}:{rng.choice(("00", "15", "30", "45"))}',
+                'cost': '800 kr',
+            }],
+        })
+
+    return bundles
+
+
+def select_bundles(bundles: list[dict], start_date: str, searched_months: int) -> list[dict]:
+    """Keep the bundles within the searched months of a query.
+
+    Args:
+        bundles: The bundles of the queried locations.
+        start_date: The `startDate` of the query, for example "2023-02-01T00:00:00.000Z".
+        searched_months: The number of months from the start date, 0 for all.
+
+    Returns:
+        The bundles from the start date up to the end of the last searched month.
+    """
+    start = datetime.date.fromisoformat(start_date[:10])
+
+    # The first day after the last searched month
+    end = None
+    if searched_months:
+        month = start.month - 1 + searched_months
+        end = datetime.date(start.year + month // 12, month % 12 + 1, 1).isoformat()
+
+    return [
+        bundle for bundle in bundles
+        if bundle['occasions'][0]['date'] >= start.isoformat()
+        and (end is None or bundle['occasions'][0]['date'] < end)
+    ]
+
+
+def load_fixtures(fixtures_directory: Path = FIXTURES_DIRECTORY, bundle_count: int = 20) -> dict[int, bytes]:
+    """Load the response body of every valid location.
+
+    Args:
+        fixtures_directory: The directory with the recorded response bodies.
+        bundle_count: The number of bundles to create for locations without
+            a recorded fixture.
+
+    Returns:
+        A dictionary mapping each location ID to its encoded response body.
+    """
+    bodies = {}
+
+    for location_ids in io.load_location_ids().values():
+        for location_id in location_ids:
+            fixture = fixtures_directory / f'{location_id}.json'
+
+            # Prefer a recorded response over a synthetic one
+            if fixture.is_file():
+                bodies[location_id] = fixture.read_bytes()
+            else:
+                bodies[location_id] = json.dumps({
+                    'status': 200,
+                    'data': {'bundles': make_bundles(location_id, bundle_count)},
+                }).encode()
+
+    return bodies
+
+
+def create_app(
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    error_rate: float = 0.0,
+    rate_limit_rate: float = 0.0,
+    max_rate: float = None,
+    max_batch_size: int = None,
+    fixtures_directory: Path = FIXTURES_DIRECTORY,
+    bundle_count: int = 20,
+    seed: int = None,
+) -> web.Application:
+    """Create the stand-in server application.
+
+    Args:
+        latency: The minimum number of seconds to wait before answering.
+        jitter: The maximum number of extra seconds to wait, picked uniformly.
+        error_rate: The fraction of requests answered with a 500 error.
+        rate_limit_rate: The fraction of requests answered with a 429 error.
+        max_rate: The number of requests per second tolerated. Requests over
+            the rate within the last second are answered with a 429 error.
+            Defaults to None, which tolerates any rate.
+        max_batch_size: The number of locations accepted in one query,
+            including the nearby locations. Defaults to None, which accepts
+            any number.
+        fixtures_directory: The directory with the recorded response bodies.
+        bundle_count: The number of bundles to create for locations without
+            a recorded fixture.
+        seed: The seed of the random number generator, for reproducible runs.
+
+    Returns:
+        The aiohttp application.
+    """
+    bodies = load_fixtures(fixtures_directory, bundle_count)
+    rejected = json.dumps({'status': 400, 'data': None}).encode()
+
+    # The bundles of every location, to answer queries for several locations
+    bundles = {location_id: json.loads(body)['data']['bundles'] for location_id, body in bodies.items()}
+    rng = random.Random(seed)
+
+    # The arrival times of the requests within the last second
+    arrivals = collections.deque()
+
+    async def occasion_bundles(request: web.Request) -> web.Response:
+        params = await request.json()
+        query = params['occasionBundleQuery']
+        location_id = query['locationId']
+        nearby_location_ids = query.get('nearbyLocationIds') or []
+        start_date = query.get('startDate') or DEFAULT_START_DATE
+        searched_months = query.get('searchedMonths') or 0
+
+        # Rate limit the requests over the tolerated rate
+        if max_rate is not None:
+            now = time.monotonic()
+            while arrivals and arrivals[0] <= now - 1:
+                arrivals.popleft()
+            arrivals.append(now)
+            if len(arrivals) > max_rate:
+                await asyncio.sleep(latency)
+                return web.Response(status=429, headers={'Retry-After': '1'})
+
+        # Simulate the time the real server spends on the request
+        await asyncio.sleep(latency + rng.uniform(0, jitter))
+
+        # Inject failures
+        roll = rng.random()
+        if roll < rate_limit_rate:
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        if roll < rate_limit_rate + error_rate:
+            return web.Response(status=500)
+
+        windowed = start_date != DEFAULT_START_DATE or searched_months
+        if not nearby_location_ids and not windowed:
+            return web.Response(
+                body=bodies.get(location_id, rejected),
+                content_type='application/json',
+            )
+
+        # Answer the bundles of all known locations of a batch
+        if location_id not in bodies or (max_batch_size is not None and 1 + len(nearby_location_ids) > max_batch_size):
+            return web.Response(body=rejected, content_type='application/json')
+
+        query_bundles = [
+            bundle
+            for batch_location_id in (location_id, *nearby_location_ids)
+            for bundle in bundles.get(batch_location_id, [])
+        ]
+        if windowed:
+            query_bundles = select_bundles(query_bundles, start_date, searched_months)
+
+        return web.json_response({'status': 200, 'data': {'bundles': query_bundles}})
+
+    app = web.Application()
+    app.router.add_post('/Boka/occasion-bundles', occasion_bundles)
+    return app
+
+
+def _serve(options: dict, host: str, port: int, connection) -> None:
+    """Run the server forever, sending the bound port through the connection."""
+    async def start() -> None:
+        runner = web.AppRunner(create_app(**options), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port, backlog=1024).start()
+        connection.send(runner.addresses[0][1])
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(start())
+    loop.run_forever()
+
+
+class StandInServer:
+    """Run the stand-in server in a separate process.
+
+    Running the server in its own process keeps it from competing with the
+    client for the GIL, and keeps its memory out of the client's measurements.
+
+    Example:
+        with StandInServer(latency=0.1, error_rate=0.01) as base_url:
+            api = TrafikverketAPI(..., base_url=base_url)
+
+    Attributes:
+        base_url: The URL of the running server.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, **options) -> None:
+        """Initialize the StandInServer object.
+
+        Args:
+            host: The host to listen on.
+            port: The port to listen on. Defaults to a random free port.
+            **options: The options accepted by `create_app`.
+        """
+        self.base_url = None
+        self._host = host
+        self._port = port
+        self._options = options
+        self._process = None
+
+    def __enter__(self) -> str:
+        """Start the server and return its URL."""
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(
+            target=_serve,
+            args=(self._options, self._host, self._port, sender),
+            daemon=True,
+        )
+        self._process.start()
+
+        # Wait for the server to listen before handing out its URL
+        self.base_url = f'http://{self._host}:{receiver.recv()}'
+        return self.base_url
+
+    def __exit__(self, *exc_info) -> None:
+        """Stop the server."""
+        self._process.terminate()
+        self._process.join()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options of the stand-in server to a command line parser."""
+    parser.add_argument('--latency', type=float, default=0.0, help='minimum server latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum extra server latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 500')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    parser.add_argument('--max-rate', type=float, default=None, help='requests per second tolerated before answering with 429')
+    parser.add_argument('--max-batch-size', type=int, default=None, help='locations accepted in one query')
+    parser.add_argument('--bundle-count', type=int, default=20, help='bundles per synthetic location')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def server_options(args: argparse.Namespace) -> dict:
+    """Return the options for `create_app` from parsed command line arguments."""
+    return {
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'error_rate': args.error_rate,
+        'rate_limit_rate': args.rate_limit_rate,
+        'max_rate': args.max_rate,
+        'max_batch_size': args.max_batch_size,
+        'bundle_count': args.bundle_count,
+        'seed': args.seed,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    web.run_app(create_app(**server_options(args)), host=args.host, port=args.port)
@@ -0,0 +1,71 @@
+"""Compare the threaded sweep with the asyncio sweep.
+
+Both sweeps are run over the Körprov locations against the local stand-in
+server, and the wall time of each is printed:
+
+    $ python -m benchmarks.sync_vs_async --latency 0.2 --rounds 3
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+
+from api.async_trafikverket import AsyncTrafikverketAPI
+from api.retry import RetryPolicy
+from api.trafikverket import TrafikverketAPI
+from benchmarks.stand_in_server import (StandInServer, add_server_arguments,
+                                        server_options)
+from helpers import async_sweep, io, sweep
+from variables import constants
+
+logger = logging.getLogger('benchmark')
+
+API_OPTIONS = {
+    'cookies': {},
+    'proxy': None,
+    'useragent': 'benchmark',
+    'ssn': '19700101-0000',
+}
+
+
+async def run_async_rounds(base_url: str, targets: list[sweep.SweepTarget], rounds: int, max_concurrency: int) -> list[float]:
+    """Run the asyncio sweep a number of times over one session."""
+    async with AsyncTrafikverketAPI(
+        **API_OPTIONS, base_url=base_url, max_connections=max_concurrency
+    ) as api:
+        return [
+            (await async_sweep.sweep_locations(
+                api, targets, logger, async_sweep.create_retry_policy(), max_concurrency
+            )).wall_time
+            for _ in range(rounds)
+        ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_server_arguments(parser)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=constants.MAX_WORKERS, help='threads for the sync sweep')
+    parser.add_argument('--concurrency', type=int, default=constants.MAX_ASYNC_REQUESTS, help='requests in flight for the async sweep')
+    args = parser.parse_args()
+
+    targets = sweep.create_targets(['Körprov'], io.load_location_ids())
+
+    with StandInServer(**server_options(args)) as base_url:
+        api = TrafikverketAPI(**API_OPTIONS, base_url=base_url, pool_maxsize=args.workers)
+        sync_times = [
+            sweep.sweep_locations(api, targets, logger, RetryPolicy(), args.workers).wall_time
+            for _ in range(args.rounds)
+        ]
+
+        async_times = asyncio.run(
+            run_async_rounds(base_url, targets, args.rounds, args.concurrency)
+        )
+
+    print(f'{len(targets)} locations, {args.latency}s latency, {args.rounds} rounds')
+    print(f'sync  ({args.workers} threads):   median {statistics.median(sync_times):.3f}s')
+    print(f'async ({args.concurrency} in flight): median {statistics.median(async_times):.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""End-to-end throughput benchmark of the sweep against the stand-in server.
+
+The real `TrafikverketAPI` (or `AsyncTrafikverketAPI`) and the sweep logic of
+the "Sort by date" mode, including the retry policy and the selection of the
+earliest rides, are run a number of times against a local stand-in server.
+The benchmark reports:
+
+- requests per second, counting every attempt including retries
+- p50/p95/p99 latency of the individual requests
+- time until the first ride is known, and wall time of each sweep
+- peak resident memory of the client process
+- the responses rate limited with 429, and the rate the governor settled on
+
+    $ python -m benchmarks.throughput --latency 0.05 --jitter 0.1 --error-rate 0.01 --rounds 5
+    $ python -m benchmarks.throughput --max-rate 40 --governor
+    $ python -m benchmarks.throughput --latency 0.2 --batch-size 20
+
+Pass `--json results.json` to save the numbers for comparison between runs.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import resource
+import statistics
+import sys
+import time
+
+from api.async_trafikverket import AsyncTrafikverketAPI
+from api.governor import RateGovernor
+from api.retry import CircuitBreaker, RetryPolicy
+from api.trafikverket import TrafikverketAPI
+from benchmarks.stand_in_server import (StandInServer, add_server_arguments,
+                                        server_options)
+from helpers import async_sweep, io, sweep
+from helpers.earliest import EarliestRides
+from variables import constants
+
+# Keep the error logs of the sweep out of the report
+logger = logging.getLogger('benchmark')
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+API_OPTIONS = {
+    'cookies': {},
+    'proxy': None,
+    'useragent': 'benchmark',
+    'ssn': '19700101-0000',
+}
+
+
+class TimedAPI:
+    """Wrap an API object and record the latency of every request.
+
+    Attributes:
+        latencies: The duration in seconds of every request, including failed ones.
+    """
+
+    def __init__(self, api) -> None:
+        """Initialize the TimedAPI object.
+
+        Args:
+            api: The `TrafikverketAPI` or `AsyncTrafikverketAPI` to wrap.
+        """
+        self.api = api
+        self.latencies = []
+
+    @property
+    def batching(self) -> bool:
+        """Whether the wrapped API object queries several locations in one request."""
+        return self.api.batching
+
+    @batching.setter
+    def batching(self, batching: bool) -> None:
+        self.api.batching = batching
+
+    def get_available_dates(self, *args, **kwargs):
+        """Time a call to `TrafikverketAPI.get_available_dates`."""
+        start_time = time.perf_counter()
+        try:
+            return self.api.get_available_dates(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start_time)
+
+    def get_available_dates_batch(self, *args, **kwargs):
+        """Time a call to `TrafikverketAPI.get_available_dates_batch`."""
+        start_time = time.perf_counter()
+        try:
+            return self.api.get_available_dates_batch(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start_time)
+
+
+class TimedAsyncAPI(TimedAPI):
+    """Wrap an `AsyncTrafikverketAPI` and record the latency of every request."""
+
+    async def get_available_dates(self, *args, **kwargs):
+        """Time a call to `AsyncTrafikverketAPI.get_available_dates`."""
+        start_time = time.perf_counter()
+        try:
+            return await self.api.get_available_dates(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start_time)
+
+    async def get_available_dates_batch(self, *args, **kwargs):
+        """Time a call to `AsyncTrafikverketAPI.get_available_dates_batch`."""
+        start_time = time.perf_counter()
+        try:
+            return await self.api.get_available_dates_batch(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start_time)
+
+
+def create_retry_options() -> dict:
+    """Return the retry policy options used by the execution modes."""
+    return {
+        'max_attempts': constants.MAX_ATTEMPTS,
+        'base_delay': constants.BACKOFF_BASE_DELAY,
+        'max_delay': constants.BACKOFF_MAX_DELAY,
+        'breaker': CircuitBreaker(
+            failure_threshold=constants.CIRCUIT_FAILURE_THRESHOLD,
+            cooldown=constants.CIRCUIT_COOLDOWN,
+        ),
+    }
+
+
+def run_sync(
+    base_url: str,
+    targets: list[sweep.SweepTarget],
+    args: argparse.Namespace,
+    governor: RateGovernor | None,
+) -> tuple[TimedAPI, list[float], list[float]]:
+    """Run the threaded sweeps.
+
+    Args:
+        base_url: The URL of the stand-in server.
+        targets: The locations to sweep.
+        args: The command line arguments.
+        governor: The optional governor pacing the requests.
+
+    Returns:
+        The timed API, the time until the first ride of every sweep and the
+        wall time of every sweep.
+    """
+    api = TimedAPI(TrafikverketAPI(**API_OPTIONS, base_url=base_url, pool_maxsize=args.workers, governor=governor))
+    retry_policy = RetryPolicy(**create_retry_options())
+
+    first_ride_times = []
+    wall_times = []
+    for _ in range(args.rounds):
+        start_time = time.perf_counter()
+        earliest_rides = EarliestRides(args.top_rides)
+        for _, rides in sweep.iter_locations(api, targets, logger, retry_policy, args.workers, args.batch_size):
+            if rides and earliest_rides.best is None:
+                first_ride_times.append(time.perf_counter() - start_time)
+            earliest_rides.extend(rides or ())
+        wall_times.append(time.perf_counter() - start_time)
+
+    return api, first_ride_times, wall_times
+
+
+async def run_async(
+    base_url: str,
+    targets: list[sweep.SweepTarget],
+    args: argparse.Namespace,
+    governor: RateGovernor | None,
+) -> tuple[TimedAsyncAPI, list[float], list[float]]:
+    """Run the asyncio sweeps.
+
+    See `run_sync` for a description of the arguments.
+
+    Returns:
+        The timed API, the time until the first ride of every sweep and the
+        wall time of every sweep.
+    """
+    async with AsyncTrafikverketAPI(
+        **API_OPTIONS, base_url=base_url, max_connections=args.concurrency, governor=governor
+    ) as async_api:
+        api = TimedAsyncAPI(async_api)
+        retry_policy = async_sweep.create_retry_policy(**create_retry_options())
+
+        first_ride_times = []
+        wall_times = []
+        for _ in range(args.rounds):
+            start_time = time.perf_counter()
+            earliest_rides = EarliestRides(args.top_rides)
+            async for _, rides in async_sweep.iter_locations(
+                api, targets, logger, retry_policy, args.concurrency, args.batch_size
+            ):
+                if rides and earliest_rides.best is None:
+                    first_ride_times.append(time.perf_counter() - start_time)
+                earliest_rides.extend(rides or ())
+            wall_times.append(time.perf_counter() - start_time)
+
+    return api, first_ride_times, wall_times
+
+
+def peak_rss_mib() -> float:
+    """Return the peak resident memory of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # The value is in bytes on macOS and in KiB elsewhere
+    if sys.platform == 'darwin':
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_server_arguments(parser)
+    parser.add_argument('--client', choices=('sync', 'async'), default='sync')
+    parser.add_argument('--exam-type', nargs='+', choices=list(constants.examination_dict), default=['Körprov'])
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=constants.MAX_WORKERS, help='threads for the sync client')
+    parser.add_argument('--concurrency', type=int, default=constants.MAX_ASYNC_REQUESTS, help='requests in flight for the async client')
+    parser.add_argument('--top-rides', type=int, default=constants.TOP_RIDES, help='number of earliest rides kept')
+    parser.add_argument('--batch-size', type=int, default=constants.BATCH_SIZE, help='locations queried in one request')
+    parser.add_argument('--governor', action='store_true', help='pace the requests with the adaptive rate governor')
+    parser.add_argument('--json', help='file to save the results to')
+    args = parser.parse_args()
+
+    targets = sweep.create_targets(args.exam_type, io.load_location_ids())
+
+    # Pace the requests like the execution modes do when the governor is enabled
+    governor = None
+    if args.governor:
+        governor = RateGovernor(
+            initial_rate=constants.GOVERNOR_INITIAL_RATE,
+            min_rate=constants.GOVERNOR_MIN_RATE,
+            max_rate=constants.GOVERNOR_MAX_RATE,
+            additive_increase=constants.GOVERNOR_ADDITIVE_INCREASE,
+            decrease_factor=constants.GOVERNOR_DECREASE_FACTOR,
+            latency_tolerance=constants.GOVERNOR_LATENCY_TOLERANCE,
+        )
+
+    with StandInServer(**server_options(args)) as base_url:
+        start_time = time.perf_counter()
+        if args.client == 'sync':
+            api, first_ride_times, wall_times = run_sync(base_url, targets, args, governor)
+        else:
+            api, first_ride_times, wall_times = asyncio.run(run_async(base_url, targets, args, governor))
+        total_time = time.perf_counter() - start_time
+
+    percentiles = statistics.quantiles(api.latencies, n=100)
+    results = {
+        'client': args.client,
+        'locations': len(targets),
+        'batch_size': args.batch_size,
+        'rounds': args.rounds,
+        'requests': len(api.latencies),
+        'requests_per_second': len(api.latencies) / total_time,
+        'latency_p50': percentiles[49],
+        'latency_p95': percentiles[94],
+        'latency_p99': percentiles[98],
+        'first_ride_time_median': statistics.median(first_ride_times) if first_ride_times else None,
+        'sweep_wall_time_median': statistics.median(wall_times),
+        'sweep_wall_time_max': max(wall_times),
+        'peak_rss_mib': peak_rss_mib(),
+        'rate_limited': api.api.metrics.responses.value(429),
+        'governor_rate': governor.rate if governor is not None else None,
+    }
+
+    print(f'{args.client} client, {len(targets)} locations in batches of {args.batch_size}, {args.rounds} rounds')
+    print(f'  requests:        {results["requests"]} ({results["requests_per_second"]:.1f}/s)')
+    print(f'  latency p50/p95/p99: '
+          f'{results["latency_p50"] * 1000:.1f} / {results["latency_p95"] * 1000:.1f} / {results["latency_p99"] * 1000:.1f} ms')
+    if first_ride_times:
+        print(f'  first ride:      median {results["first_ride_time_median"]:.3f}s')
+    print(f'  sweep wall time: median {results["sweep_wall_time_median"]:.3f}s, max {results["sweep_wall_time_max"]:.3f}s')
+    print(f'  peak RSS:        {results["peak_rss_mib"]:.1f} MiB')
+    print(f'  rate limited:    {results["rate_limited"]} responses')
+    if governor is not None:
+        print(f'  governor:        {governor.rate:.1f} requests/s after {governor.decreases} decreases')
+
+    if args.json:
+        io.safe_write(json.dumps(results, indent=4), args.json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""Concurrent sweeps over the examination locations using asyncio.
+
+This module is the asyncio counterpart of the `sweep` module. Instead of a
+pool of worker threads, every location is requested from a single event loop
+through an `AsyncTrafikverketAPI`, with a semaphore bounding the number of
+requests in flight.
+"""
+import asyncio
+import contextlib
+import logging
+import queue
+import time
+from typing import AsyncGenerator, AsyncIterator, Callable, Iterator, TypeVar
+
+from api.async_trafikverket import (REQUEST_EXCEPTIONS, RETRYABLE_EXCEPTIONS,
+                                    AsyncTrafikverketAPI)
+from api.exceptions import BatchRejected, CircuitOpen, HTTPStatus
+from api.retry import RetryPolicy
+from helpers import helpers
+from helpers.ride import Ride
+from helpers.sweep import (SweepResult, SweepTarget, batch_arguments,
+                           check_rejected_batch, create_batches, split_batch)
+from variables import constants
+
+T = TypeVar('T')
+
+# Marks the end of a stream passed between threads
+_END_OF_STREAM = object()
+
+
+def create_retry_policy(**kwargs) -> RetryPolicy:
+    """Create a retry policy that handles the errors raised by aiohttp.
+
+    Args:
+        **kwargs: The remaining arguments accepted by `RetryPolicy`.
+
+    Returns:
+        The retry policy.
+    """
+    return RetryPolicy(
+        errors=(HTTPStatus, *REQUEST_EXCEPTIONS),
+        retryable_errors=RETRYABLE_EXCEPTIONS,
+        **kwargs
+    )
+
+
+async def fetch_location(
+    api: AsyncTrafikverketAPI,
+    target: SweepTarget,
+    logger: logging.Logger,
+    retry_policy: RetryPolicy,
+    starting_date: str = None,
+    searched_months: int = None,
+) -> list[Ride]:
+    """Retrieve the stripped rides for a single location, retrying on errors.
+
+    Args:
+        api: The API object used to make the request.
+        target: The location and examination type to retrieve.
+        logger: The logger used to report errors.
+        retry_policy: The policy deciding whether and when to retry a failed
+            request, created with `create_retry_policy`.
+        starting_date: The first date to query, or None for all dates.
+        searched_months: The number of months to query, or None for all months.
+
+    Returns:
+        A list of rides.
+
+    Raises:
+        CircuitOpen: If the location is out of rotation after failing persistently.
+        HTTPStatus: If the server returned an unexpected response code.
+        aiohttp.ClientError: If the request failed.
+    """
+    try:
+        # Get the available rides from the API
+        return helpers.strip_useless_info(
+            await retry_policy.call_async(
+                api.get_available_dates,
+                target.location_id,
+                extended_information=True,
+                examination_type_id=constants.examination_dict[target.exam_type],
+                starting_date=starting_date,
+                searched_months=searched_months,
+                key=target,
+            )
+        )
+    except retry_policy.errors as e:
+        logger.error(
+            'Unfixable error occurred with location id: %s\n%s',
+            target, e
+        )
+        raise
+
+
+async def fetch_locations(
+    api: AsyncTrafikverketAPI,
+    batch: list[SweepTarget],
+    logger: logging.Logger,
+    retry_policy: RetryPolicy,
+) -> list[tuple[SweepTarget, list[Ride] | None]]:
+    """Retrieve the stripped rides for a batch of locations, one request per location.
+
+    See `sweep.fetch_locations`.
+    """
+    results = []
+    for target in batch:
+        try:
+            results.append((target, await fetch_location(api, target, logger, retry_policy)))
+        except (*retry_policy.errors, CircuitOpen):
+            results.append((target, None))
+    return results
+
+
+async def fetch_batch(
+    api: AsyncTrafikverketAPI,
+    batch: list[SweepTarget],
+    logger: logging.Logger,
+    retry_policy: RetryPolicy,
+) -> list[tuple[SweepTarget, list[Ride] | None]]:
+    """Retrieve the stripped rides for a batch of locations in one request,
+    falling back to one request per location if the server rejects it.
+
+    See `sweep.fetch_batch`.
+    """
+    if len(batch) == 1 or not api.batching:
+        return await fetch_locations(api, batch, logger, retry_policy)
+
+    try:
+        dates = await retry_policy.call_async(api.get_available_dates_batch, **batch_arguments(batch))
+        return split_batch(batch, logger, dates=dates)
+    except (BatchRejected, *retry_policy.errors, CircuitOpen) as e:
+        results = split_batch(batch, logger, error=e)
+
+    # Request the locations one by one if the server rejected the batch
+    if results is None:
+        results = await fetch_locations(api, batch, logger, retry_policy)
+        check_rejected_batch(api, results, logger)
+    return results
+
+
+async def iter_locations(
+    api: AsyncTrafikverketAPI,
+    targets: list[SweepTarget],
+    logger: logging.Logger,
+    retry_policy: RetryPolicy,
+    max_concurrency: int = constants.MAX_ASYNC_REQUESTS,
+    batch_size: int = 1,
+) -> AsyncIterator[tuple[SweepTarget, list[Ride] | None]]:
+    """Retrieve the available rides for all locations concurrently, yielding
+    the rides of every location as soon as it completes.
+
+    Args:
+        api: The API object used to make the requests.
+        targets: The locations and examination types to retrieve.
+        logger: The logger used to report errors.
+        retry_policy: The policy used to retry failed requests.
+        max_concurrency: The maximum number of requests in flight at once.
+        batch_size: The maximum number of locations in one request.
+
+    Yields:
+        A tuple of the target and its rides, in order of completion. The
+        rides are None if the location could not be retrieved.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(batch: list[SweepTarget]) -> list[tuple[SweepTarget, list[Ride] | None]]:
+        # Wait for a free slot before sending the request
+        async with semaphore:
+            return await fetch_batch(api, batch, logger, retry_policy)
+
+    # Request every batch of locations, or every location if the server rejects batches
+    batches = create_batches(targets, batch_size if api.batching else 1)
+    tasks = [asyncio.create_task(fetch(batch)) for batch in batches]
+    try:
+        for task in asyncio.as_completed(tasks):
+            for result in await task:
+                yield result
+    finally:
+        # Stop the remaining requests if the stream is closed early
+        for task in tasks:
+            task.cancel()
+
+
+async def sweep_locations(
+    api: AsyncTrafikverketAPI,
+    targets: list[SweepTarget],
+    logger: logging.Logger,
+    retry_policy: RetryPolicy,
+    max_concurrency: int = constants.MAX_ASYNC_REQUESTS,
+    on_location_done: Callable[[SweepTarget], None] = None,
+    batch_size: int = 1,
+) -> SweepResult:
+    """Retrieve the available rides for all locations concurrently.
+
+    Args:
+        api: The API object used to make the requests.
+        targets: The locations and examination types to retrieve.
+        logger: The logger used to report errors.
+        retry_policy: The policy used to retry failed requests.
+        max_concurrency: The maximum number of requests in flight at once.
+        on_location_done: An optional callback that is called with the
+            target every time a location has been processed.
+        batch_size: The maximum number of locations in one request.
+
+    Returns:
+        A SweepResult with the merged rides of all locations.
+    """
+    # Start measuring the wall time of the sweep
+    start_time = time.perf_counter()
+
+    rides = []
+    failed_locations = []
+
+    # Merge the results as the locations complete
+    async for target, location_rides in iter_locations(api, targets, logger, retry_policy, max_concurrency, batch_size):
+        if location_rides is None:
+            failed_locations.append(target)
+        else:
+            rides.extend(location_rides)
+
+        if on_location_done is not None:
+            on_location_done(target)
+
+    return SweepResult(
+        rides=rides,
+        failed_locations=failed_locations,
+        wall_time=time.perf_counter() - start_time,
+    )
+
+
+def iterate_threadsafe(stream: AsyncGenerator[T, None], event_loop: asyncio.AbstractEventLoop) -> Iterator[T]:
+    """Consume an async generator on an event loop running in another thread.
+
+    This lets synchronous code stream the results of `iter_locations` while
+    the requests stay on the shared event loop.
+
+    Args:
+        stream: The async generator to consume. It is closed when the
+            returned iterator is closed.
+        event_loop: The running event loop to consume it on.
+
+    Yields:
+        The items of the async generator, as soon as they are produced.
+    """
+    items = queue.Queue()
+
+    async def forward() -> None:
+        try:
+            async with contextlib.aclosing(stream):
+                async for item in stream:
+                    items.put(item)
+        finally:
+            items.put(_END_OF_STREAM)
+
+    future = asyncio.run_coroutine_threadsafe(forward(), event_loop)
+    try:
+        while (item := items.get()) is not _END_OF_STREAM:
+            yield item
+
+        # Raise the error that ended the stream, if any
+        future.result()
+    finally:
+        future.cancel()
+
+
+async def iterate_in_executor(stream: Iterator[T]) -> AsyncGenerator[T, None]:
+    """Consume a blocking iterator from a worker thread.
+
+    This is the counterpart of `iterate_threadsafe`, letting an event loop
+    stream the results of the threaded `sweep.iter_locations` without blocking.
+
+    Args:
+        stream: The iterator to consume. If it is a generator, it is closed
+            when the returned async generator is closed.
+
+    Yields:
+        The items of the iterator, as soon as they are produced.
+    """
+    event_loop = asyncio.get_running_loop()
+    try:
+        while (item := await event_loop.run_in_executor(None, next, stream, _END_OF_STREAM)) is not _END_OF_STREAM:
+            yield item
+    finally:
+        if hasattr(stream, 'close'):
+            await event_loop.run_in_executor(None, stream.close)
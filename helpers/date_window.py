@@ -0,0 +1,162 @@
+"""Planning of the dates every poll asks the server for.
+
+By default every query starts in 1970 and searches all months, so the server
+returns every bundle of a location, and all of them are downloaded, parsed
+and stripped even if the watchers only care about the next few weeks. The
+`QueryPlanner` derives a date window for every examination type from the
+union of the date windows of its watch profiles: from the earliest start
+date, but not before today, to the latest end date. The window is sent as the
+`startDate` and `searchedMonths` of the query, so the server only returns the
+bundles of the months the watchers care about.
+
+The rest of the calendar is still polled, but on a slower cadence: every
+location is polled without a window once every `full_interval` seconds, and
+always on its first poll, so that the rides outside the windows are still
+logged, only later.
+"""
+import datetime
+import time
+from typing import Callable, Iterable, NamedTuple
+
+from helpers.sweep import SweepTarget
+from helpers.watch import WatchProfile
+
+
+class DateWindow(NamedTuple):
+    """A range of dates to poll. A date that is None leaves that side open.
+
+    Attributes:
+        start_date: The first date, in the format 'YYYY-MM-DD'.
+        end_date: The last date, in the format 'YYYY-MM-DD'.
+    """
+
+    start_date: str | None = None
+    end_date: str | None = None
+
+    @property
+    def unbounded(self) -> bool:
+        """Whether the window covers every date."""
+        return self.start_date is None and self.end_date is None
+
+    def query_options(self) -> dict:
+        """Return the starting date and searched months for `get_available_dates`.
+
+        The server searches whole months, so the window is widened to the
+        end of the month of its end date.
+        """
+        if self.unbounded:
+            return {}
+
+        start = datetime.date.fromisoformat(self.start_date) if self.start_date is not None else datetime.date.today()
+        if self.end_date is None:
+            # Zero months searches all months from the start date
+            searched_months = 0
+        else:
+            end = datetime.date.fromisoformat(self.end_date)
+            searched_months = max(1, (end.year - start.year) * 12 + end.month - start.month + 1)
+
+        return {
+            'starting_date': f'{start.isoformat()}T00:00:00.000Z',
+            'searched_months': searched_months,
+        }
+
+
+def union_window(profiles: Iterable[WatchProfile], today: str) -> DateWindow:
+    """Find the smallest window covering the windows of all profiles from today on.
+
+    Args:
+        profiles: The watch profiles.
+        today: The current date, in the format 'YYYY-MM-DD'.
+
+    Returns:
+        The window, unbounded if there are no profiles or a profile watches
+        every future date.
+    """
+    profiles = list(profiles)
+    if not profiles:
+        return DateWindow()
+
+    # A profile without a start date starts today, since past dates have no rides
+    start_date = max(min(profile.start_date or today for profile in profiles), today)
+
+    # A profile without an end date watches the whole future
+    if any(profile.end_date is None for profile in profiles):
+        end_date = None
+    else:
+        end_date = max(max(profile.end_date for profile in profiles), start_date)
+
+    if start_date == today and end_date is None:
+        return DateWindow()
+    return DateWindow(start_date, end_date)
+
+
+class QueryPlanner:
+    """Choose the date window of every poll of the change logging mode.
+
+    Attributes:
+        profiles: The watch profiles whose windows are polled.
+        full_interval: The number of seconds between two polls of a location
+            without a window.
+    """
+
+    def __init__(
+        self,
+        profiles: Iterable[WatchProfile],
+        full_interval: float,
+        clock: Callable[[], float] = time.monotonic,
+        today: Callable[[], datetime.date] = datetime.date.today,
+    ) -> None:
+        """Initialize the QueryPlanner object.
+
+        Args:
+            profiles: The watch profiles whose windows are polled.
+            full_interval: The number of seconds between two polls of a
+                location without a window.
+            clock: The function used to read the current time.
+            today: The function used to read the current date.
+        """
+        self.profiles = list(profiles)
+        self.full_interval = full_interval
+        self._clock = clock
+        self._today = today
+
+        # The time every location was last polled without a window
+        self._full_polls: dict[SweepTarget, float] = {}
+
+    def window(self, exam_type: str) -> DateWindow:
+        """Return the union of the windows of the profiles of an examination type.
+
+        Without any profile for the examination type, every change is
+        logged, so the window is unbounded.
+        """
+        return union_window(
+            (profile for profile in self.profiles if profile.exam_type in (None, exam_type)),
+            self._today().isoformat(),
+        )
+
+    def plan(self, target: SweepTarget) -> DateWindow:
+        """Choose the window of the next poll of a location.
+
+        Returns:
+            The window of the examination type, or an unbounded window if the
+            location is due for a poll of every date.
+        """
+        window = self.window(target.exam_type)
+        if window.unbounded:
+            return window
+
+        last_full_poll = self._full_polls.get(target)
+        if last_full_poll is None or self._clock() - last_full_poll >= self.full_interval:
+            return DateWindow()
+
+        return window
+
+    def record(self, target: SweepTarget, window: DateWindow) -> None:
+        """Record a successful poll of a location.
+
+        Args:
+            target: The polled location.
+            window: The window of the poll, as returned by `plan`.
+        """
+        if window.unbounded:
+            self._full_polls[target] = self._clock()
@@ -0,0 +1,144 @@
+"""Incremental per-location diffing of the available rides.
+
+The diff engine keeps the last known rides of every location, keyed by
+their identity (date, time, location and name). When a location has been
+polled, only its new rides are compared against its previous state, and the
+differences are returned as typed events. A location that could not be
+polled is simply not updated, so it keeps its previous state instead of
+having all of its rides reported as removed and then added again.
+
+A poll can also be limited to a date window, in which case only the rides
+within the window are compared, and the rides outside it are kept as they
+were.
+"""
+from enum import Enum
+from typing import Hashable, Iterable, Iterator, NamedTuple
+
+from helpers.ride import Ride
+
+
+class EventType(Enum):
+    """The kind of change to a ride."""
+
+    ADDED = 'added'
+    REMOVED = 'removed'
+    CHANGED = 'changed'
+
+
+class RideEvent(NamedTuple):
+    """A change to a ride in a location.
+
+    Attributes:
+        type: The kind of change.
+        location_id: The ID of the location the ride belongs to.
+        ride: The ride. For removed rides this is the last known version.
+        previous: The previous version of a changed ride, otherwise None.
+    """
+
+    type: EventType
+    location_id: Hashable
+    ride: Ride
+    previous: Ride | None = None
+
+
+class DiffEngine:
+    """Keep the last known rides of every location and diff new polls against them.
+
+    Attributes:
+        size: The total number of rides over all locations.
+    """
+
+    def __init__(self, initial_state: dict[Hashable, Iterable[Ride]] = None) -> None:
+        """Initialize the DiffEngine object.
+
+        Args:
+            initial_state: The last known rides of each location, for example
+                loaded from the snapshot store. No events are produced for them.
+        """
+        # Maps each location to its rides, keyed by their identity
+        self._state: dict[Hashable, dict[tuple, Ride]] = {}
+
+        # Maps each location to its earliest ride
+        self._earliest: dict[Hashable, Ride] = {}
+        self.size = 0
+
+        for location_id, rides in (initial_state or {}).items():
+            self.update(location_id, rides)
+
+    def __len__(self) -> int:
+        """Return the total number of rides over all locations."""
+        return self.size
+
+    def rides(self) -> Iterator[Ride]:
+        """Iterate over the last known rides of all locations."""
+        for location_rides in self._state.values():
+            yield from location_rides.values()
+
+    def earliest(self) -> Ride | None:
+        """Return the earliest ride over all locations, or None if there are none.
+
+        Only the earliest ride of every location is compared, so this does not
+        scan all rides.
+        """
+        return min(self._earliest.values(), default=None)
+
+    def location_rides(self, location_id: Hashable) -> list[Ride]:
+        """Return the last known rides of a location."""
+        return list(self._state.get(location_id, {}).values())
+
+    def update(self, location_id: Hashable, rides: Iterable[Ride], start_date: str = None, end_date: str = None) -> list[RideEvent]:
+        """Replace the state of a polled location and return what changed.
+
+        Only call this for locations that were polled successfully.
+
+        Args:
+            location_id: The ID of the polled location.
+            rides: The rides found in the location.
+            start_date: The first date of the poll, in the format 'YYYY-MM-DD'.
+                Defaults to None, meaning the poll had no lower bound.
+            end_date: The last date of the poll, in the format 'YYYY-MM-DD'.
+                Defaults to None, meaning the poll had no upper bound.
+
+        Returns:
+            The events for the rides that were added, removed or changed
+            within the dates of the poll, in that order.
+        """
+        previous = self._state.get(location_id, {})
+        current = {ride.key: ride for ride in rides}
+
+        # Only compare the rides within the dates of the poll, and keep the others
+        outside = {}
+        if start_date is not None or end_date is not None:
+            def in_window(ride: Ride) -> bool:
+                return (start_date is None or ride.date >= start_date) and (end_date is None or ride.date <= end_date)
+
+            outside = {key: ride for key, ride in previous.items() if not in_window(ride)}
+            previous = {key: ride for key, ride in previous.items() if in_window(ride)}
+            current = {key: ride for key, ride in current.items() if in_window(ride)}
+
+        events = []
+        changed = []
+        for key, ride in current.items():
+            previous_ride = previous.get(key)
+            if previous_ride is None:
+                events.append(RideEvent(EventType.ADDED, location_id, ride))
+            elif previous_ride != ride:
+                changed.append(RideEvent(EventType.CHANGED, location_id, ride, previous_ride))
+
+        events.extend(
+            RideEvent(EventType.REMOVED, location_id, ride)
+            for key, ride in previous.items() if key not in current
+        )
+        events.extend(changed)
+
+        # Keep the new state of the location
+        self.size += len(current) - len(previous)
+        if outside:
+            current = {**outside, **current}
+        self._state[location_id] = current
+        if current:
+            self._earliest[location_id] = min(current.values())
+        else:
+            self._earliest.pop(location_id, None)
+
+        return events
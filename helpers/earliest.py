@@ -0,0 +1,92 @@
+"""Bounded selection of the earliest available rides.
+
+Instead of collecting and sorting every ride of a sweep, `EarliestRides`
+keeps only the earliest k rides seen so far in a bounded heap, so that rides
+can be added as each location completes and the best ride is known at any
+point of the sweep.
+"""
+import heapq
+from typing import Iterable
+
+from helpers.ride import Ride
+
+
+class _Latest:
+    """Order rides latest first, turning `heapq`'s min-heap into a max-heap."""
+
+    __slots__ = ('ride',)
+
+    def __init__(self, ride: Ride) -> None:
+        self.ride = ride
+
+    def __lt__(self, other: '_Latest') -> bool:
+        return other.ride < self.ride
+
+
+class EarliestRides:
+    """Keep the k earliest rides seen so far.
+
+    Attributes:
+        k: The maximum number of rides kept.
+        best: The earliest ride seen so far, or None if no ride has been seen.
+        seen: The number of rides seen so far, including the ones not kept.
+    """
+
+    def __init__(self, k: int) -> None:
+        """Initialize the EarliestRides object.
+
+        Args:
+            k: The maximum number of rides kept.
+        """
+        if k < 1:
+            raise ValueError('k must be at least 1')
+
+        self.k = k
+        self.best: Ride | None = None
+        self.seen = 0
+
+        # The kept rides, with the latest of them at the top
+        self._heap: list[_Latest] = []
+
+    def __len__(self) -> int:
+        """Return the number of rides kept."""
+        return len(self._heap)
+
+    def push(self, ride: Ride) -> bool:
+        """Add a ride, dropping the latest kept ride if there are too many.
+
+        Args:
+            ride: The ride to add.
+
+        Returns:
+            Whether the ride is earlier than every ride seen before it.
+        """
+        self.seen += 1
+
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, _Latest(ride))
+        elif ride < self._heap[0].ride:
+            heapq.heapreplace(self._heap, _Latest(ride))
+
+        if self.best is None or ride < self.best:
+            self.best = ride
+            return True
+        return False
+
+    def extend(self, rides: Iterable[Ride]) -> bool:
+        """Add several rides.
+
+        Args:
+            rides: The rides to add.
+
+        Returns:
+            Whether the earliest ride improved.
+        """
+        improved = False
+        for ride in rides:
+            improved |= self.push(ride)
+        return improved
+
+    def sorted(self) -> list[Ride]:
+        """Return the kept rides, earliest first."""
+        return sorted(entry.ride for entry in self._heap)
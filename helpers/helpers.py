@@ -7,27 +7,23 @@ updating nested dictionaries.
 """
 import shutil
 
+from helpers.ride import Ride
 
-def strip_useless_info(rides: list[dict]) -> list[dict]:
+
+def strip_useless_info(rides: list[dict]) -> list[Ride]:
     """Strip unnecessary information from a list of ride dictionaries.
 
     This function takes a list of raw ride dictionaries from the server and
-    removes information that is not used in this script in order to save on
-    memory usage on the system.
+    converts them into compact `Ride` records, dropping the information that
+    is not used in this script in order to save on memory usage on the system.
 
     Args:
         rides: The list of raw ride dictionaries to strip.
 
     Returns:
-        A list of stripped ride dictionaries.
+        A list of rides.
     """
-    return [{
-        "time": ride["occasions"][0]["time"],
-        'location':ride["occasions"][0]["locationName"],
-        'cost':ride["occasions"][0]["cost"],
-        'date':ride["occasions"][0]["date"],
-        'name':ride["occasions"][0]["name"]
-    } for ride in rides]
+    return [Ride.from_bundle(ride) for ride in rides]
 
 
 def inplace_print(output: str) -> None:
@@ -8,6 +8,7 @@ The module provides the following functions:
 - safe_read: Read a file, returning an empty string if the file is not found.
 - load_config: Load the configuration from a JSON file.
 - update_config: Update the configuration in the JSON file.
+- get_option: Return a command line option, falling back to the configuration.
 """
 
 
@@ -53,13 +54,14 @@ def safe_write(data: str, file_path: str, backup_path: str = None, create_folder
             raise e
 
         # Create the folder structure for the backup file
-        Path(backup_path).mkdir(parents=True, exist_ok=True)
+        Path(backup_path).parent.mkdir(parents=True, exist_ok=True)
 
         # Retry writing the data to the backup file
         with open(backup_path, mode, encoding=encoding) as f:
             f.write(data)
 
-    # Move the backup file to the original file path
+    # Move the backup file to the original file path, which replaces the file
+    # atomically when both are on the same file system
     shutil.move(backup_path, file_path)
 
 
@@ -103,7 +105,7 @@ def safe_read(file_path: str, encoding: str = 'utf-8') -> str:
             return f.read()
     except FileNotFoundError:
         # If the file is not found, create the folder structure for the file
-        Path(file_path).mkdir(parents=True, exist_ok=True)
+        Path(file_path).parent.mkdir(parents=True, exist_ok=True)
 
         # Return an empty string if the file is not found.
         return ''
@@ -137,6 +139,24 @@ def update_config(data: dict) -> None:
     safe_write(data, paths.config_file)
 
 
+def get_option(value: Any, config: dict, key: str, default: Any = None) -> Any:
+    """Return a command line option, or the configured value if it was not given.
+
+    Args:
+        value: The value of the command line option, None if it was not given.
+        config: The configuration section of the option.
+        key: The key of the option in the configuration.
+        default: The value used if the option is neither given nor configured.
+
+    Returns:
+        The value of the option. Falsy values such as 0 given on the command
+        line are kept, so that they reach the validation of the option.
+    """
+    if value is not None:
+        return value
+    return config.get(key, default)
+
+
 def load_location_ids() -> dict:
     """Load valid location IDs from a file.
 
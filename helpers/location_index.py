@@ -0,0 +1,171 @@
+"""Statistics of every location across sweeps, and a slow lane for dead ones.
+
+Most of the valid locations have no available rides most of the time, and
+some of them fail on every request, for example because they no longer
+offer the exam type. The `LocationIndex` records for every location how
+often it was swept, empty or failed, and when it last had rides.
+
+A location that was empty for `empty_sweeps` sweeps in a row, or failed for
+`error_sweeps` sweeps in a row, is demoted to the slow lane: instead of
+every sweep, it is only swept once every `slow_interval` seconds. As soon as
+it has rides again it is back in the fast lane, so locations that come back
+are rediscovered within `slow_interval`.
+
+The index is saved as JSON with `io.safe_write`, so an interrupted run never
+leaves a truncated file behind.
+"""
+import json
+import time
+from pathlib import Path
+from typing import Callable
+
+from helpers import io
+from helpers.ride import Ride
+from helpers.sweep import SweepTarget
+
+
+class LocationStats:
+    """The history of one location of one examination type.
+
+    Attributes:
+        sweeps: The number of times the location was swept.
+        empty: The number of sweeps without any rides.
+        errors: The number of sweeps in which the location could not be retrieved.
+        consecutive_empty: The number of empty sweeps since it last had rides.
+        consecutive_errors: The number of failed sweeps since it was last retrieved.
+        last_swept: The time of the last sweep, or None if it was never swept.
+        last_rides: The time it last had rides, or None if it never had any.
+    """
+
+    def __init__(
+        self,
+        sweeps: int = 0,
+        empty: int = 0,
+        errors: int = 0,
+        consecutive_empty: int = 0,
+        consecutive_errors: int = 0,
+        last_swept: float | None = None,
+        last_rides: float | None = None,
+    ) -> None:
+        """Initialize the LocationStats object.
+
+        The arguments are the attributes, so that the stats can be created
+        from their saved dictionary.
+        """
+        self.sweeps = sweeps
+        self.empty = empty
+        self.errors = errors
+        self.consecutive_empty = consecutive_empty
+        self.consecutive_errors = consecutive_errors
+        self.last_swept = last_swept
+        self.last_rides = last_rides
+
+    def to_dict(self) -> dict:
+        """Return the stats as a dictionary that can be saved as JSON."""
+        return dict(vars(self))
+
+
+class LocationIndex:
+    """The statistics of every location, deciding which ones are swept.
+
+    Attributes:
+        path: The path of the JSON file the index is saved to.
+        empty_sweeps: The number of empty sweeps in a row that demote a location.
+        error_sweeps: The number of failed sweeps in a row that demote a location.
+        slow_interval: The number of seconds between two sweeps of a location
+            in the slow lane.
+        locations: The stats of every location by examination type and location ID.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        empty_sweeps: int = 10,
+        error_sweeps: int = 3,
+        slow_interval: float = 21600,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """Initialize the LocationIndex object, loading the saved stats if any.
+
+        Args:
+            path: The path of the JSON file the index is saved to.
+            empty_sweeps: The number of empty sweeps in a row that demote a location.
+            error_sweeps: The number of failed sweeps in a row that demote a location.
+            slow_interval: The number of seconds between two sweeps of a
+                location in the slow lane.
+            clock: The function used to read the current time. The times are
+                saved, so it must be a wall clock.
+        """
+        self.path = path
+        self.empty_sweeps = empty_sweeps
+        self.error_sweeps = error_sweeps
+        self.slow_interval = slow_interval
+        self._clock = clock
+
+        # JSON keys are strings, so convert the location IDs back to integers
+        saved: dict[str, dict[str, dict]] = io.safe_json_load(path, default_value={})
+        self.locations: dict[str, dict[int, LocationStats]] = {
+            exam_type: {int(location_id): LocationStats(**stats) for location_id, stats in locations.items()}
+            for exam_type, locations in saved.items()
+        }
+
+    def stats(self, target: SweepTarget) -> LocationStats:
+        """Return the stats of a location, creating them if it was never swept."""
+        locations = self.locations.setdefault(target.exam_type, {})
+        if target.location_id not in locations:
+            locations[target.location_id] = LocationStats()
+        return locations[target.location_id]
+
+    def is_slow(self, target: SweepTarget) -> bool:
+        """Check whether a location is in the slow lane."""
+        stats = self.stats(target)
+        return stats.consecutive_empty >= self.empty_sweeps or stats.consecutive_errors >= self.error_sweeps
+
+    def select(self, targets: list[SweepTarget]) -> list[SweepTarget]:
+        """Choose the locations to sweep now.
+
+        Args:
+            targets: All locations.
+
+        Returns:
+            The locations in the fast lane, and the ones in the slow lane that
+            were not swept for `slow_interval` seconds, in their original order.
+        """
+        now = self._clock()
+        return [
+            target for target in targets
+            if not self.is_slow(target) or now - self.stats(target).last_swept >= self.slow_interval
+        ]
+
+    def record(self, target: SweepTarget, rides: list[Ride] | None) -> None:
+        """Update the stats of a swept location.
+
+        Args:
+            target: The location.
+            rides: The rides of the location, or None if it could not be retrieved.
+        """
+        stats = self.stats(target)
+        now = self._clock()
+        stats.sweeps += 1
+        stats.last_swept = now
+
+        if rides is None:
+            stats.errors += 1
+            stats.consecutive_errors += 1
+            return
+
+        stats.consecutive_errors = 0
+        if rides:
+            stats.consecutive_empty = 0
+            stats.last_rides = now
+        else:
+            stats.empty += 1
+            stats.consecutive_empty += 1
+
+    def save(self) -> None:
+        """Write the index to its file, replacing the previous one atomically."""
+        data = {
+            exam_type: {location_id: stats.to_dict() for location_id, stats in locations.items()}
+            for exam_type, locations in self.locations.items()
+        }
+        io.safe_write(json.dumps(data, indent=4), str(self.path))
@@ -0,0 +1,513 @@
+"""Delivery of the change events of the watch mode to notification sinks.
+
+The polling loop only hands the events of a poll to the `Notifier`, which
+copies them into the bounded queue of every sink and returns without any I/O.
+Every sink is served by its own `SinkWorker` thread, so a slow webhook never
+delays the next poll, nor the other sinks:
+
+- batching: the worker waits up to `batch_window` seconds after the first
+  queued notification for more to arrive, and sends up to `batch_size` of
+  them at once, so a burst of hundreds of released rides goes out as a few
+  batched notifications
+- retry: a failed delivery is retried with exponential backoff by a
+  `RetryPolicy`, and dropped after `max_attempts` attempts
+- overflow: when the queue of a sink is full, the oldest (or, with the
+  drop_newest policy, the new) notifications are dropped instead of blocking
+
+The delivered, dropped and failed notifications of every sink, and the
+latency from the poll to the delivery, are recorded in the metrics.
+"""
+import json
+import logging
+import platform
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Iterable, NamedTuple
+
+import requests
+
+from api import exceptions
+from api.metrics import Metrics
+from api.retry import RetryPolicy
+from helpers.diff import EventType, RideEvent
+from helpers.watch import Match
+from variables import constants
+
+# Errors of a sink that are handled by the retry policy. HTTP responses other
+# than 429 and 5xx are not retried.
+SINK_ERRORS = (exceptions.HTTPStatus, requests.exceptions.RequestException, OSError, subprocess.SubprocessError)
+
+# The overflow policies of the queue of a sink
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+# The number of notifications listed in the body of a desktop notification
+DESKTOP_MAX_LINES = 10
+
+
+class Notification(NamedTuple):
+    """A change event to deliver to the sinks.
+
+    Attributes:
+        exam_type: The examination type of the event.
+        event: The change event.
+        watchers: The names of the watch profiles matching the event.
+        created_at: The time the event was found, from `time.monotonic`.
+    """
+
+    exam_type: str
+    event: RideEvent
+    watchers: tuple[str, ...] = ()
+    created_at: float = 0.0
+
+    def describe(self) -> str:
+        """Describe the event in one line, like the log of the watch mode."""
+        ride = self.event.ride
+        text = f'[{self.event.type.value.capitalize()}] {ride.name}, {ride.date} {ride.time} in {ride.location} for {ride.cost}'
+
+        if self.event.type is EventType.CHANGED:
+            text += f' (was {self.event.previous.cost})'
+        if self.watchers:
+            text += f' [{", ".join(self.watchers)}]'
+        return text
+
+    def to_dict(self) -> dict:
+        """Return the notification as a dictionary that can be sent as JSON."""
+        previous = self.event.previous
+        return {
+            'type': self.event.type.value,
+            'exam_type': self.exam_type,
+            'location_id': self.event.location_id,
+            'ride': self.event.ride._asdict(),
+            'previous': previous._asdict() if previous is not None else None,
+            'watchers': list(self.watchers),
+            'text': self.describe(),
+        }
+
+
+def create_notifications(exam_type: str, events: Iterable[RideEvent], matches: Iterable[Match]) -> list[Notification]:
+    """Create the notifications of the events of a poll.
+
+    Args:
+        exam_type: The examination type of the polled location.
+        events: The change events of the poll.
+        matches: The watch profiles matching the events.
+
+    Returns:
+        A notification for every event, naming the profiles that match it.
+    """
+    watchers: dict[RideEvent, list[str]] = {}
+    for match in matches:
+        watchers.setdefault(match.event, []).append(match.profile.name)
+
+    now = time.monotonic()
+    return [
+        Notification(exam_type, event, tuple(watchers.get(event, ())), now)
+        for event in events
+    ]
+
+
+class WebhookSink:
+    """POST every batch as JSON to a URL.
+
+    The body is `{"notifications": [...]}`, with every notification as
+    returned by `Notification.to_dict`.
+
+    Attributes:
+        url: The URL of the webhook.
+        timeout: The number of seconds to wait for the response.
+    """
+
+    def __init__(self, url: str, timeout: float = 10, headers: dict = None) -> None:
+        """Initialize the WebhookSink object.
+
+        Args:
+            url: The URL of the webhook.
+            timeout: The number of seconds to wait for the response.
+            headers: Extra headers sent with every request, for example
+                for authentication.
+        """
+        self.url = url
+        self.timeout = timeout
+
+        # Keep the connection open between the batches
+        self._session = requests.session()
+        self._session.headers.update(headers or {})
+
+    def send(self, notifications: list[Notification]) -> None:
+        """Send a batch of notifications.
+
+        Raises:
+            HTTPStatus: If the webhook did not answer with a 2xx response.
+            RequestException: If the request failed.
+        """
+        r = self._session.post(
+            self.url,
+            json={'notifications': [notification.to_dict() for notification in notifications]},
+            timeout=self.timeout,
+        )
+        if not 200 <= r.status_code < 300:
+            raise exceptions.HTTPStatus(r.status_code)
+
+
+class CommandSink:
+    """Run a local command for every batch, with one notification per line on its stdin.
+
+    Attributes:
+        command: The command, as a list of arguments or a shell command line.
+        timeout: The number of seconds the command may run.
+    """
+
+    def __init__(self, command: list[str] | str, timeout: float = 30) -> None:
+        """Initialize the CommandSink object.
+
+        Args:
+            command: The command, as a list of arguments or a shell command line.
+            timeout: The number of seconds the command may run.
+        """
+        self.command = command
+        self.timeout = timeout
+
+    def send(self, notifications: list[Notification]) -> None:
+        """Run the command for a batch of notifications.
+
+        Raises:
+            CalledProcessError: If the command failed.
+            TimeoutExpired: If the command did not finish in time.
+        """
+        subprocess.run(
+            self.command,
+            input=''.join(f'{notification.describe()}\n' for notification in notifications),
+            shell=isinstance(self.command, str),
+            text=True,
+            capture_output=True,
+            timeout=self.timeout,
+            check=True,
+        )
+
+
+class DesktopSink:
+    """Show every batch as one desktop notification, with notify-send or osascript.
+
+    Attributes:
+        timeout: The number of seconds the notification command may run.
+    """
+
+    def __init__(self, timeout: float = 10) -> None:
+        """Initialize the DesktopSink object.
+
+        Args:
+            timeout: The number of seconds the notification command may run.
+
+        Raises:
+            ValueError: If desktop notifications are not supported on this system.
+        """
+        self.timeout = timeout
+        self._system = platform.system()
+
+        if self._system == 'Linux' and shutil.which('notify-send') is None:
+            raise ValueError('Desktop notifications need notify-send on Linux')
+        if self._system not in ('Linux', 'Darwin'):
+            raise ValueError(f'Desktop notifications are not supported on {self._system}')
+
+    def send(self, notifications: list[Notification]) -> None:
+        """Show a batch of notifications.
+
+        Raises:
+            CalledProcessError: If the notification could not be shown.
+        """
+        title = f'{len(notifications)} ride change{"s" if len(notifications) != 1 else ""}'
+        lines = [notification.describe() for notification in notifications[:DESKTOP_MAX_LINES]]
+        if len(notifications) > DESKTOP_MAX_LINES:
+            lines.append(f'and {len(notifications) - DESKTOP_MAX_LINES} more')
+        body = '\n'.join(lines)
+
+        if self._system == 'Darwin':
+            # JSON strings are valid AppleScript strings
+            script = f'display notification {json.dumps(body, ensure_ascii=False)} with title {json.dumps(title, ensure_ascii=False)}'
+            command = ['osascript', '-e', script]
+        else:
+            command = ['notify-send', '--app-name=trafikverket-helper', title, body]
+
+        subprocess.run(command, capture_output=True, timeout=self.timeout, check=True)
+
+
+class FileSink:
+    """Append every notification as a line of JSON to a file.
+
+    Attributes:
+        path: The path of the file.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        """Initialize the FileSink object.
+
+        Args:
+            path: The path of the file.
+        """
+        self.path = Path(path)
+
+    def send(self, notifications: list[Notification]) -> None:
+        """Append a batch of notifications to the file.
+
+        Raises:
+            OSError: If the file could not be written.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(
+                json.dumps(notification.to_dict(), ensure_ascii=False) + '\n'
+                for notification in notifications
+            )
+
+
+# The sinks by the type used in the configuration
+SINK_TYPES = {
+    'webhook': WebhookSink,
+    'command': CommandSink,
+    'desktop': DesktopSink,
+    'file': FileSink,
+}
+
+
+class SinkWorker:
+    """Deliver the notifications of one sink from its own queue and thread.
+
+    Attributes:
+        name: The name of the sink, used in the logs and metrics.
+        sink: The sink, with a `send` method taking a list of notifications.
+        batch_size: The maximum number of notifications sent at once.
+        batch_window: The number of seconds to wait for more notifications
+            after the first one of a batch.
+        queue_size: The maximum number of queued notifications.
+        overflow: What to drop when the queue is full, `DROP_OLDEST` or `DROP_NEWEST`.
+        only_matches: Whether to only deliver the events matching a watch profile.
+        retry_policy: The policy used to retry failed deliveries.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sink,
+        metrics: Metrics,
+        logger: logging.Logger,
+        batch_size: int = constants.NOTIFY_BATCH_SIZE,
+        batch_window: float = constants.NOTIFY_BATCH_WINDOW,
+        queue_size: int = constants.NOTIFY_QUEUE_SIZE,
+        overflow: str = DROP_OLDEST,
+        only_matches: bool = False,
+        max_attempts: int = constants.NOTIFY_MAX_ATTEMPTS,
+    ) -> None:
+        """Initialize the SinkWorker object and start its thread.
+
+        Args:
+            name: The name of the sink, used in the logs and metrics.
+            sink: The sink, with a `send` method taking a list of notifications.
+            metrics: The metrics recording the deliveries.
+            logger: The logger used to report failed deliveries.
+            batch_size: The maximum number of notifications sent at once.
+            batch_window: The number of seconds to wait for more
+                notifications after the first one of a batch.
+            queue_size: The maximum number of queued notifications.
+            overflow: What to drop when the queue is full, `DROP_OLDEST` or `DROP_NEWEST`.
+            only_matches: Whether to only deliver the events matching a watch profile.
+            max_attempts: The maximum number of attempts to deliver a batch.
+
+        Raises:
+            ValueError: If the overflow policy is unknown.
+        """
+        if overflow not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f'Unknown overflow policy {overflow!r} of notification sink {name!r}')
+
+        self.name = name
+        self.sink = sink
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.only_matches = only_matches
+        self.retry_policy = RetryPolicy(
+            max_attempts=max_attempts,
+            base_delay=constants.BACKOFF_BASE_DELAY,
+            max_delay=constants.BACKOFF_MAX_DELAY,
+            errors=SINK_ERRORS,
+            retryable_errors=SINK_ERRORS,
+        )
+        self._metrics = metrics
+        self._logger = logger
+
+        self._queue: deque[Notification] = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._deliver_forever, name=f'notify-{name}', daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of notifications waiting to be delivered."""
+        return len(self._queue)
+
+    def put(self, notifications: Iterable[Notification]) -> None:
+        """Queue notifications for delivery without blocking.
+
+        Args:
+            notifications: The notifications to deliver.
+        """
+        if self.only_matches:
+            notifications = [notification for notification in notifications if notification.watchers]
+        else:
+            notifications = list(notifications)
+        if not notifications:
+            return
+
+        dropped = 0
+        with self._condition:
+            for notification in notifications:
+                if len(self._queue) >= self.queue_size:
+                    dropped += 1
+                    if self.overflow == DROP_NEWEST:
+                        continue
+                    self._queue.popleft()
+                self._queue.append(notification)
+            self._condition.notify()
+
+        if dropped:
+            self._metrics.notifications.inc(self.name, 'dropped', amount=dropped)
+
+    def stop(self) -> None:
+        """Send the queued notifications without waiting for more, then stop the thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def join(self, timeout: float) -> None:
+        """Wait for the thread to deliver the queued notifications after `stop`.
+
+        Args:
+            timeout: The number of seconds to wait. The thread is abandoned
+                after that, so an unreachable sink never prevents the script
+                from exiting.
+        """
+        self._thread.join(timeout)
+
+    def _take_batch(self) -> list[Notification] | None:
+        """Wait for the next batch of notifications.
+
+        Returns:
+            The batch, or None once the worker is closed and the queue is empty.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._queue or self._closed)
+            if not self._queue:
+                return None
+
+            # Give the rest of a burst time to arrive, unless the worker is closing
+            deadline = time.monotonic() + self.batch_window
+            while len(self._queue) < self.batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            return [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+
+    def _deliver_forever(self) -> None:
+        """Deliver the queued notifications in batches until the worker is closed."""
+        while 1:
+            batch = self._take_batch()
+            if batch is None:
+                return
+
+            try:
+                self.retry_policy.call(self.sink.send, batch, key=self.name)
+            except SINK_ERRORS as e:
+                self._metrics.notifications.inc(self.name, 'failed', amount=len(batch))
+                self._logger.error('Could not deliver %s notifications to %s\n%s', len(batch), self.name, e)
+                continue
+
+            now = time.monotonic()
+            self._metrics.notifications.inc(self.name, 'delivered', amount=len(batch))
+            for notification in batch:
+                self._metrics.notification_latency.observe(now - notification.created_at, self.name)
+
+
+def create_worker(options: dict, metrics: Metrics, logger: logging.Logger) -> SinkWorker:
+    """Create the worker of a sink from its entry in the configuration.
+
+    Args:
+        options: The entry, with the type of the sink, its optional name and
+            delivery policy, and the arguments of the sink.
+        metrics: The metrics recording the deliveries.
+        logger: The logger used to report failed deliveries.
+
+    Returns:
+        The worker, with its thread started.
+
+    Raises:
+        ValueError: If the entry is not a valid sink.
+    """
+    options = dict(options)
+    sink_type = options.pop('type', None)
+    if sink_type not in SINK_TYPES:
+        raise ValueError(f'Unknown notification sink type {sink_type!r}, expected one of {", ".join(SINK_TYPES)}')
+
+    name = options.pop('name', sink_type)
+    policy = {
+        field: options.pop(field)
+        for field in ('batch_size', 'batch_window', 'queue_size', 'overflow', 'only_matches', 'max_attempts')
+        if field in options
+    }
+
+    try:
+        sink = SINK_TYPES[sink_type](**options)
+    except TypeError as e:
+        raise ValueError(f'Invalid options for notification sink {name!r}: {e}') from e
+
+    return SinkWorker(name, sink, metrics, logger, **policy)
+
+
+class Notifier:
+    """Hand the notifications of the polling loop to the workers of every sink.
+
+    Attributes:
+        workers: The worker of every sink.
+    """
+
+    def __init__(self, workers: Iterable[SinkWorker]) -> None:
+        """Initialize the Notifier object.
+
+        Args:
+            workers: The worker of every sink.
+        """
+        self.workers = list(workers)
+
+    def __len__(self) -> int:
+        """Return the number of sinks."""
+        return len(self.workers)
+
+    def publish(self, notifications: list[Notification]) -> None:
+        """Queue notifications for every sink, without waiting for their delivery."""
+        for worker in self.workers:
+            worker.put(notifications)
+
+    def stats(self) -> dict[str, dict]:
+        """Return the queue depth of every sink by name."""
+        return {worker.name: {'queue_depth': worker.queue_depth} for worker in self.workers}
+
+    def close(self, timeout: float = constants.NOTIFY_CLOSE_TIMEOUT) -> None:
+        """Deliver the queued notifications of every sink and stop their threads.
+
+        Args:
+            timeout: The number of seconds to wait for all sinks together.
+        """
+        for worker in self.workers:
+            worker.stop()
+
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
@@ -1,34 +1,214 @@
+"""Logging to the console and to rotating log files from a background thread.
+
+The logger only has a `QueueHandler`, which merges the message of every
+record with its arguments and puts it on a queue. A `QueueListener` thread
+takes the records from the queue and writes them to the console and the log
+files, so neither disk I/O nor colouring ever runs in the polling or sweeping
+threads.
+
+Messages are logged without colour codes. A message that should stand out is
+logged with a colour in its extra fields, `extra={'color': 'cyan'}`, and only
+the console of interactive runs colours it, so the log files never need to be
+stripped of colour codes.
+
+The log file rotates when it grows beyond `max_bytes`, or at the interval
+given by `when` (for example 'midnight'), and the rotated files are
+compressed with gzip. The optional JSON lines log keeps the raw fields of
+every record, including the message template and its arguments.
+"""
+import atexit
+import contextlib
+import gzip
+import json
 import logging
+import logging.handlers
 import os
-import time
+import queue
+import shutil
+from typing import Callable, Iterator, TextIO
 
-import click
-import coloredlogs
 import verboselogs
 
+# The names of the log files in the log directory
+LOG_FILE_NAME = 'trafikverket.log'
+JSON_LOG_FILE_NAME = 'trafikverket.jsonl'
+
+
+def to_json_value(value):
+    """Return a value as is if JSON can represent it, and as a string otherwise."""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
 
-class RemoveColorFilter(logging.Filter):
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """A queue handler that keeps the template and arguments of every message."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merge the message with its arguments, keeping both for the JSON lines log."""
+        template, args = record.msg, record.args
+        record = super().prepare(record)
+
+        record.template = str(template)
+        if isinstance(args, dict):
+            record.fields = {key: to_json_value(value) for key, value in args.items()}
+        else:
+            record.fields = [to_json_value(arg) for arg in args or ()]
+        return record
+
+
+class RedirectedStream:
+    """A stream that writes through a function, such as `tqdm.write` while a progress bar is shown.
+
+    Attributes:
+        write_function: The function writing a line to a stream.
+        stream: The stream the function writes to.
     """
-    A logging filter that removes color codes from log messages.
+
+    def __init__(self, write_function: Callable[[str, TextIO], None], stream: TextIO) -> None:
+        """Initialize the RedirectedStream object.
+
+        Args:
+            write_function: The function writing a line to a stream, which
+                ends the line itself like `tqdm.write`.
+            stream: The stream the function writes to.
+        """
+        self.write_function = write_function
+        self.stream = stream
+
+    def write(self, text: str) -> None:
+        """Write a formatted record, without the line end added by the handler."""
+        self.write_function(text.removesuffix('\n'), self.stream)
+
+    def flush(self) -> None:
+        """Do nothing, the write function flushes the stream itself."""
+
+
+# The console handlers of the loggers, redirected while a progress bar is shown
+console_handlers: list[logging.StreamHandler] = []
+
+
+@contextlib.contextmanager
+def redirect_console(write_function: Callable[[str, TextIO], None]) -> Iterator[None]:
+    """Write the console output of every logger through a function within the context.
+
+    The console is written by the listener thread, so the handlers of the
+    logger itself cannot be swapped like `tqdm.contrib.logging` does.
+
+    Args:
+        write_function: The function writing a line to a stream, for
+            example `tqdm.write` to print above a progress bar.
     """
+    streams = [handler.setStream(RedirectedStream(write_function, handler.stream)) for handler in console_handlers]
+    try:
+        yield
+    finally:
+        for handler, stream in zip(console_handlers, streams):
+            handler.setStream(stream)
+
 
-    def filter(self, record):
-        # Check if record is valid and has a message
-        if record and record.msg and isinstance(record.msg, str):
-            # Remove color codes from log message
-            record.msg = click.unstyle(record.msg)
+class ColorFormatter(logging.Formatter):
+    """Colour the messages that have a colour in their extra fields, then format them."""
 
-        # Return True to allow the log message to be processed
-        return True
+    def __init__(self, formatter: logging.Formatter) -> None:
+        """Initialize the ColorFormatter object.
 
+        Args:
+            formatter: The formatter of the coloured records.
+        """
+        super().__init__()
+        self._formatter = formatter
 
-def create_logger(name=None, logging_dir=None) -> logging.Logger:
+        # Only import termcolor when it is needed
+        from termcolor import colored
+        self._colored = colored
+
+    def format(self, record: logging.LogRecord) -> str:
+        color = getattr(record, 'color', None)
+        if color is not None:
+            # Colour a copy, so that the other handlers see the plain message
+            record = logging.makeLogRecord(record.__dict__)
+            record.msg = self._colored(record.getMessage(), color)
+            record.args = None
+        return self._formatter.format(record)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Format every record as a line of JSON with its raw fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+            'template': getattr(record, 'template', record.msg),
+            'fields': getattr(record, 'fields', []),
+        }, ensure_ascii=False)
+
+
+def compress_rotated(source: str, dest: str) -> None:
+    """Compress a rotated log file with gzip, removing the uncompressed file."""
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def create_file_handler(path: str, max_bytes: int, backup_count: int, when: str | None) -> logging.Handler:
+    """Create a handler writing to a file that rotates and compresses its old files.
+
+    Args:
+        path: The path of the log file.
+        max_bytes: The size in bytes at which the file rotates, 0 for no limit.
+            Ignored if when is set.
+        backup_count: The number of rotated files to keep.
+        when: The interval at which the file rotates, as accepted by
+            `TimedRotatingFileHandler`, for example 'midnight'. Defaults to
+            rotating by size.
+
+    Returns:
+        The handler.
+    """
+    if when is not None:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=when, backupCount=backup_count, encoding='utf-8'
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        )
+
+    # Compress the rotated files, in the listener thread like every write
+    handler.namer = lambda name: f'{name}.gz'
+    handler.rotator = compress_rotated
+    return handler
+
+
+def create_logger(
+    name=None,
+    logging_dir=None,
+    use_colors=True,
+    max_bytes: int = 10485760,
+    backup_count: int = 5,
+    when: str = None,
+    json_lines: bool = False,
+) -> logging.Logger:
     """
     Create a logger.
 
     Args:
         name: The name of the logger. Defaults to None.
         logging_dir: The directory to store log files in. Defaults to None.
+        use_colors: Whether to colour the console output. Defaults to True.
+            Headless runs disable it, which also skips importing coloredlogs.
+        max_bytes: The size in bytes at which the log file rotates, 0 for no
+            limit. Defaults to 10 MiB.
+        backup_count: The number of rotated log files to keep. Defaults to 5.
+        when: The interval at which the log file rotates instead, for example
+            'midnight'. Defaults to None, rotating by size.
+        json_lines: Whether to also write every record with its raw fields
+            to a JSON lines log. Defaults to False.
 
     Returns:
         A logger instance.
@@ -36,6 +216,7 @@ def create_logger(name=None, logging_dir=None) -> logging.Logger:
 
     # Initialize verbose logger
     logger = verboselogs.VerboseLogger(name)
+    logger.setLevel(logging.INFO)
 
     # Check if the /log directory exists
     if not os.path.isdir(logging_dir):
@@ -48,43 +229,54 @@ def create_logger(name=None, logging_dir=None) -> logging.Logger:
     else:
         fmt = "[%(levelname)s] %(asctime)s: %(message)s"
 
-    # Setup logging
-    coloredlogs.install(
-        level=20,
-        fmt=fmt,
-        level_styles={
-            "critical": {"bold": True, "color": "red"},
-            "debug": {"color": "green"},
-            "error": {"color": "red"},
-            "info": {"color": "white"},
-            "notice": {"color": "magenta"},
-            "spam": {"color": "green", "faint": True},
-            "success": {"bold": True, "color": "green"},
-            "verbose": {"color": "blue"},
-            "warning": {"color": "yellow"},
-        },
-        logger=logger,
-        field_styles={
-            "asctime": {"color": "cyan"},
-            "levelname": {"bold": True, "color": "black"},
-        },
-        isatty=True,
-    )
-
-    # Add file handler to logger
-    log_file = os.path.join(logging_dir, f"{int(time.time())}.log")
-    file_handler = logging.FileHandler(log_file)
-    logger.addHandler(file_handler)
-
-    # Create formatter and set it for the file handler
-    formatter = logging.Formatter(fmt)
-    file_handler.setFormatter(formatter)
-
-    # Filter out all colors from the output
-    color_filter = RemoveColorFilter()
-    file_handler.addFilter(color_filter)
-
-    # Set log level for file handler
-    file_handler.setLevel(logging.DEBUG)
+    console_handler = logging.StreamHandler()
+    console_handlers.append(console_handler)
+    if use_colors:
+        # Only import coloredlogs when it is needed
+        import coloredlogs
+
+        # Colour the levels and fields, and the messages logged with a colour
+        console_handler.setFormatter(ColorFormatter(coloredlogs.ColoredFormatter(
+            fmt=fmt,
+            level_styles={
+                "critical": {"bold": True, "color": "red"},
+                "debug": {"color": "green"},
+                "error": {"color": "red"},
+                "info": {"color": "white"},
+                "notice": {"color": "magenta"},
+                "spam": {"color": "green", "faint": True},
+                "success": {"bold": True, "color": "green"},
+                "verbose": {"color": "blue"},
+                "warning": {"color": "yellow"},
+            },
+            field_styles={
+                "asctime": {"color": "cyan"},
+                "levelname": {"bold": True, "color": "black"},
+            },
+        )))
+    else:
+        # Log plain messages to the console
+        console_handler.setFormatter(logging.Formatter(fmt))
+    handlers = [console_handler]
+
+    # Write the log file, rotating and compressing it
+    file_handler = create_file_handler(os.path.join(logging_dir, LOG_FILE_NAME), max_bytes, backup_count, when)
+    file_handler.setFormatter(logging.Formatter(fmt))
+    handlers.append(file_handler)
+
+    # Write the raw fields of every record if enabled
+    if json_lines:
+        json_handler = create_file_handler(os.path.join(logging_dir, JSON_LOG_FILE_NAME), max_bytes, backup_count, when)
+        json_handler.setFormatter(JsonLinesFormatter())
+        handlers.append(json_handler)
+
+    # Hand the records to a background thread writing them to every handler
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(LogQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    # Write the queued records before exiting
+    atexit.register(listener.stop)
 
     return logger
@@ -0,0 +1,243 @@
+"""Profiling of a sweep or of a number of polls.
+
+The `Profiler` runs cProfile in every thread started while it is running,
+so the worker threads and the event loop of the asyncio client are profiled
+along with the main thread, and traces the allocations with tracemalloc.
+When it stops, the profiles of all threads are merged into one pstats file
+and a report splits the time into the parts of the request path:
+
+- network wait: time blocked in sockets, TLS and the event loop selector
+- JSON parsing: decoding the response bodies with `api.codec.loads`
+- strip_useless_info: converting the bundles into rides
+- sorting: sorting rides and keeping the earliest ones
+- diffing: comparing the rides with their previous state
+- logging and colouring: formatting, colouring and writing the log messages
+- waiting on other threads: blocked on locks and queues, for example idle
+  workers and the main thread waiting for them
+
+The time of a category is the time spent in its functions and everything
+they call, except the time spent in other categories. It is summed over all
+threads, so it can exceed the wall time of the run.
+
+The saved profile can be explored further with `python -m pstats <file>`.
+"""
+import cProfile
+import io
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+# A function in a pstats profile: file name, line number and function name
+Function = tuple[str, int, str]
+
+# Built-in functions blocking on the network
+NETWORK_BUILTINS = re.compile(r"'_socket\.socket'|'select\.|'_ssl\._SSLSocket'|_socket\.getaddrinfo")
+
+# Built-in functions sorting or maintaining heaps
+SORTING_BUILTINS = re.compile(r"builtins\.sorted>|method 'sort' of 'list' objects|_heapq\.")
+
+# Built-in functions blocking on locks and queues
+LOCK_BUILTINS = re.compile(r"of '_thread\.(lock|RLock)' objects|of '_queue\.SimpleQueue' objects")
+
+
+def _in_module(function: Function, *modules: str) -> bool:
+    """Check whether a function is defined in one of the given modules or packages."""
+    file_name = function[0].replace('\\', '/')
+    return any(module in file_name for module in modules)
+
+
+# Whether a function belongs to each category, in the order of the report
+CATEGORIES: dict[str, Callable[[Function], bool]] = {
+    'network wait': lambda function: function[0] == '~' and bool(NETWORK_BUILTINS.search(function[2])),
+    'JSON parsing': lambda function: function[2] == 'loads' and _in_module(function, 'api/codec.py'),
+    'strip_useless_info': lambda function: function[2] == 'strip_useless_info',
+    'sorting': lambda function: (
+        (function[0] == '~' and bool(SORTING_BUILTINS.search(function[2])))
+        or _in_module(function, 'helpers/earliest.py')
+    ),
+    'diffing': lambda function: _in_module(function, 'helpers/diff.py'),
+    'logging and colouring': lambda function: _in_module(
+        function, '/logging/', '/termcolor/', '/coloredlogs/', '/humanfriendly/', '/verboselogs/', 'helpers/output.py'
+    ),
+    'waiting on other threads': lambda function: function[0] == '~' and bool(LOCK_BUILTINS.search(function[2])),
+}
+
+
+def categorize(stats: pstats.Stats) -> dict[str, float]:
+    """Split the profiled time into the categories.
+
+    Args:
+        stats: The profile.
+
+    Returns:
+        The seconds spent in every category, followed by the seconds spent
+        elsewhere under 'other'.
+    """
+    # Find the category of every function
+    category_of: dict[Function, str] = {}
+    for function in stats.stats:
+        for category, matches in CATEGORIES.items():
+            if matches(function):
+                category_of[function] = category
+                break
+
+    times = dict.fromkeys(CATEGORIES, 0.0)
+    for function, category in category_of.items():
+        _, _, _, cumulative_time, callers = stats.stats[function]
+
+        # Threads starting in the function have no callers
+        if not callers:
+            times[category] += cumulative_time
+
+        for caller, (_, _, _, edge_time) in callers.items():
+            caller_category = category_of.get(caller)
+            if caller_category == category:
+                # Already counted by the call entering the category
+                continue
+
+            times[category] += edge_time
+            if caller_category is not None:
+                # Move the time out of the calling category
+                times[caller_category] -= edge_time
+
+    times['other'] = max(0.0, stats.total_tt - sum(times.values()))
+    return times
+
+
+class Profiler:
+    """Profile the time of every thread and the allocations of a run.
+
+    Attributes:
+        wall_time: The number of seconds the profiler ran.
+    """
+
+    def __init__(self, top_allocations: int = 20, top_functions: int = 30) -> None:
+        """Initialize the Profiler object.
+
+        Args:
+            top_allocations: The number of allocation sites in the report.
+            top_functions: The number of functions in the report.
+        """
+        self.top_allocations = top_allocations
+        self.top_functions = top_functions
+        self.wall_time = 0.0
+        self._profiles: list[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._snapshot: tracemalloc.Snapshot | None = None
+        self._peak_memory = 0
+        self._start_time = 0.0
+
+    def _profile_thread(self, frame, event, arg) -> None:
+        """Start profiling a new thread.
+
+        Installed with `threading.setprofile`, so it is called on the first
+        event of every thread started while the profiler runs, and replaces
+        itself with a profiler of the thread.
+        """
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Since Python 3.12 the profiler of the main thread already sees every thread
+            return
+
+        with self._lock:
+            self._profiles.append(profile)
+
+    def start(self) -> None:
+        """Start profiling the current thread and every new thread."""
+        tracemalloc.start()
+        threading.setprofile(self._profile_thread)
+
+        profile = cProfile.Profile()
+        self._profiles.append(profile)
+        self._start_time = time.perf_counter()
+        profile.enable()
+
+    def stop(self) -> None:
+        """Stop profiling and take the snapshot of the allocations."""
+        self._profiles[0].disable()
+        self.wall_time = time.perf_counter() - self._start_time
+        threading.setprofile(None)
+
+        self._snapshot = tracemalloc.take_snapshot()
+        self._peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def stats(self) -> pstats.Stats:
+        """Return the merged profile of all threads."""
+        with self._lock:
+            profiles = list(self._profiles)
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            # Threads that never ran any Python code have no entries
+            try:
+                stats.add(profile)
+            except TypeError:
+                pass
+        return stats
+
+    def report(self, stats: pstats.Stats) -> str:
+        """Format the time by category, the slowest functions and the largest allocations.
+
+        Args:
+            stats: The merged profile of all threads.
+        """
+        lines = [
+            f'Wall time: {self.wall_time:.2f}s over {len(self._profiles)} threads, '
+            f'{stats.total_tt:.2f}s profiled',
+            '',
+            'Time by category (seconds summed over all threads):',
+        ]
+        for category, seconds in categorize(stats).items():
+            share = seconds / stats.total_tt if stats.total_tt else 0
+            lines.append(f'  {category:<26} {seconds:9.3f}s {share:7.1%}')
+
+        # List the slowest functions, including what they call
+        output = io.StringIO()
+        stats.stream = output
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_functions)
+        lines += ['', f'Top {self.top_functions} functions by cumulative time:', output.getvalue().strip()]
+
+        lines += [
+            '',
+            f'Peak traced memory: {self._peak_memory / 2 ** 20:.1f} MiB',
+            f'Top {self.top_allocations} allocation sites still held at the end:',
+        ]
+        for statistic in self._snapshot.statistics('lineno')[:self.top_allocations]:
+            frame = statistic.traceback[0]
+            lines.append(
+                f'  {statistic.size / 1024:10.1f} KiB {statistic.count:8} blocks  {frame.filename}:{frame.lineno}'
+            )
+
+        return '\n'.join(lines) + '\n'
+
+    def save(self, directory: Path, name: str) -> tuple[Path, Path, dict[str, float]]:
+        """Save the merged profile and the report.
+
+        Args:
+            directory: The directory to save the files in. It is created if needed.
+            name: The name of the profiled run, used in the file names.
+
+        Returns:
+            The paths of the pstats file and the report, and the seconds
+            spent in every category.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        file_stem = f'{name}-{time.strftime("%Y%m%d-%H%M%S")}'
+        stats_path = directory / f'{file_stem}.pstats'
+        report_path = directory / f'{file_stem}.txt'
+
+        stats = self.stats()
+        stats.dump_stats(stats_path)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(self.report(stats))
+
+        return stats_path, report_path, categorize(stats)
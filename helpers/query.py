@@ -0,0 +1,162 @@
+"""Indexed in-memory queries over the available rides.
+
+A `RideIndex` is built once from the current rides and can then answer many
+queries, such as "the earliest Körprov B in these locations between these
+dates under this cost", without scanning every ride:
+
+- the rides are stored sorted by date and time, so a date range is found
+  with two binary searches
+- the positions of the rides of every location and every examination name
+  are indexed, so only the rides matching those filters are visited, and
+  several filters are combined by intersecting their positions
+- the costs are parsed once when the index is built
+
+The index is immutable; build a new one when the rides change.
+"""
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from typing import Collection, Iterable, Iterator, NamedTuple
+
+from helpers.ride import Ride
+
+
+def parse_cost(cost: str) -> int | None:
+    """Parse the cost of a ride, for example '325 kr'.
+
+    Args:
+        cost: The cost as returned by the server.
+
+    Returns:
+        The cost in SEK, or None if it does not contain a number.
+    """
+    digits = ''.join(character for character in cost if character.isdigit())
+    return int(digits) if digits else None
+
+
+class RideQuery(NamedTuple):
+    """A query over the available rides. Every filter that is None matches all rides.
+
+    Attributes:
+        locations: The names of the locations to include.
+        names: The names of the examinations to include, for example 'Körprov B'.
+        start_date: The first date to include, in the format 'YYYY-MM-DD'.
+        end_date: The last date to include, in the format 'YYYY-MM-DD'.
+        max_cost: The highest cost to include, in SEK. Rides with an unknown
+            cost are excluded when it is set.
+        limit: The maximum number of rides to return.
+    """
+
+    locations: Collection[str] | None = None
+    names: Collection[str] | None = None
+    start_date: str | None = None
+    end_date: str | None = None
+    max_cost: int | None = None
+    limit: int | None = None
+
+
+class RideIndex:
+    """Rides sorted by date and time, indexed by location and examination name."""
+
+    def __init__(self, rides: Iterable[Ride]) -> None:
+        """Build the index.
+
+        Args:
+            rides: The rides to index.
+        """
+        self._rides = sorted(rides)
+        self._dates = [ride.date for ride in self._rides]
+        self._costs = [parse_cost(ride.cost) for ride in self._rides]
+
+        # Map every location and name to the sorted positions of its rides
+        self._by_location: dict[str, list[int]] = {}
+        self._by_name: dict[str, list[int]] = {}
+        for position, ride in enumerate(self._rides):
+            self._by_location.setdefault(ride.location, []).append(position)
+            self._by_name.setdefault(ride.name, []).append(position)
+
+    def __len__(self) -> int:
+        """Return the number of indexed rides."""
+        return len(self._rides)
+
+    def locations(self) -> list[str]:
+        """Return the names of the locations with rides, in alphabetical order."""
+        return sorted(self._by_location)
+
+    def names(self) -> list[str]:
+        """Return the names of the examinations with rides, in alphabetical order."""
+        return sorted(self._by_name)
+
+    def query(self, query: RideQuery) -> list[Ride]:
+        """Find the rides matching a query.
+
+        Args:
+            query: The query.
+
+        Returns:
+            The matching rides, earliest first.
+        """
+        rides = []
+        if query.limit is not None and query.limit <= 0:
+            return rides
+
+        for position in self._positions(query):
+            if query.max_cost is not None:
+                cost = self._costs[position]
+                if cost is None or cost > query.max_cost:
+                    continue
+
+            rides.append(self._rides[position])
+            if len(rides) == query.limit:
+                break
+
+        return rides
+
+    def earliest(self, query: RideQuery = RideQuery()) -> Ride | None:
+        """Find the earliest ride matching a query.
+
+        Args:
+            query: The query. Its limit is ignored.
+
+        Returns:
+            The earliest matching ride, or None if no ride matches.
+        """
+        rides = self.query(query._replace(limit=1))
+        return rides[0] if rides else None
+
+    def _positions(self, query: RideQuery) -> Iterator[int]:
+        """Iterate over the positions of the rides matching the indexed filters, in order."""
+        # Find the range of positions within the dates with binary searches
+        start = 0 if query.start_date is None else bisect_left(self._dates, query.start_date)
+        end = len(self._rides) if query.end_date is None else bisect_right(self._dates, query.end_date)
+        if start >= end:
+            return iter(())
+
+        # Collect the positions of every indexed filter within the range
+        candidates = [
+            self._union(index, values, start, end)
+            for index, values in ((self._by_location, query.locations), (self._by_name, query.names))
+            if values is not None
+        ]
+        if not candidates:
+            return iter(range(start, end))
+
+        # Walk the smallest list and check the others, which keeps the order
+        candidates.sort(key=len)
+        smallest, others = candidates[0], [set(positions) for positions in candidates[1:]]
+        return (
+            position for position in smallest
+            if all(position in positions for positions in others)
+        )
+
+    @staticmethod
+    def _union(index: dict[str, list[int]], values: Collection[str], start: int, end: int) -> list[int]:
+        """Merge the sorted positions of several index values within a range."""
+        ranges = []
+        for value in set(values):
+            positions = index.get(value)
+            if positions:
+                ranges.append(positions[bisect_left(positions, start):bisect_left(positions, end)])
+
+        if len(ranges) == 1:
+            return ranges[0]
+        return list(merge(*ranges))
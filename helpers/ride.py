@@ -0,0 +1,55 @@
+"""Compact record of an available ride.
+
+A `Ride` is an immutable named tuple holding only the fields used by the
+script. The fields are ordered so that sorting rides sorts them by date and
+time, and the string values are interned, since the same few dates, times,
+locations and names are shared by thousands of rides.
+"""
+import sys
+from typing import NamedTuple
+
+
+class Ride(NamedTuple):
+    """An available ride.
+
+    Attributes:
+        date: The date of the ride, in the format 'YYYY-MM-DD'.
+        time: The time of the ride, in the format 'HH:MM'.
+        location: The name of the location.
+        name: The name of the examination, for example 'Körprov B'.
+        cost: The cost of the examination.
+    """
+
+    date: str
+    time: str
+    location: str
+    name: str
+    cost: str
+
+    @classmethod
+    def from_bundle(cls, bundle: dict) -> 'Ride':
+        """Create a ride from a raw bundle dictionary from the server.
+
+        Args:
+            bundle: The raw bundle dictionary.
+
+        Returns:
+            The ride.
+        """
+        occasion = bundle['occasions'][0]
+        return cls(
+            date=sys.intern(occasion['date']),
+            time=sys.intern(occasion['time']),
+            location=sys.intern(occasion['locationName']),
+            name=sys.intern(occasion['name']),
+            cost=occasion['cost'],
+        )
+
+    @property
+    def key(self) -> tuple[str, str, str, str]:
+        """The identity of the ride: its date, time, location and name.
+
+        Two rides with the same key are the same occasion, even if their
+        cost differs.
+        """
+        return self[:4]
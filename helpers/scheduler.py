@@ -0,0 +1,206 @@
+"""Adaptive per-location polling for the change logging mode.
+
+Instead of re-polling every location on one global interval, every location
+gets its own next-due time in a priority queue. The polling interval of a
+location shrinks when its rides change and grows while they stay the same,
+within configurable bounds. A token bucket caps the total number of requests
+per hour, so that busy locations can only be polled more often by polling
+dead locations less often.
+"""
+import heapq
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Callable, Hashable
+
+# Factor applied to the interval of a location whose rides changed
+CHANGED_FACTOR = 0.5
+
+# Factor applied to the interval of a location whose rides stayed the same
+UNCHANGED_FACTOR = 1.25
+
+
+class PollScheduler:
+    """A priority queue of locations ordered by their next-due time.
+
+    Attributes:
+        intervals: The current polling interval in seconds for each location.
+        min_interval: The shortest polling interval in seconds.
+        max_interval: The longest polling interval in seconds.
+        requests_per_hour: The maximum number of polls per hour, over all
+            locations.
+    """
+
+    def __init__(
+        self,
+        location_ids: list[Hashable],
+        initial_interval: float,
+        min_interval: float,
+        max_interval: float,
+        requests_per_hour: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize the PollScheduler object.
+
+        All locations are due immediately. The request budget allows a burst
+        of one poll per location, so that the first sweep is not throttled.
+
+        Args:
+            location_ids: The locations to poll.
+            initial_interval: The polling interval in seconds that every
+                location starts with.
+            min_interval: The shortest polling interval in seconds.
+            max_interval: The longest polling interval in seconds.
+            requests_per_hour: The maximum number of polls per hour.
+            clock: The function used to read the current time.
+
+        Raises:
+            ValueError: If the request budget is not positive.
+        """
+        if requests_per_hour <= 0:
+            raise ValueError(f'The request budget must be positive, got {requests_per_hour} requests per hour')
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.requests_per_hour = requests_per_hour
+        self._clock = clock
+
+        now = clock()
+        initial_interval = min(max(initial_interval, min_interval), max_interval)
+        self.intervals = {location_id: initial_interval for location_id in location_ids}
+
+        # Heap of (due time, insertion order, location ID)
+        self._queue = [(now, i, location_id) for i, location_id in enumerate(location_ids)]
+        self._counter = len(self._queue)
+
+        # Token bucket for the request budget
+        self._burst = max(len(location_ids), 1)
+        self._tokens = float(self._burst)
+        self._last_refill = now
+
+    def __len__(self) -> int:
+        """Return the number of locations waiting in the queue."""
+        return len(self._queue)
+
+    def _refill(self, now: float) -> None:
+        """Add the tokens earned since the last refill to the bucket."""
+        self._tokens = min(
+            self._burst,
+            self._tokens + (now - self._last_refill) * self.requests_per_hour / 3600
+        )
+        self._last_refill = now
+
+    def time_until_next(self) -> float:
+        """Return the number of seconds until the next poll may be sent.
+
+        Returns:
+            The number of seconds, or infinity if no location is queued.
+        """
+        if not self._queue:
+            return float('inf')
+
+        now = self._clock()
+        self._refill(now)
+
+        # Wait for both the location to be due and a token to be available
+        due_in = self._queue[0][0] - now
+        token_in = (1 - self._tokens) * 3600 / self.requests_per_hour
+        return max(due_in, token_in, 0.0)
+
+    def pop_due(self) -> Hashable | None:
+        """Take the next location off the queue if it may be polled now.
+
+        The location is not queued again until `reschedule` is called for it.
+
+        Returns:
+            The location ID, or None if no location may be polled yet.
+        """
+        if self.time_until_next() > 0:
+            return None
+
+        self._tokens -= 1
+        return heapq.heappop(self._queue)[2]
+
+    def reschedule(self, location_id: Hashable, changed: bool | None) -> float:
+        """Adapt the interval of a polled location and queue it again.
+
+        Args:
+            location_id: The location that was polled.
+            changed: True if the rides of the location changed, False if they
+                stayed the same, or None if the poll failed, in which case the
+                interval is kept as it is.
+
+        Returns:
+            The new polling interval of the location in seconds.
+        """
+        interval = self.intervals[location_id]
+
+        if changed is not None:
+            interval *= CHANGED_FACTOR if changed else UNCHANGED_FACTOR
+            interval = min(max(interval, self.min_interval), self.max_interval)
+            self.intervals[location_id] = interval
+
+        heapq.heappush(self._queue, (self._clock() + interval, self._counter, location_id))
+        self._counter += 1
+
+        return interval
+
+
+def poll_forever(
+    scheduler: PollScheduler,
+    submit: Callable[[Hashable], Future],
+    on_polled: Callable[[Hashable, Future], bool | None],
+    max_in_flight: int,
+    on_idle: Callable[[float], None] = None,
+    max_polls: int = None,
+) -> None:
+    """Poll the locations of a scheduler as they become due, forever or
+    until a number of polls have landed.
+
+    The result of every poll is handed to `on_polled` as soon as it lands,
+    without waiting for any other location.
+
+    Args:
+        scheduler: The scheduler deciding when each location is polled.
+        submit: A function that starts polling a location and returns a
+            future of the result, for example `ThreadPoolExecutor.submit`.
+        on_polled: A function called with the location ID and the completed
+            future. It returns whether the rides of the location changed, or
+            None if the poll failed.
+        max_in_flight: The maximum number of polls running at once.
+        on_idle: An optional function called roughly every second while
+            waiting, with the number of seconds until the next poll.
+        max_polls: The number of polls after which to return, once they have
+            all landed. Defaults to None, which polls forever.
+    """
+    in_flight = {}
+    submitted = 0
+
+    while max_polls is None or submitted < max_polls or in_flight:
+        # Start polling every location that is due, up to the concurrency limit
+        # and the number of polls
+        while (
+            len(in_flight) < max_in_flight
+            and (max_polls is None or submitted < max_polls)
+            and (location_id := scheduler.pop_due()) is not None
+        ):
+            in_flight[submit(location_id)] = location_id
+            submitted += 1
+
+        # Wait for a poll to land or for the next location to become due
+        if len(in_flight) >= max_in_flight:
+            timeout = 1.0
+        else:
+            timeout = min(scheduler.time_until_next(), 1.0)
+        if on_idle is not None:
+            on_idle(scheduler.time_until_next())
+
+        if not in_flight:
+            time.sleep(timeout)
+            continue
+
+        done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        # Handle the landed polls and queue their locations again
+        for future in done:
+            location_id = in_flight.pop(future)
+            scheduler.reschedule(location_id, on_polled(location_id, future))
@@ -0,0 +1,187 @@
+"""Persistent SQLite storage of the available rides.
+
+Every poll of a location is saved to an SQLite database in WAL mode, so that
+the change logging mode can pick up where it left off after a restart, and so
+that the history of every ride is kept. A ride is stored in one row from the
+moment it is first seen until it is removed; rides that are still available
+have no removal time.
+
+Writes are queued and performed in batches by a background thread, so they
+never block the polling loop.
+"""
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from helpers.ride import Ride
+
+# The columns holding the fields of a ride, in the order of the fields
+RIDE_FIELDS = Ride._fields
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS rides (
+    exam_type TEXT NOT NULL,
+    location_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    location TEXT NOT NULL,
+    name TEXT NOT NULL,
+    cost TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    removed_at REAL
+);
+CREATE INDEX IF NOT EXISTS rides_by_date ON rides (exam_type, date, location);
+CREATE INDEX IF NOT EXISTS current_rides ON rides (exam_type, location_id) WHERE removed_at IS NULL;
+'''
+
+
+def connect(database_path: str | Path) -> sqlite3.Connection:
+    """Open the database, creating the tables if needed.
+
+    Args:
+        database_path: The path of the database file.
+
+    Returns:
+        The database connection.
+    """
+    connection = sqlite3.connect(database_path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+class SnapshotStore:
+    """Save the rides of every polled location in the background.
+
+    Attributes:
+        database_path: The path of the database file.
+    """
+
+    def __init__(self, database_path: str | Path, logger: logging.Logger, batch_size: int = 256) -> None:
+        """Initialize the SnapshotStore object and start its writer thread.
+
+        Args:
+            database_path: The path of the database file.
+            logger: The logger used to report write errors.
+            batch_size: The maximum number of queued polls written in one
+                transaction.
+        """
+        self.database_path = database_path
+        self._logger = logger
+        self._batch_size = batch_size
+        self._queue = queue.Queue()
+
+        # Create the tables before anything reads from the database
+        connect(database_path).close()
+
+        self._writer = threading.Thread(target=self._write_forever, daemon=True)
+        self._writer.start()
+
+    def load_current(self, exam_type: str) -> dict[int, list[Ride]]:
+        """Load the last known rides of every location.
+
+        Args:
+            exam_type: The examination type, for example 'Körprov'.
+
+        Returns:
+            A dictionary mapping each location ID to its rides.
+        """
+        connection = connect(self.database_path)
+        try:
+            rows = connection.execute(
+                f'SELECT location_id, {", ".join(RIDE_FIELDS)} FROM rides '
+                'WHERE exam_type = ? AND removed_at IS NULL',
+                (exam_type,),
+            ).fetchall()
+        finally:
+            connection.close()
+
+        current_rides = {}
+        for location_id, *values in rows:
+            current_rides.setdefault(location_id, []).append(Ride(*values))
+
+        return current_rides
+
+    def save(self, exam_type: str, location_id: int, rides: list[Ride]) -> None:
+        """Queue the rides found in a poll of a location to be saved.
+
+        Rides that were stored for the location but are missing from the new
+        list are marked as removed.
+
+        Args:
+            exam_type: The examination type, for example 'Körprov'.
+            location_id: The ID of the polled location.
+            rides: The rides found in the location.
+        """
+        self._queue.put((exam_type, location_id, rides, time.time()))
+
+    def close(self) -> None:
+        """Write all queued polls and stop the writer thread."""
+        self._queue.put(None)
+        self._writer.join()
+
+    def _write_forever(self) -> None:
+        """Write the queued polls in batches until the store is closed."""
+        connection = connect(self.database_path)
+
+        while 1:
+            # Wait for a poll, then take whatever else is queued with it
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size and not self._queue.empty():
+                batch.append(self._queue.get())
+
+            stop = None in batch
+            batch = [job for job in batch if job is not None]
+
+            try:
+                with connection:
+                    for job in batch:
+                        self._write_poll(connection, *job)
+            except sqlite3.Error as e:
+                self._logger.error('Could not save %s polls to the database\n%s', len(batch), e)
+
+            if stop:
+                connection.close()
+                return
+
+    @staticmethod
+    def _write_poll(connection: sqlite3.Connection, exam_type: str, location_id: int, rides: list[Ride], timestamp: float) -> None:
+        """Update the stored rides of a location to match a poll."""
+        # Find the rides that are currently stored for the location
+        stored_rides = {
+            Ride(*values): rowid
+            for rowid, *values in connection.execute(
+                f'SELECT rowid, {", ".join(RIDE_FIELDS)} FROM rides '
+                'WHERE exam_type = ? AND location_id = ? AND removed_at IS NULL',
+                (exam_type, location_id),
+            )
+        }
+        polled_rides = set(rides)
+
+        # Mark the rides that disappeared as removed
+        connection.executemany(
+            'UPDATE rides SET removed_at = ? WHERE rowid = ?',
+            [(timestamp, rowid) for ride, rowid in stored_rides.items() if ride not in polled_rides],
+        )
+
+        # Mark the remaining rides as seen
+        connection.execute(
+            'UPDATE rides SET last_seen = ? '
+            'WHERE exam_type = ? AND location_id = ? AND removed_at IS NULL',
+            (timestamp, exam_type, location_id),
+        )
+
+        # Insert the new rides
+        connection.executemany(
+            f'INSERT INTO rides (exam_type, location_id, {", ".join(RIDE_FIELDS)}, first_seen, last_seen) '
+            f'VALUES (?, ?, {", ".join("?" for _ in RIDE_FIELDS)}, ?, ?)',
+            [
+                (exam_type, location_id, *ride, timestamp, timestamp)
+                for ride in polled_rides if ride not in stored_rides
+            ],
+        )
@@ -0,0 +1,360 @@
+"""Concurrent sweeps over the examination locations.
+
+This module contains the sweep engine that is shared by the execution modes
+of the script. A sweep fans out over a list of location IDs using a bounded
+pool of worker threads and retrieves the available rides for every location.
+The results can either be streamed as each location completes, or merged into
+a single result once all of them have.
+
+Every location is swept for one examination type, so a single sweep can cover
+several examination types over the same session and connection pool.
+
+The locations of the same examination type can be requested in batches, one
+request per batch through the `nearbyLocationIds` of the query. If the server
+rejects a batch, its locations are requested one by one.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+from api.exceptions import BatchRejected, CircuitOpen
+from api.retry import RetryPolicy
+from api.trafikverket import TrafikverketAPI
+from helpers import helpers
+from helpers.ride import Ride
+from variables import constants
+
+
+class SweepTarget(NamedTuple):
+    """A location to sweep for one examination type.
+
+    Attributes:
+        exam_type: The examination type, for example 'Körprov'.
+        location_id: The ID of the location.
+    """
+
+    exam_type: str
+    location_id: int
+
+    def __str__(self) -> str:
+        return f'{self.location_id} ({self.exam_type})'
+
+
+def create_targets(exam_types: Iterable[str], valid_location_ids: dict[str, list[int]]) -> list[SweepTarget]:
+    """Create the targets for sweeping the valid locations of several examination types.
+
+    Args:
+        exam_types: The examination types to sweep.
+        valid_location_ids: The valid location IDs of each examination type.
+
+    Returns:
+        The targets, one per examination type and location.
+    """
+    return [
+        SweepTarget(exam_type, location_id)
+        for exam_type in exam_types
+        for location_id in valid_location_ids[exam_type]
+    ]
+
+
+def create_batches(targets: list[SweepTarget], batch_size: int) -> list[list[SweepTarget]]:
+    """Group the targets into batches of locations of the same examination type.
+
+    Args:
+        targets: The locations and examination types to retrieve.
+        batch_size: The maximum number of locations in a batch.
+
+    Returns:
+        The batches, keeping the order of the targets within every
+        examination type.
+    """
+    targets_by_exam_type: dict[str, list[SweepTarget]] = {}
+    for target in targets:
+        targets_by_exam_type.setdefault(target.exam_type, []).append(target)
+
+    return [
+        exam_type_targets[i:i + batch_size]
+        for exam_type_targets in targets_by_exam_type.values()
+        for i in range(0, len(exam_type_targets), batch_size)
+    ]
+
+
+class SweepResult:
+    """The merged result of a sweep over a list of locations.
+
+    Attributes:
+        rides: The rides found in all locations.
+        failed_locations: The targets that could not be retrieved.
+        wall_time: The number of seconds the sweep took to complete.
+    """
+
+    def __init__(self, rides: list[Ride], failed_locations: list[SweepTarget], wall_time: float) -> None:
+        """Initialize the SweepResult object.
+
+        Args:
+            rides: The rides found in all locations.
+            failed_locations: The targets that could not be retrieved.
+            wall_time: The number of seconds the sweep took to complete.
+        """
+        self.rides = rides
+        self.failed_locations = failed_locations
+        self.wall_time = wall_time
+
+
+def fetch_location(
+    api: TrafikverketAPI,
+    target: SweepTarget,
+    logger: logging.Logger,
+    retry_policy: RetryPolicy,
+    starting_date: str = None,
+    searched_months: int = None,
+) -> list[Ride]:
+    """Retrieve the stripped rides for a single location, retrying on errors.
+
+    Args:
+        api: The API object used to make the request.
+        target: The location and examination type to retrieve.
+        logger: The logger used to report errors.
+        retry_policy: The policy deciding whether and when to retry a failed
+            request. The target is used as the key of its circuit breaker.
+        starting_date: The first date to query, or None for all dates.
+        searched_months: The number of months to query, or None for all months.
+
+    Returns:
+        A list of rides.
+
+    Raises:
+        CircuitOpen: If the location is out of rotation after failing persistently.
+        HTTPStatus: If the server returned an unexpected response code.
+        requests.exceptions.RequestException: If the request failed.
+    """
+    try:
+        # Get the available rides from the API
+        return helpers.strip_useless_info(
+            retry_policy.call(
+                api.get_available_dates,
+                target.location_id,
+                extended_information=True,
+                examination_type_id=constants.examination_dict[target.exam_type],
+                starting_date=starting_date,
+                searched_months=searched_months,
+                key=target,
+            )
+        )
+    except retry_policy.errors as e:
+        logger.error(
+            'Unfixable error occurred with location id: %s\n%s',
+            target, e
+        )
+        raise
+
+
+def batch_arguments(batch: list[SweepTarget]) -> dict:
+    """Return the arguments of the request for a batch of locations of the same examination type.
+
+    The batch is used as the key of the circuit breaker of the retry policy.
+    """
+    return {
+        'location_ids': [target.location_id for target in batch],
+        'extended_information': True,
+        'examination_type_id': constants.examination_dict[batch[0].exam_type],
+        'key': tuple(batch),
+    }
+
+
+def split_batch(
+    batch: list[SweepTarget],
+    logger: logging.Logger,
+    dates: dict[int, list[dict]] = None,
+    error: Exception = None,
+) -> list[tuple[SweepTarget, list[Ride] | None]] | None:
+    """Turn the result of a batched request into the rides of every target.
+
+    Args:
+        batch: The requested locations.
+        logger: The logger used to report errors.
+        dates: The bundles of every location ID if the request succeeded.
+        error: The error raised by the request if it failed.
+
+    Returns:
+        A tuple of every target and its rides, which are None if the request
+        failed, or None if the server rejected the batch and its locations
+        should be requested one by one.
+    """
+    if isinstance(error, BatchRejected):
+        logger.warning('Requesting the locations one by one\n%s', error)
+        return None
+
+    if error is not None:
+        logger.error(
+            'Unfixable error occurred with location ids: %s\n%s',
+            ', '.join(map(str, batch)), error
+        )
+        return [(target, None) for target in batch]
+
+    return [(target, helpers.strip_useless_info(dates[target.location_id])) for target in batch]
+
+
+def check_rejected_batch(
+    api: TrafikverketAPI,
+    results: list[tuple[SweepTarget, list[Ride] | None]],
+    logger: logging.Logger,
+) -> None:
+    """Turn batching off if every location of a rejected batch could be retrieved on its own.
+
+    Args:
+        api: The API object, synchronous or asyncio.
+        results: The rides of every location of the batch, requested one by one.
+        logger: The logger used to report the change.
+    """
+    # The locations are fine on their own, so the server does not accept batches at all
+    if all(rides is not None for _, rides in results):
+        logger.warning('The server rejects batched requests, requesting every location on its own')
+        api.batching = False
+
+
+def fetch_locations(
+    api: TrafikverketAPI,
+    batch: list[SweepTarget],
+    logger: logging.Logger,
+    retry_policy: RetryPolicy,
+) -> list[tuple[SweepTarget, list[Ride] | None]]:
+    """Retrieve the stripped rides for a batch of locations, one request per location.
+
+    Returns:
+        A tuple of every target and its rides. The rides are None if the
+        location could not be retrieved.
+    """
+    results = []
+    for target in batch:
+        try:
+            results.append((target, fetch_location(api, target, logger, retry_policy)))
+        except (*retry_policy.errors, CircuitOpen):
+            results.append((target, None))
+    return results
+
+
+def fetch_batch(
+    api: TrafikverketAPI,
+    batch: list[SweepTarget],
+    logger: logging.Logger,
+    retry_policy: RetryPolicy,
+) -> list[tuple[SweepTarget, list[Ride] | None]]:
+    """Retrieve the stripped rides for a batch of locations in one request,
+    falling back to one request per location if the server rejects it.
+
+    Args:
+        api: The API object used to make the request.
+        batch: The locations to retrieve, all of the same examination type.
+        logger: The logger used to report errors.
+        retry_policy: The policy deciding whether and when to retry a failed
+            request. The batch is used as the key of its circuit breaker.
+
+    Returns:
+        A tuple of every target and its rides. The rides are None if the
+        location could not be retrieved.
+    """
+    if len(batch) == 1 or not api.batching:
+        return fetch_locations(api, batch, logger, retry_policy)
+
+    try:
+        dates = retry_policy.call(api.get_available_dates_batch, **batch_arguments(batch))
+        return split_batch(batch, logger, dates=dates)
+    except (BatchRejected, *retry_policy.errors, CircuitOpen) as e:
+        results = split_batch(batch, logger, error=e)
+
+    # Request the locations one by one if the server rejected the batch
+    if results is None:
+        results = fetch_locations(api, batch, logger, retry_policy)
+        check_rejected_batch(api, results, logger)
+    return results
+
+
+def iter_locations(
+    api: TrafikverketAPI,
+    targets: list[SweepTarget],
+    logger: logging.Logger,
+    retry_policy: RetryPolicy,
+    max_workers: int = constants.MAX_WORKERS,
+    batch_size: int = 1,
+) -> Iterator[tuple[SweepTarget, list[Ride] | None]]:
+    """Retrieve the available rides for all locations concurrently, yielding
+    the rides of every location as soon as it completes.
+
+    Args:
+        api: The API object used to make the requests. It is shared between
+            all worker threads.
+        targets: The locations and examination types to retrieve.
+        logger: The logger used to report errors.
+        retry_policy: The policy used to retry failed requests.
+        max_workers: The maximum number of requests in flight at once.
+        batch_size: The maximum number of locations in one request.
+
+    Yields:
+        A tuple of the target and its rides, in order of completion. The
+        rides are None if the location could not be retrieved.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Submit one job per batch of locations, or per location if the server rejects batches
+        futures = [
+            executor.submit(fetch_batch, api, batch, logger, retry_policy)
+            for batch in create_batches(targets, batch_size if api.batching else 1)
+        ]
+
+        try:
+            for future in as_completed(futures):
+                yield from future.result()
+        finally:
+            # Drop the locations that have not started if the stream is closed early
+            for future in futures:
+                future.cancel()
+
+
+def sweep_locations(
+    api: TrafikverketAPI,
+    targets: list[SweepTarget],
+    logger: logging.Logger,
+    retry_policy: RetryPolicy,
+    max_workers: int = constants.MAX_WORKERS,
+    on_location_done: Callable[[SweepTarget], None] = None,
+    batch_size: int = 1,
+) -> SweepResult:
+    """Retrieve the available rides for all locations concurrently.
+
+    Args:
+        api: The API object used to make the requests. It is shared between
+            all worker threads.
+        targets: The locations and examination types to retrieve.
+        logger: The logger used to report errors.
+        retry_policy: The policy used to retry failed requests.
+        max_workers: The maximum number of requests in flight at once.
+        on_location_done: An optional callback that is called with the
+            target every time a location has been processed, for example
+            to update a progress bar.
+        batch_size: The maximum number of locations in one request.
+
+    Returns:
+        A SweepResult with the merged rides of all locations.
+    """
+    # Start measuring the wall time of the sweep
+    start_time = time.perf_counter()
+
+    rides = []
+    failed_locations = []
+
+    # Merge the results as the locations complete
+    for target, location_rides in iter_locations(api, targets, logger, retry_policy, max_workers, batch_size):
+        if location_rides is None:
+            failed_locations.append(target)
+        else:
+            rides.extend(location_rides)
+
+        if on_location_done is not None:
+            on_location_done(target)
+
+    return SweepResult(
+        rides=rides,
+        failed_locations=failed_locations,
+        wall_time=time.perf_counter() - start_time,
+    )
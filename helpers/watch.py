@@ -0,0 +1,206 @@
+"""Matching of ride events against many watch profiles.
+
+A watch profile describes the rides one person is waiting for: a set of
+locations, a date window, the examination type and name, and a maximum cost.
+All profiles are loaded from one file and evaluated against the change events
+of a single sweep, so any number of watchers share the same requests.
+
+The profiles are indexed by location and by date window, so an event is only
+checked against the profiles that can match its location and date:
+
+- the location index maps every location name and ID to its profiles
+- the date index splits the calendar at the start and end of every window,
+  and stores the profiles covering each segment, so the profiles whose
+  window contains a date are found with one binary search
+
+The cost of matching therefore grows with the number of events and the
+profiles that actually match them, not with the number of profiles times the
+number of rides.
+"""
+import json
+from bisect import bisect_right
+from pathlib import Path
+from typing import Hashable, Iterable, NamedTuple
+
+from helpers.diff import EventType, RideEvent
+from helpers.query import parse_cost
+
+
+class WatchProfile(NamedTuple):
+    """The rides one watcher is waiting for. Every filter that is None matches all rides.
+
+    Attributes:
+        name: The name of the watcher, used to report the matches.
+        locations: The names or IDs of the locations to watch.
+        start_date: The first date to watch, in the format 'YYYY-MM-DD'.
+        end_date: The last date to watch, in the format 'YYYY-MM-DD'.
+        exam_type: The examination type, for example 'Körprov'.
+        names: The names of the examinations, for example 'Körprov B'.
+        max_cost: The highest cost to watch, in SEK.
+        events: The kinds of events to report.
+    """
+
+    name: str
+    locations: frozenset[Hashable] | None = None
+    start_date: str | None = None
+    end_date: str | None = None
+    exam_type: str | None = None
+    names: frozenset[str] | None = None
+    max_cost: int | None = None
+    events: frozenset[EventType] = frozenset({EventType.ADDED})
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'WatchProfile':
+        """Create a profile from an entry of the watch profile file.
+
+        Args:
+            data: The entry of the file.
+
+        Returns:
+            The profile.
+
+        Raises:
+            ValueError: If the entry is not a valid profile.
+        """
+        if 'name' not in data:
+            raise ValueError(f'Watch profile without a name: {data}')
+
+        unknown_fields = set(data) - set(cls._fields)
+        if unknown_fields:
+            raise ValueError(f'Unknown fields in watch profile {data["name"]!r}: {", ".join(sorted(unknown_fields))}')
+
+        return cls(
+            name=data['name'],
+            locations=frozenset(data['locations']) if data.get('locations') is not None else None,
+            start_date=data.get('start_date'),
+            end_date=data.get('end_date'),
+            exam_type=data.get('exam_type'),
+            names=frozenset(data['names']) if data.get('names') is not None else None,
+            max_cost=data.get('max_cost'),
+            events=frozenset(EventType(event) for event in data.get('events', ['added'])),
+        )
+
+
+def load_profiles(file_path: str | Path) -> list[WatchProfile]:
+    """Load the watch profiles from a JSON file holding a list of profiles.
+
+    Args:
+        file_path: The path of the file.
+
+    Returns:
+        The profiles, or an empty list if the file does not exist.
+
+    Raises:
+        ValueError: If the file contains an invalid profile.
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return [WatchProfile.from_dict(data) for data in json.load(f)]
+    except FileNotFoundError:
+        return []
+
+
+class Match(NamedTuple):
+    """An event matching a watch profile.
+
+    Attributes:
+        profile: The matching profile.
+        event: The matching event.
+    """
+
+    profile: WatchProfile
+    event: RideEvent
+
+
+class ProfileMatcher:
+    """Evaluate watch profiles against ride events through location and date indexes."""
+
+    def __init__(self, profiles: Iterable[WatchProfile]) -> None:
+        """Build the indexes of the profiles.
+
+        Args:
+            profiles: The profiles to match.
+        """
+        self.profiles = list(profiles)
+
+        # Map every location to the positions of its profiles, and keep the
+        # profiles watching every location apart
+        self._by_location: dict[Hashable, set[int]] = {}
+        self._any_location: set[int] = set()
+        for position, profile in enumerate(self.profiles):
+            if profile.locations is None:
+                self._any_location.add(position)
+            else:
+                for location in profile.locations:
+                    self._by_location.setdefault(location, set()).add(position)
+
+        # Split the calendar at the boundaries of every window. Segment i
+        # holds the dates from boundary i - 1 up to, but not including,
+        # boundary i. Every end date is included in its window, so the
+        # boundary is placed right after it.
+        boundaries = set()
+        for profile in self.profiles:
+            if profile.start_date is not None:
+                boundaries.add(profile.start_date)
+            if profile.end_date is not None:
+                boundaries.add(profile.end_date + '\0')
+        self._boundaries = sorted(boundaries)
+
+        # Store the profiles covering every segment
+        self._by_segment: list[frozenset[int]] = []
+        for segment in range(len(self._boundaries) + 1):
+            # Any date within the segment, compared with the windows
+            first = self._boundaries[segment - 1] if segment else ''
+            self._by_segment.append(frozenset(
+                position for position, profile in enumerate(self.profiles)
+                if (profile.start_date is None or profile.start_date <= first)
+                and (profile.end_date is None or first < profile.end_date + '\0')
+            ))
+
+    def __len__(self) -> int:
+        """Return the number of profiles."""
+        return len(self.profiles)
+
+    def match(self, events: Iterable[RideEvent], exam_type: str = None) -> list[Match]:
+        """Find the profiles matching every event.
+
+        Args:
+            events: The events of a poll or sweep.
+            exam_type: The examination type of the events.
+
+        Returns:
+            A match for every event and profile that matches it, in the order
+            of the events and profiles.
+        """
+        matches = []
+        for event in events:
+            ride = event.ride
+
+            # Find the profiles watching the location and the date of the ride
+            candidates = (
+                self._by_location.get(event.location_id, set())
+                | self._by_location.get(ride.location, set())
+                | self._any_location
+            ) & self._by_segment[bisect_right(self._boundaries, ride.date)]
+
+            for position in sorted(candidates):
+                profile = self.profiles[position]
+                if self._matches(profile, event, exam_type):
+                    matches.append(Match(profile, event))
+
+        return matches
+
+    @staticmethod
+    def _matches(profile: WatchProfile, event: RideEvent, exam_type: str | None) -> bool:
+        """Check the filters of a profile that are not indexed."""
+        if event.type not in profile.events:
+            return False
+        if profile.exam_type is not None and profile.exam_type != exam_type:
+            return False
+        if profile.names is not None and event.ride.name not in profile.names:
+            return False
+        if profile.max_cost is not None:
+            cost = parse_cost(event.ride.cost)
+            if cost is None or cost > profile.max_cost:
+                return False
+        return True
@@ -1,248 +1,238 @@
-import datetime
-import time
+"""Entry point of the script.
+
+Run without arguments to choose the exam types, execution mode and proxy
+interactively:
+
+    $ python main.py
+
+Or pass a subcommand to run headless, for example from cron or systemd. Every
+setting is then taken from the flags, `config.json` or the defaults, and
+nothing is prompted:
+
+    $ python main.py sweep --exam-type Körprov
+    $ python main.py watch --exam-type Körprov --exam-type Kunskapsprov --polling-frequency 600
+    $ python main.py serve --port 8080
+
+The interactive dependencies (questionary, tqdm, termcolor and coloredlogs)
+are only imported when running interactively, so headless runs start faster.
+"""
+import argparse
+import logging
+import sys
 
-import questionary
-import requests
 import urllib3
-from termcolor import colored
-from tqdm import tqdm
-from user_agent import generate_user_agent
 
-from api.exceptions import HTTPStatus
-from api.trafikverket import TrafikverketAPI
-from helpers import helpers, io, output
+import modes
+from helpers import io, output, profiling
 from variables import constants, paths
 
-# Disable warnings for unverified HTTPS requests
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-# Create the logger and save them in the log directory
-logger = output.create_logger(logging_dir=paths.logging_directory)
-
-# Ask user to select exam type from a list of choices
-EXAMINATION_TYPE: str = questionary.select(
-    'Select exam type:', choices=["Kunskapsprov", "Körprov"]
-).ask()
-
-# Ask user to select execution mode from a list of choices
-EXECUTION_MODE: str = questionary.select(
-    'Select execution mode:', choices=["Sort by date", "Log server changes", "Start web server"]
-).ask()
-
-# Load configuration
-CONFIG = io.load_config()
-
-# If proxy is defined in the configuration
-if 'proxy' in CONFIG:
-    # Retrieve proxy configuration
-    proxy_config = CONFIG['proxy']
-    # Format proxy for requests library
-    proxy = helpers.create_requests_proxy(
-        host=proxy_config['host'],
-        port=proxy_config['port'],
-        protocol=proxy_config.get('protocol', 'http'),
+# The execution modes of the interactive prompt and their subcommands
+EXECUTION_MODES = {
+    'Sort by date': 'sweep',
+    'Log server changes': 'watch',
+    'Start web server': 'serve',
+}
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Create the parser of the command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Find available rides for driving examinations at Trafikverket.'
+    )
+    parser.set_defaults(profile=False, batch_size=None)
+    subparsers = parser.add_subparsers(
+        dest='command', metavar='command',
+        help='run headless instead of prompting for the settings',
+    )
+
+    # Arguments shared by all subcommands
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        '--exam-type', action='append', dest='exam_types', choices=list(constants.examination_dict),
+        help='exam type to sweep, can be repeated (default: exam_types in config.json, or Körprov)',
+    )
+    common.add_argument(
+        '--proxy', choices=list(constants.proxy_select),
+        help='request proxy, replacing the proxy pool (default: proxy_pool or proxy in config.json, or None)',
+    )
+    common.add_argument(
+        '--async', dest='use_async', action='store_true', default=None,
+        help='send the requests from an asyncio event loop (default: use_async in config.json)',
+    )
+    common.add_argument(
+        '--metrics-port', type=int,
+        help='serve the metrics on /metrics on this port (default: metrics.port in config.json, or disabled)',
+    )
+    common.add_argument(
+        '--all-locations', action='store_true',
+        help='sweep every location, including the ones in the slow lane of the location index',
+    )
+
+    # Arguments of the subcommands that can be profiled
+    profiling_parser = argparse.ArgumentParser(add_help=False)
+    profiling_parser.add_argument(
+        '--profile', action='store_true',
+        help='profile the run with cProfile and tracemalloc and save the report in the profiles directory',
+    )
+
+    # Arguments of the subcommands that sweep all locations at once
+    batching_parser = argparse.ArgumentParser(add_help=False)
+    batching_parser.add_argument(
+        '--batch-size', type=int,
+        help='number of locations queried in one request (default: batch_size in config.json, or 1)',
+    )
+
+    sweep_parser = subparsers.add_parser(
+        'sweep', parents=[common, profiling_parser, batching_parser], help='sweep all locations once and list the earliest rides'
+    )
+    sweep_parser.add_argument('--top-rides', type=int, help='number of earliest rides to list')
+
+    watch_parser = subparsers.add_parser(
+        'watch', parents=[common, profiling_parser], help='poll all locations continuously and log the changes'
+    )
+    watch_parser.add_argument('--polling-frequency', type=int, help='initial polling interval of every location in seconds')
+    watch_parser.add_argument('--min-interval', type=float, help='shortest polling interval in seconds')
+    watch_parser.add_argument('--max-interval', type=float, help='longest polling interval in seconds')
+    watch_parser.add_argument('--requests-per-hour', type=float, help='request budget over all locations')
+    watch_parser.add_argument('--database', help='path of the snapshot database')
+    watch_parser.add_argument('--watch-profiles', help='path of the watch profile file')
+    watch_parser.add_argument(
+        '--profile-polls', type=int,
+        help='number of polls to profile before exiting (default: one poll of every location)',
+    )
+
+    serve_parser = subparsers.add_parser(
+        'serve', parents=[common, batching_parser], help='serve the rides on a local web server'
     )
-else:
-    # Ask user to select request proxy from a list of choices
-    proxy: str = questionary.select(
-        'Select request proxy:', choices=["None", "Fiddler", "TOR"]
+    serve_parser.add_argument('--host', help='address to listen on')
+    serve_parser.add_argument('--port', type=int, help='port to listen on')
+    serve_parser.add_argument('--sweep-interval', type=float, help='seconds between two sweeps')
+
+    return parser
+
+
+def prompt_arguments(config: dict, logger: logging.Logger) -> argparse.Namespace:
+    """Ask the user for the settings of an interactive run.
+
+    Args:
+        config: The configuration, used to skip the proxy prompt if a proxy
+            is configured.
+        logger: The logger used to report invalid input.
+
+    Returns:
+        The arguments of the chosen subcommand.
+    """
+    # Only import the prompts when they are needed
+    import questionary
+
+    # Ask user to select the exam types to sweep from a list of choices
+    exam_types: list[str] = questionary.checkbox(
+        'Select exam types:',
+        choices=list(constants.examination_dict),
+        validate=lambda selected: bool(selected) or 'Select at least one exam type',
     ).ask()
 
-    # Set proxy for requests library
-    proxy = constants.proxy_select[proxy]
-
-# Generate a random user agent
-useragent = generate_user_agent()
-
-# Load valid location ids
-valid_location_ids = io.load_location_ids()
-
-# Load class into object
-trafikverket_api = TrafikverketAPI(
-    cookies=constants.cookies,
-    useragent=useragent,
-    proxy=proxy,
-    ssn=CONFIG['swedish_ssn'],
-    examination_type_id=constants.examination_dict[EXAMINATION_TYPE],
-)
-
-# Select execution mode
-if EXECUTION_MODE == "Sort by date":
-    # Reset the list of available rides
-    available_rides_list = []
-
-    # Loop through all valid location IDs for the selected examination type
-    for location_id in tqdm(
-        valid_location_ids[EXAMINATION_TYPE],
-        desc='Updating local database',
-        unit='id',
-        leave=False,
-    ):
-
-        # Try to retrieve the available rides up to the maximum number of attempts
-        for attempt in range(constants.MAX_ATTEMPTS):
+    # Ask user to select execution mode from a list of choices
+    execution_mode: str = questionary.select(
+        'Select execution mode:', choices=list(EXECUTION_MODES)
+    ).ask()
+
+    # Ask user to select request proxy from a list of choices, unless one or a pool is configured
+    proxy = None
+    if 'proxy' not in config and 'proxy_pool' not in config:
+        proxy: str = questionary.select(
+            'Select request proxy:', choices=list(constants.proxy_select)
+        ).ask()
+
+    # Start from the defaults of the subcommand
+    command = EXECUTION_MODES[execution_mode]
+    args = create_parser().parse_args([command])
+    args.exam_types = exam_types
+    args.proxy = proxy
+
+    if command == 'watch':
+        while 1:
+            # Ask user to input polling frequency
             try:
-                # Get the available rides from the API
-                available_rides = helpers.strip_useless_info(
-                    trafikverket_api.get_available_dates(
-                        location_id,
-                        extended_information=True,
-                    )
-                )
-
-                # Add the available rides to the list
-                available_rides_list.extend(available_rides)
-
-                # Stop trying if the available rides were successfully retrieved
+                args.polling_frequency = int(questionary.text(
+                    'Enter polling frequency:', default=str(constants.POLLING_FREQUENCY)
+                ).ask())
                 break
-            except (HTTPStatus, requests.exceptions.RequestException) as e:
-                logger.error(
-                    'Unfixable error occurred with location id: %s\n%s',
-                    location_id, e
-                )
-                # Wait for the specified time before retrying
-                time.sleep(constants.WAIT_TIME)
-
-    # Sort the avaliable rides based on the date and time
-    available_rides_list.sort(
-        key=lambda x: (x['date'], x['time']),
-        reverse=True
-    )
+            except ValueError as e:
+                # Log input error
+                logger.exception('Invalid input: %s', e)
+
+    return args
 
-    # Display all the available rides
-    for ride in available_rides_list:
+
+def report_profile(profiler: profiling.Profiler, name: str, logger: logging.Logger) -> None:
+    """Save the profile of a run and log where the time went."""
+    stats_path, report_path, times = profiler.save(paths.profiling_directory, name)
+
+    total_time = sum(times.values())
+    for category, seconds in times.items():
         logger.info(
-            '%s, %s %s in %s for %s',
-            ride["name"],
-            ride["date"],
-            ride["time"],
-            ride["location"],
-            ride["cost"]
+            'Profile: %-26s %8.3fs %6.1f%%',
+            category, seconds, 100 * seconds / total_time if total_time else 0
         )
+    logger.info('Saved the profile to %s and the report to %s', stats_path, report_path)
+
 
-    # Show the total amount of rides found
-    logger.info(
-        'Total: %s', len(available_rides_list)
+# The function running each subcommand
+COMMANDS = {
+    'sweep': modes.run_sweep,
+    'watch': modes.run_watch,
+    'serve': modes.run_serve,
+}
+
+
+def main(argv: list[str] = None) -> None:
+    """Run the script.
+
+    Args:
+        argv: The command line arguments. Defaults to `sys.argv[1:]`.
+    """
+    args = create_parser().parse_args(argv)
+
+    # Prompt for the settings unless a subcommand was given
+    interactive = args.command is None
+
+    # Disable warnings for unverified HTTPS requests
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    # Load configuration
+    config = io.load_config()
+
+    # Create the logger and save the logs in the log directory, rotating them
+    logging_config: dict = config.get('logging', {})
+    logger = output.create_logger(
+        logging_dir=paths.logging_directory,
+        use_colors=interactive,
+        max_bytes=logging_config.get('max_bytes', constants.LOG_MAX_BYTES),
+        backup_count=logging_config.get('backup_count', constants.LOG_BACKUP_COUNT),
+        when=logging_config.get('when'),
+        json_lines=logging_config.get('json_lines', False),
     )
 
-elif EXECUTION_MODE == "Log server changes":
-    # Set of ride information dictionaries
-    last_available_rides = set([])
-
-    while 1:
-        # Ask user to input polling frequency
-        try:
-            POLLING_FREQUENCY = int(questionary.text(
-                'Enter polling frequency:', default='1200'
-            ).ask())
-            break
-        except ValueError as e:
-            # Log input error
-            logger.exception('Invalid input: %s', e)
-
-    while 1:
-        # List to store ride information dictionaries
-        available_rides_list = []
-
-        # Retrieve list of valid location IDs for the examination type
-        for location_id in tqdm(
-            valid_location_ids[EXAMINATION_TYPE],
-            desc='Updating local database',
-            unit='id',
-            leave=False
-        ):
-            for _ in range(constants.MAX_ATTEMPTS):
-                try:
-                    # Retrieve available dates from server and add to list, stripping unnecessary information
-                    available_rides_list.extend(helpers.strip_useless_info(
-                        trafikverket_api.get_available_dates(
-                            location_id,
-                            extended_information=True,
-                        )
-                    ))
-                    break
-                except (HTTPStatus, requests.exceptions.RequestException) as e:
-                    # Log error
-                    logger.error(
-                        'Unfixable error occurred with location id: %s\n%s',
-                        location_id, e
-                    )
-                # Sleep for specified time before trying again
-                time.sleep(constants.WAIT_TIME)
-
-        # Update last check time
-        last_check_time = time.time()
-
-        # Sort the list of ride information dictionaries by date and time
-        next_available_ride = sorted(
-            available_rides_list,
-            key=lambda x: (x['date'], x['time'])
-        )[0]
-
-        # Print current information to console
-        helpers.inplace_print(
-            f'Database size: {len(available_rides_list)} | '
-            f'Next sync: {datetime.timedelta(seconds=POLLING_FREQUENCY)} | '
-            f'Next available: {next_available_ride["date"]} {next_available_ride["time"]} in {next_available_ride["location"]}'
-        )
+    if interactive:
+        args = prompt_arguments(config, logger)
+
+    # Profile the run if requested, starting before the client creates its threads
+    profiler = None
+    if args.profile:
+        profiler = profiling.Profiler()
+        profiler.start()
+
+    runtime = modes.Runtime(args, config, logger, interactive)
+    try:
+        COMMANDS[args.command](runtime, args)
+    finally:
+        runtime.close()
+
+        if profiler is not None:
+            profiler.stop()
+            report_profile(profiler, args.command, logger)
+
 
-        # Convert the list of dictionaries into a set
-        available_rides = {tuple(d.items()) for d in available_rides_list}
-
-        # Find the difference between available rides and last available rides
-        added_rides = available_rides.difference(last_available_rides)
-        # Convert tuples back to dictionaries
-        added_rides = (dict(v) for v in added_rides)
-
-        # Find the difference between last available rides and available rides
-        removed_rides = last_available_rides.difference(available_rides)
-        # Convert tuples back to dictionaries
-        removed_rides = (dict(v) for v in removed_rides)
-
-        # Update last available rides
-        last_available_rides = available_rides
-        # Hide the in-place print output
-        helpers.hide_print()
-
-        # Print added rides to console
-        for ride in added_rides:
-            # Example: "[Added] Kunskapsprov B, 2022-01-07 11:15 in Örebro for 325kr"
-            logger.info(
-                colored(
-                    '[Added] %s, %s %s in %s for %s',
-                    'green'
-                ),
-                ride["name"],
-                ride["date"],
-                ride["time"],
-                ride["location"],
-                ride["cost"],
-            )
-
-        for ride in removed_rides:
-            # Example: "[Removed] Kunskapsprov B, 2022-01-07 11:15 in Örebro for 325kr"
-            logger.info(
-                colored(
-                    '[Removed] %s, %s %s in %s for %s',
-                    'red'
-                ),
-                ride["name"],
-                ride["date"],
-                ride["time"],
-                ride["location"],
-                ride["cost"],
-            )
-
-        # Update countdown timer until next update
-        for i in range(POLLING_FREQUENCY, 0, -1):
-            helpers.inplace_print(
-                f'Database size: {len(available_rides_list)} | '
-                f'Next sync: {datetime.timedelta(seconds=i)} | '
-                f'Next available: {next_available_ride["date"]} {next_available_ride["time"]} in {next_available_ride["location"]}'
-            )
-            time.sleep(1)
-
-        # Hide the in-place print output
-        helpers.hide_print()
-else:
-    raise NotImplementedError
+if __name__ == '__main__':
+    main(sys.argv[1:])
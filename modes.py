@@ -0,0 +1,788 @@
+"""The execution modes of the script and the runtime they share.
+
+A `Runtime` holds the API client, retry policy and settings that every mode
+needs. The modes run on top of it:
+
+- `run_sweep` sweeps all locations once and lists the earliest rides
+- `run_watch` polls every location on its own interval and logs the changes
+- `run_serve` serves the rides on a local web server, sweeping in the background
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Iterator
+
+from api.cache import ResponseCache
+from api.exceptions import CircuitOpen
+from api.governor import RateGovernor
+from api.metrics import Metrics, MetricsServer
+from api.proxy_pool import ProxyExit, ProxyPool
+from api.retry import CircuitBreaker, RetryPolicy
+from api.trafikverket import BASE_URL, TrafikverketAPI
+from helpers import (date_window, diff, helpers, io, notify, output,
+                     scheduler, storage, sweep, watch)
+from helpers.earliest import EarliestRides
+from helpers.location_index import LocationIndex
+from helpers.ride import Ride
+from variables import constants, paths
+
+class Runtime:
+    """The API client, retry policy and settings shared by the execution modes.
+
+    Attributes:
+        logger: The logger.
+        config: The configuration.
+        interactive: Whether the script runs in a terminal with prompts,
+            progress bars and colours.
+        exam_types: The exam types to sweep.
+        targets: The locations to sweep for every exam type.
+        location_index: The statistics of every location, deciding which
+            ones are swept.
+        all_locations: Whether to sweep every location, ignoring the slow lane.
+        use_async: Whether the requests are sent from an asyncio event loop.
+        max_workers: The number of threads sending requests.
+        max_async_requests: The number of asyncio requests in flight at once.
+        batch_size: The number of locations queried in one request by the sweeps.
+        proxy_pool: The pool of proxies the requests are spread over, or None.
+        governors: The rate governor of every exit by name, empty if disabled.
+        response_cache: The optional cache of recent responses.
+        metrics: The metrics of the requests, sweeps and changes.
+        metrics_server: The server exposing the metrics, or None if disabled.
+        api: The `TrafikverketAPI` or `AsyncTrafikverketAPI` object.
+        retry_policy: The policy used to retry failed requests.
+        fetch_errors: The errors raised when a location could not be retrieved.
+        event_loop: The event loop running the asyncio client in the
+            background, or None.
+    """
+
+    def __init__(self, args: argparse.Namespace, config: dict, logger: logging.Logger, interactive: bool) -> None:
+        """Create the API client for the selected exam types.
+
+        Args:
+            args: The command line arguments or prompted settings.
+            config: The configuration.
+            logger: The logger.
+            interactive: Whether the script runs interactively.
+        """
+        self.logger = logger
+        self.config = config
+        self.interactive = interactive
+
+        # Sweep every valid location once for every selected exam type
+        self.exam_types: list[str] = args.exam_types or config.get('exam_types', ['Körprov'])
+        self.targets = sweep.create_targets(self.exam_types, io.load_location_ids())
+
+        # Sweep the locations that were empty or failing for a while less often
+        index_config: dict = config.get('location_index', {})
+        self.location_index = LocationIndex(
+            index_config.get('path', paths.location_index),
+            empty_sweeps=index_config.get('empty_sweeps', constants.LOCATION_EMPTY_SWEEPS),
+            error_sweeps=index_config.get('error_sweeps', constants.LOCATION_ERROR_SWEEPS),
+            slow_interval=index_config.get('slow_interval', constants.LOCATION_SLOW_INTERVAL),
+        )
+        self.all_locations: bool = args.all_locations
+
+        # Number of locations to request concurrently
+        self.max_workers: int = config.get('max_workers', constants.MAX_WORKERS)
+        self.max_async_requests: int = config.get('max_async_requests', constants.MAX_ASYNC_REQUESTS)
+
+        # Number of locations to query in one request, the polls of the watch mode are never batched
+        self.batch_size: int = io.get_option(args.batch_size, config, 'batch_size', constants.BATCH_SIZE)
+
+        # Share the responses of recent requests between callers if enabled
+        if 'cache' in config:
+            self.response_cache = ResponseCache(
+                ttl=config['cache'].get('ttl', constants.CACHE_TTL),
+                max_entries=config['cache'].get('max_entries', constants.CACHE_MAX_ENTRIES),
+            )
+        else:
+            self.response_cache = None
+
+        # Record the metrics of the requests, sweeps and changes
+        self.metrics = Metrics()
+        if self.response_cache is not None:
+            self.metrics.watch_cache(self.response_cache)
+
+        # Serve the metrics on their own port if enabled
+        metrics_config: dict = config.get('metrics', {})
+        metrics_port: int | None = io.get_option(args.metrics_port, metrics_config, 'port')
+        self.metrics_server = None
+        if metrics_port:
+            self.metrics_server = MetricsServer(
+                self.metrics, metrics_config.get('host', constants.METRICS_HOST), metrics_port
+            )
+            self.metrics_server.start()
+            logger.info('Serving the metrics on http://%s:%s/metrics', *self.metrics_server.address)
+
+        # Use the asyncio client instead of the thread pool if enabled
+        self.use_async: bool = args.use_async if args.use_async is not None else config.get('use_async', False)
+
+        # Retry failed requests with exponential backoff, and take persistently
+        # failing locations out of rotation for a while
+        retry_options = {
+            'max_attempts': constants.MAX_ATTEMPTS,
+            'base_delay': constants.BACKOFF_BASE_DELAY,
+            'max_delay': constants.BACKOFF_MAX_DELAY,
+            'breaker': CircuitBreaker(
+                failure_threshold=constants.CIRCUIT_FAILURE_THRESHOLD,
+                cooldown=constants.CIRCUIT_COOLDOWN,
+            ),
+            'on_retry': self.log_retry,
+        }
+
+        api_options = {
+            'cookies': constants.cookies,
+            'useragent': self._create_useragent(),
+            'proxy': self._create_proxy(args.proxy),
+            'ssn': config['swedish_ssn'],
+            'examination_type_id': constants.examination_dict[self.exam_types[0]],
+            # Send the requests to a local stand-in server instead of Trafikverket if configured
+            'base_url': config.get('base_url', BASE_URL),
+            'cache': self.response_cache,
+            'metrics': self.metrics,
+        }
+
+        # Spread the requests over a pool of proxies if configured, unless a
+        # single proxy was chosen
+        pool_config: dict | None = config.get('proxy_pool') if args.proxy is None else None
+        exit_proxies = self._create_exit_proxies(pool_config) if pool_config else []
+
+        # Pace the requests of every exit by the feedback of the server if enabled
+        self.governors: dict[str, RateGovernor] = {}
+        if 'governor' in config:
+            for name, _ in exit_proxies or [('default', None)]:
+                self.governors[name] = self._create_governor(config['governor'])
+            self.metrics.watch_governors(
+                lambda: {name: governor.stats() for name, governor in self.governors.items()}
+            )
+
+        self.event_loop = None
+        if self.use_async:
+            # Only import aiohttp when it is needed
+            from api.async_trafikverket import AsyncTrafikverketAPI
+            from api.proxy_pool import AsyncProxyPool
+            from helpers import async_sweep
+
+            # Keep one event loop running in the background for all requests, so that
+            # the connection pool is reused
+            self.event_loop = asyncio.new_event_loop()
+            threading.Thread(target=self.event_loop.run_forever, daemon=True).start()
+
+            self.api = self._create_api(
+                AsyncTrafikverketAPI, AsyncProxyPool, {'max_connections': self.max_async_requests},
+                api_options, exit_proxies, pool_config,
+            )
+            self.run_coroutine(self.api.open())
+
+            self.retry_policy = async_sweep.create_retry_policy(**retry_options)
+        else:
+            self.api = self._create_api(
+                TrafikverketAPI, ProxyPool, {'pool_maxsize': self.max_workers},
+                api_options, exit_proxies, pool_config,
+            )
+            self.retry_policy = RetryPolicy(**retry_options)
+
+        self.proxy_pool = self.api if exit_proxies else None
+        if self.proxy_pool is not None:
+            # Send as many requests at once through every exit as through a single connection
+            self.max_workers *= len(self.proxy_pool)
+            self.max_async_requests *= len(self.proxy_pool)
+            self.metrics.watch_proxy_pool(self.proxy_pool.stats)
+
+        # Errors raised when a location could not be retrieved
+        self.fetch_errors = (*self.retry_policy.errors, CircuitOpen)
+
+    def _create_useragent(self) -> str:
+        """Return the configured user agent, or generate a random one."""
+        if 'useragent' in self.config:
+            return self.config['useragent']
+
+        from user_agent import generate_user_agent
+        return generate_user_agent()
+
+    def _create_proxy(self, proxy_name: str | None) -> dict | None:
+        """Return the proxy for the requests library.
+
+        Args:
+            proxy_name: The name of a proxy in `constants.proxy_select`, or
+                None to use the configured proxy.
+        """
+        # If proxy is defined in the configuration and not overridden
+        if proxy_name is None and 'proxy' in self.config:
+            proxy_config = self.config['proxy']
+            return helpers.create_requests_proxy(
+                host=proxy_config['host'],
+                port=proxy_config['port'],
+                protocol=proxy_config.get('protocol', 'http'),
+            )
+
+        return constants.proxy_select[proxy_name or 'None']
+
+    def _create_exit_proxies(self, pool_config: dict) -> list[tuple[str, dict]]:
+        """Return the name and proxy of every exit of the proxy pool.
+
+        Args:
+            pool_config: The proxy_pool field of the configuration.
+        """
+        exit_proxies = []
+
+        # Send some of the requests without a proxy if enabled
+        if pool_config.get('include_direct', False):
+            exit_proxies.append(('direct', constants.proxy_select['None']))
+
+        for proxy_config in pool_config.get('proxies', []):
+            proxy = helpers.create_requests_proxy(
+                host=proxy_config['host'],
+                port=proxy_config['port'],
+                protocol=proxy_config.get('protocol', 'http'),
+            )
+            exit_proxies.append((proxy['https'], proxy))
+
+        return exit_proxies
+
+    @staticmethod
+    def _create_governor(governor_config: dict) -> RateGovernor:
+        """Create a rate governor from the governor field of the configuration."""
+        return RateGovernor(
+            initial_rate=governor_config.get('initial_rate', constants.GOVERNOR_INITIAL_RATE),
+            min_rate=governor_config.get('min_rate', constants.GOVERNOR_MIN_RATE),
+            max_rate=governor_config.get('max_rate', constants.GOVERNOR_MAX_RATE),
+            additive_increase=governor_config.get('additive_increase', constants.GOVERNOR_ADDITIVE_INCREASE),
+            decrease_factor=governor_config.get('decrease_factor', constants.GOVERNOR_DECREASE_FACTOR),
+            latency_tolerance=governor_config.get('latency_tolerance', constants.GOVERNOR_LATENCY_TOLERANCE),
+        )
+
+    def _create_api(
+        self,
+        api_class: type,
+        pool_class: type[ProxyPool],
+        connection_options: dict,
+        api_options: dict,
+        exit_proxies: list[tuple[str, dict]],
+        pool_config: dict | None,
+    ):
+        """Create the API client, or a proxy pool with a client for every exit.
+
+        Args:
+            api_class: The class of the API client.
+            pool_class: The class of the proxy pool for that client.
+            connection_options: The size of the connection pool of every client.
+            api_options: The remaining options of every client.
+            exit_proxies: The name and proxy of every exit, or an empty list
+                to create a single client.
+            pool_config: The proxy_pool field of the configuration.
+        """
+        if not exit_proxies:
+            return api_class(**connection_options, **api_options, governor=self.governors.get('default'))
+
+        # Give every exit its own session, cookie jar and governor, sharing one cache in front of the pool
+        exits = [
+            ProxyExit(name, api_class(
+                **connection_options,
+                **{**api_options, 'proxy': proxy, 'cache': None},
+                governor=self.governors.get(name),
+            ))
+            for name, proxy in exit_proxies
+        ]
+        return pool_class(
+            exits,
+            cache=self.response_cache,
+            examination_type_id=api_options['examination_type_id'],
+            failure_threshold=pool_config.get('failure_threshold', constants.PROXY_FAILURE_THRESHOLD),
+            max_error_rate=pool_config.get('max_error_rate', constants.PROXY_MAX_ERROR_RATE),
+            min_requests=pool_config.get('min_requests', constants.PROXY_MIN_REQUESTS),
+            cooldown=pool_config.get('cooldown', constants.PROXY_COOLDOWN),
+        )
+
+    def log_retry(
+        self,
+        key: sweep.SweepTarget | tuple[sweep.SweepTarget, ...],
+        attempt: int,
+        delay: float,
+        error: Exception,
+    ) -> None:
+        """Log and count a failed attempt that is about to be retried.
+
+        Args:
+            key: The target of the request, or the tuple of the targets of a
+                batched request.
+            attempt: The number of the failed attempt.
+            delay: The number of seconds before the next attempt.
+            error: The error of the failed attempt.
+        """
+        # A target is a named tuple itself, so check for it before treating the key as a batch
+        targets = [key] if isinstance(key, sweep.SweepTarget) else list(key)
+        for target in targets:
+            self.metrics.retries.inc(target.location_id, constants.examination_dict[target.exam_type])
+
+        self.logger.warning(
+            'Attempt %s failed for location id: %s, retrying in %.1fs\n%s',
+            attempt, ', '.join(map(str, targets)), delay, error
+        )
+
+    def run_coroutine(self, coroutine):
+        """Run a coroutine on the background event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.event_loop).result()
+
+    def submit_fetch(self, target: sweep.SweepTarget, executor: ThreadPoolExecutor, **query_options) -> Future:
+        """Start retrieving the rides of a location in the background.
+
+        Args:
+            target: The location to retrieve.
+            executor: The thread pool running the threaded requests.
+            **query_options: The starting date and searched months of the query, if any.
+        """
+        if self.use_async:
+            from helpers import async_sweep
+            return asyncio.run_coroutine_threadsafe(
+                async_sweep.fetch_location(self.api, target, self.logger, self.retry_policy, **query_options),
+                self.event_loop,
+            )
+        return executor.submit(sweep.fetch_location, self.api, target, self.logger, self.retry_policy, **query_options)
+
+    def sweep_targets(self) -> list[sweep.SweepTarget]:
+        """Return the locations to sweep now, skipping the slow lane unless it is due."""
+        if self.all_locations:
+            return self.targets
+
+        targets = self.location_index.select(self.targets)
+        self.logger.debug(
+            'Sweeping %s of %s locations, skipping the slow lane', len(targets), len(self.targets)
+        )
+        return targets
+
+    def stream_sweep(self) -> Iterator[tuple[sweep.SweepTarget, list[Ride] | None]]:
+        """Sweep the valid locations for the selected examination types,
+        recording their statistics in the location index.
+
+        Yields:
+            A tuple of the target and its rides as soon as each location
+            completes. The rides are None if the location could not be retrieved.
+        """
+        targets = self.sweep_targets()
+
+        if self.use_async:
+            from helpers import async_sweep
+            stream = async_sweep.iterate_threadsafe(async_sweep.iter_locations(
+                self.api,
+                targets,
+                logger=self.logger,
+                retry_policy=self.retry_policy,
+                max_concurrency=self.max_async_requests,
+                batch_size=self.batch_size,
+            ), self.event_loop)
+        else:
+            stream = sweep.iter_locations(
+                self.api,
+                targets,
+                logger=self.logger,
+                retry_policy=self.retry_policy,
+                max_workers=self.max_workers,
+                batch_size=self.batch_size,
+            )
+
+        # Start measuring the wall time of the sweep
+        start_time = time.perf_counter()
+        failed_locations = 0
+
+        with self._progress_bar(len(targets)) as update_progress:
+            for target, location_rides in stream:
+                failed_locations += location_rides is None
+                self.location_index.record(target, location_rides)
+                update_progress()
+                yield target, location_rides
+
+        # Save the statistics of the swept locations
+        self.location_index.save()
+
+        # Report how long the sweep took
+        sweep_time = time.perf_counter() - start_time
+        self.metrics.sweep_duration.observe(sweep_time)
+        self.logger.debug(
+            'Swept %s locations in %.2fs (%s failed)',
+            len(targets), sweep_time, failed_locations
+        )
+
+        # Report how many requests the cache saved
+        if self.response_cache is not None:
+            self.logger.debug('Response cache: %s', self.response_cache.stats())
+
+        # Report the health of the exits of the proxy pool
+        if self.proxy_pool is not None:
+            for name, stats in self.proxy_pool.stats().items():
+                self.logger.debug('Proxy exit %s: %s', name, stats)
+
+        # Report the request rate the governors settled on
+        for name, governor in self.governors.items():
+            self.logger.debug('Rate governor %s: %s', name, governor.stats())
+
+    @contextlib.contextmanager
+    def _progress_bar(self, total: int) -> Iterator[Callable[[], None]]:
+        """Show a progress bar of the sweep on interactive consoles.
+
+        Args:
+            total: The number of locations in the sweep.
+
+        Yields:
+            The function to call when a location completes.
+        """
+        if not self.interactive:
+            yield lambda: None
+            return
+
+        from tqdm import tqdm
+
+        # Print the log messages above the progress bar while it is shown
+        with tqdm(
+            total=total,
+            desc='Updating local database',
+            unit='id',
+            leave=False,
+        ) as progress_bar, output.redirect_console(lambda message, stream: tqdm.write(message, file=stream)):
+            yield progress_bar.update
+
+    def close(self) -> None:
+        """Close the connection pool of the asyncio client and the metrics server."""
+        if self.use_async:
+            self.run_coroutine(self.api.close())
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+
+def run_sweep(runtime: Runtime, args: argparse.Namespace) -> None:
+    """Sweep all locations once and list the earliest rides."""
+    logger = runtime.logger
+
+    # Keep only the earliest rides of every exam type instead of sorting all of them
+    top_rides = io.get_option(args.top_rides, runtime.config, 'top_rides', constants.TOP_RIDES)
+    earliest_rides = {exam_type: EarliestRides(top_rides) for exam_type in runtime.exam_types}
+
+    # Start measuring the wall time of the sweep
+    start_time = time.perf_counter()
+
+    # Retrieve the available rides as each location completes
+    for target, available_rides_list in runtime.stream_sweep():
+        if not available_rides_list:
+            continue
+
+        # Show the earliest ride of the exam type as soon as it improves
+        if earliest_rides[target.exam_type].extend(available_rides_list):
+            ride = earliest_rides[target.exam_type].best
+            logger.info(
+                '[Earliest] %s, %s %s in %s for %s (after %.2fs)',
+                ride.name,
+                ride.date,
+                ride.time,
+                ride.location,
+                ride.cost,
+                time.perf_counter() - start_time,
+                extra={'color': 'cyan'},
+            )
+
+    # Display the earliest rides, latest first so that the earliest ends up at the bottom
+    for exam_type_rides in earliest_rides.values():
+        for ride in reversed(exam_type_rides.sorted()):
+            logger.info(
+                '%s, %s %s in %s for %s',
+                ride.name,
+                ride.date,
+                ride.time,
+                ride.location,
+                ride.cost
+            )
+
+    # Show the total amount of rides found
+    logger.info(
+        'Total: %s', sum(exam_type_rides.seen for exam_type_rides in earliest_rides.values())
+    )
+
+    # Show how long the sweep took
+    logger.info(
+        'Sweep time: %.2fs', time.perf_counter() - start_time
+    )
+
+
+def run_watch(runtime: Runtime, args: argparse.Namespace) -> None:
+    """Poll all locations continuously and log the changes."""
+    logger, config = runtime.logger, runtime.config
+
+    # Save every poll to the database in the background
+    snapshot_store = storage.SnapshotStore(
+        io.get_option(args.database, config, 'database', paths.snapshot_database), logger
+    )
+
+    # Last known rides of every location of every exam type, starting from the
+    # state saved by the previous run
+    diff_engines = {
+        exam_type: diff.DiffEngine(snapshot_store.load_current(exam_type))
+        for exam_type in runtime.exam_types
+    }
+
+    # Earliest ride over all locations of every exam type
+    next_available_rides = {
+        exam_type: diff_engine.earliest() for exam_type, diff_engine in diff_engines.items()
+    }
+
+    # Match the changes against the rides every watcher is waiting for
+    profile_matcher = watch.ProfileMatcher(watch.load_profiles(
+        io.get_option(args.watch_profiles, config, 'watch_profiles', paths.watch_profiles)
+    ))
+    if profile_matcher:
+        logger.info('Loaded %s watch profiles', len(profile_matcher))
+
+    # Deliver the changes to the notification sinks in the background if configured
+    notifier = notify.Notifier(
+        notify.create_worker(options, runtime.metrics, logger)
+        for options in config.get('notifications', [])
+    )
+    if notifier:
+        runtime.metrics.watch_notifier(notifier.stats)
+        logger.info('Delivering the changes to %s notification sinks', len(notifier))
+
+    # Load the polling bounds and request budget
+    polling_config: dict = config.get('polling', {})
+
+    # Only ask the server for the dates the watchers care about, and for all
+    # dates on a slower cadence
+    query_planner = date_window.QueryPlanner(
+        profile_matcher.profiles,
+        full_interval=polling_config.get('full_interval', constants.FULL_POLLING_INTERVAL),
+    )
+
+    # The date window of every poll in flight
+    poll_windows: dict[sweep.SweepTarget, date_window.DateWindow] = {}
+
+    # Give every location of every exam type its own polling interval, starting
+    # at the polling frequency, sharing one request budget
+    poll_scheduler = scheduler.PollScheduler(
+        runtime.targets,
+        initial_interval=io.get_option(args.polling_frequency, polling_config, 'frequency', constants.POLLING_FREQUENCY),
+        min_interval=io.get_option(args.min_interval, polling_config, 'min_interval', constants.MIN_POLLING_INTERVAL),
+        max_interval=io.get_option(args.max_interval, polling_config, 'max_interval', constants.MAX_POLLING_INTERVAL),
+        requests_per_hour=io.get_option(args.requests_per_hour, polling_config, 'requests_per_hour', constants.REQUESTS_PER_HOUR),
+    )
+
+    def format_next_available(exam_type: str) -> str:
+        """Format the earliest ride of an exam type for the status line."""
+        next_available_ride = next_available_rides[exam_type]
+        if next_available_ride is None:
+            next_available = 'None'
+        else:
+            next_available = (
+                f'{next_available_ride.date} {next_available_ride.time} '
+                f'in {next_available_ride.location}'
+            )
+
+        # Tell the exam types apart when sweeping more than one
+        if len(runtime.exam_types) > 1:
+            return f'{exam_type} {next_available}'
+        return next_available
+
+    def print_status(seconds_until_next: float) -> None:
+        """Print current information to console."""
+        next_available = ', '.join(map(format_next_available, runtime.exam_types))
+
+        # Every location is being polled when none is waiting in the queue
+        if math.isinf(seconds_until_next):
+            next_poll = 'now'
+        else:
+            next_poll = datetime.timedelta(seconds=int(seconds_until_next))
+
+        helpers.inplace_print(
+            f'Database size: {sum(map(len, diff_engines.values()))} | '
+            f'Next poll: {next_poll} | '
+            f'Next available: {next_available}'
+        )
+
+    # Message and colour of added and removed rides
+    event_formats = {
+        diff.EventType.ADDED: ('[Added] %s, %s %s in %s for %s', 'green'),
+        diff.EventType.REMOVED: ('[Removed] %s, %s %s in %s for %s', 'red'),
+    }
+
+    def submit_poll(target: sweep.SweepTarget, executor: ThreadPoolExecutor) -> Future:
+        """Start polling a location within the date window planned for it."""
+        window = poll_windows[target] = query_planner.plan(target)
+        return runtime.submit_fetch(target, executor, **window.query_options())
+
+    def log_changes(target: sweep.SweepTarget, future: Future) -> bool | None:
+        """Log the rides that were added, removed or changed in a polled location.
+
+        Returns:
+            Whether the rides of the location changed, or None if the location
+            could not be retrieved.
+        """
+        window = poll_windows.pop(target)
+        try:
+            available_rides_list = future.result()
+        except runtime.fetch_errors:
+            # Keep the previous state of the location until it can be retrieved
+            runtime.location_index.record(target, None)
+            return None
+
+        query_planner.record(target, window)
+
+        # Compare the dates of the poll against their previous state
+        diff_engine = diff_engines[target.exam_type]
+        events = diff_engine.update(target.location_id, available_rides_list, *window)
+
+        # Save the poll, marking the rides that disappeared as removed. The
+        # rides outside the window of the poll are kept.
+        location_rides = diff_engine.location_rides(target.location_id)
+        snapshot_store.save(target.exam_type, target.location_id, location_rides)
+        runtime.location_index.record(target, location_rides)
+
+        if not events:
+            return False
+
+        runtime.metrics.record_events(events, constants.examination_dict[target.exam_type])
+
+        # Find the earliest ride over all locations of the exam type
+        next_available_rides[target.exam_type] = diff_engine.earliest()
+
+        # Hide the in-place print output
+        if runtime.interactive:
+            helpers.hide_print()
+
+        for event in events:
+            ride = event.ride
+
+            if event.type is diff.EventType.CHANGED:
+                # Example: "[Changed] Kunskapsprov B, 2022-01-07 11:15 in Örebro for 400kr (was 325kr)"
+                logger.info(
+                    '[Changed] %s, %s %s in %s for %s (was %s)',
+                    ride.name,
+                    ride.date,
+                    ride.time,
+                    ride.location,
+                    ride.cost,
+                    event.previous.cost,
+                    extra={'color': 'yellow'},
+                )
+            else:
+                # Example: "[Added] Kunskapsprov B, 2022-01-07 11:15 in Örebro for 325kr"
+                message, color = event_formats[event.type]
+                logger.info(
+                    message,
+                    ride.name,
+                    ride.date,
+                    ride.time,
+                    ride.location,
+                    ride.cost,
+                    extra={'color': color},
+                )
+
+        # Example: "[Match] Anna: Körprov B, 2022-01-07 11:15 in Örebro for 800kr"
+        matches = profile_matcher.match(events, target.exam_type)
+        for match in matches:
+            ride = match.event.ride
+            logger.info(
+                '[Match] %s: %s, %s %s in %s for %s',
+                match.profile.name,
+                ride.name,
+                ride.date,
+                ride.time,
+                ride.location,
+                ride.cost,
+                extra={'color': 'magenta'},
+            )
+
+        # Hand the changes to the sinks without waiting for their delivery
+        if notifier:
+            notifier.publish(notify.create_notifications(target.exam_type, events, matches))
+
+        return True
+
+    try:
+        with ThreadPoolExecutor(max_workers=runtime.max_workers) as executor:
+            # Poll every location when it is due and log its changes as soon as it lands
+            scheduler.poll_forever(
+                poll_scheduler,
+                submit=lambda target: submit_poll(target, executor),
+                on_polled=log_changes,
+                max_in_flight=runtime.max_async_requests if runtime.use_async else runtime.max_workers,
+                on_idle=print_status if runtime.interactive else None,
+                # Only run a limited number of polls when profiling
+                max_polls=(args.profile_polls or len(runtime.targets)) if args.profile else None,
+            )
+    finally:
+        # Write the polls that are still queued before exiting
+        snapshot_store.close()
+
+        # Deliver the notifications that are still queued, for a limited time
+        notifier.close()
+
+        # Save the statistics of the polled locations
+        runtime.location_index.save()
+
+
+def run_serve(runtime: Runtime, args: argparse.Namespace) -> None:
+    """Serve the rides on a local web server, sweeping in the background."""
+    # Only import aiohttp when it is needed
+    from helpers import async_sweep
+    from web import server
+
+    # Load the address of the server and the time between sweeps
+    web_config: dict = runtime.config.get('web', {})
+
+    async def record_locations(stream: AsyncIterator[tuple[sweep.SweepTarget, list[Ride] | None]]):
+        """Record the statistics of every swept location, saving them when the sweep completes."""
+        async for target, rides in stream:
+            runtime.location_index.record(target, rides)
+            yield target, rides
+
+        runtime.location_index.save()
+
+    def start_sweep():
+        """Start a sweep of the valid locations and exam types, streaming the rides of each location."""
+        targets = runtime.sweep_targets()
+
+        if runtime.use_async:
+            return record_locations(async_sweep.iter_locations(
+                runtime.api,
+                targets,
+                logger=runtime.logger,
+                retry_policy=runtime.retry_policy,
+                max_concurrency=runtime.max_async_requests,
+                batch_size=runtime.batch_size,
+            ))
+
+        # Run the threaded sweep without blocking the server
+        return record_locations(async_sweep.iterate_in_executor(sweep.iter_locations(
+            runtime.api,
+            targets,
+            logger=runtime.logger,
+            retry_policy=runtime.retry_policy,
+            max_workers=runtime.max_workers,
+            batch_size=runtime.batch_size,
+        )))
+
+    async def serve() -> None:
+        """Serve the rides from memory while sweeping in the background."""
+        web_server = server.WebServer(server.Snapshot(), runtime.logger, runtime.metrics)
+        await web_server.start(
+            io.get_option(args.host, web_config, 'host', constants.WEB_HOST),
+            io.get_option(args.port, web_config, 'port', constants.WEB_PORT),
+        )
+
+        try:
+            await server.sweep_forever(
+                web_server,
+                start_sweep,
+                interval=io.get_option(args.sweep_interval, web_config, 'sweep_interval', constants.WEB_SWEEP_INTERVAL),
+                logger=runtime.logger,
+            )
+        finally:
+            await web_server.stop()
+
+    # Serve from the event loop of the asyncio client, so that it keeps its connection pool
+    if runtime.use_async:
+        runtime.run_coroutine(serve())
+    else:
+        asyncio.run(serve())
@@ -0,0 +1,64 @@
+"""Tests of the request coalescing of the asyncio response cache."""
+import asyncio
+import unittest
+
+from api.cache import ResponseCache
+
+
+class CoalescingTest(unittest.TestCase):
+    """The callers waiting for the same key share one load, whoever is cancelled."""
+
+    def setUp(self) -> None:
+        self.cache = ResponseCache()
+        self.loads = 0
+
+    async def load(self) -> list:
+        """Load a value after a short delay, counting the loads."""
+        self.loads += 1
+        await asyncio.sleep(0.05)
+        return ['2023-02-01']
+
+    def test_cancelled_first_caller(self) -> None:
+        """Cancelling the caller that started the load does not cancel the others."""
+        async def run() -> list:
+            first = asyncio.ensure_future(self.cache.get_or_load_async(1000001, self.load))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(self.cache.get_or_load_async(1000001, self.load))
+            await asyncio.sleep(0)
+
+            first.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await first
+            return await second
+
+        self.assertEqual(asyncio.run(run()), ['2023-02-01'])
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache.stats(), {'hits': 0, 'misses': 1, 'coalesced': 1})
+
+        # The value of the load is cached
+        self.assertEqual(asyncio.run(self.cache.get_or_load_async(1000001, self.load)), ['2023-02-01'])
+        self.assertEqual(self.loads, 1)
+
+    def test_failed_load(self) -> None:
+        """Every caller gets the error of a failed load, which is not cached."""
+        async def fail() -> list:
+            await asyncio.sleep(0.05)
+            raise ConnectionError('Connection reset')
+
+        async def run() -> list:
+            return await asyncio.gather(
+                self.cache.get_or_load_async(1000001, fail),
+                self.cache.get_or_load_async(1000001, fail),
+                return_exceptions=True,
+            )
+
+        first, second = asyncio.run(run())
+        self.assertIsInstance(first, ConnectionError)
+        self.assertIs(first, second)
+
+        # Failed loads are not cached
+        self.assertEqual(asyncio.run(self.cache.get_or_load_async(1000001, self.load)), ['2023-02-01'])
+
+
+if __name__ == '__main__':
+    unittest.main()
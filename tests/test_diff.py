@@ -0,0 +1,82 @@
+"""Tests of the polls limited to a date window."""
+import random
+import unittest
+
+from helpers import diff
+from helpers.ride import Ride
+
+DATES = [f'2026-{month:02}-{day:02}' for month in (10, 11) for day in range(1, 29)]
+
+
+def in_window(ride: Ride, start_date: str | None, end_date: str | None) -> bool:
+    """Check whether a ride is within the dates of a poll."""
+    return (start_date is None or ride.date >= start_date) and (end_date is None or ride.date <= end_date)
+
+
+class WindowUpdateTest(unittest.TestCase):
+    """A poll limited to a date window only changes the rides within its dates."""
+
+    def setUp(self) -> None:
+        self.generator = random.Random(2026)
+
+    def create_rides(self, count: int) -> list[Ride]:
+        """Create random rides of one location, some of them with the same identity."""
+        return [
+            Ride(
+                self.generator.choice(DATES),
+                self.generator.choice(('08:00', '09:30')),
+                'Farsta',
+                'Körprov B',
+                self.generator.choice(('800 kr', '1 040 kr')),
+            )
+            for _ in range(count)
+        ]
+
+    def test_outside_rides_kept(self) -> None:
+        """The ride outside the dates of the poll is not reported as removed."""
+        rides = [Ride('2026-10-01', '08:00', 'Farsta', 'Körprov B', '800 kr'),
+                 Ride('2026-11-20', '08:00', 'Farsta', 'Körprov B', '800 kr')]
+        diff_engine = diff.DiffEngine({1000001: rides})
+
+        # The poll of October does not see the ride in November
+        events = diff_engine.update(1000001, rides[:1], '2026-10-01', '2026-10-31')
+        self.assertEqual(events, [])
+        self.assertEqual(sorted(diff_engine.location_rides(1000001)), rides)
+        self.assertEqual(len(diff_engine), 2)
+
+    def test_random_windows(self) -> None:
+        """Random polls only report and replace the rides within their dates."""
+        diff_engine = diff.DiffEngine()
+        state = {}
+        for _ in range(500):
+            start_date, end_date = sorted(self.generator.sample(DATES, 2))
+            start_date = self.generator.choice((start_date, None))
+            end_date = self.generator.choice((end_date, None))
+
+            # The server only returns the rides within the dates of the poll
+            polled = {
+                ride.key: ride for ride in self.create_rides(self.generator.randrange(0, 20))
+                if in_window(ride, start_date, end_date)
+            }
+            events = diff_engine.update(1000001, polled.values(), start_date, end_date)
+
+            previous = {key: ride for key, ride in state.items() if in_window(ride, start_date, end_date)}
+            expected = {
+                (diff.EventType.ADDED, ride) for key, ride in polled.items() if key not in previous
+            } | {
+                (diff.EventType.REMOVED, ride) for key, ride in previous.items() if key not in polled
+            } | {
+                (diff.EventType.CHANGED, ride) for key, ride in polled.items() if key in previous and previous[key] != ride
+            }
+            self.assertEqual({(event.type, event.ride) for event in events}, expected)
+            self.assertEqual(len(events), len(expected))
+
+            # The rides outside the dates of the poll are kept as they were
+            state = {**{key: ride for key, ride in state.items() if not in_window(ride, start_date, end_date)}, **polled}
+            self.assertEqual(sorted(diff_engine.location_rides(1000001)), sorted(state.values()))
+            self.assertEqual(len(diff_engine), len(state))
+            self.assertEqual(diff_engine.earliest(), min(state.values(), default=None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+"""Tests of the console output while a progress bar is shown."""
+import logging
+import tempfile
+import unittest
+
+from helpers import output
+
+
+class RedirectConsoleTest(unittest.TestCase):
+    """The console output goes through the redirect only, once per record."""
+
+    def setUp(self) -> None:
+        self.stream = tempfile.TemporaryFile('w+')
+        self.handler = logging.StreamHandler(self.stream)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+        output.console_handlers.append(self.handler)
+
+    def tearDown(self) -> None:
+        output.console_handlers.remove(self.handler)
+        self.stream.close()
+
+    def log(self, message: str) -> None:
+        """Write a record to the console handler, like the listener thread does."""
+        self.handler.handle(logging.makeLogRecord({'msg': message, 'levelno': logging.INFO}))
+
+    def console(self) -> str:
+        """Return everything written to the console stream directly."""
+        self.stream.seek(0)
+        return self.stream.read()
+
+    def test_redirect(self) -> None:
+        """Every record is written once, through the redirect while it is active."""
+        lines = []
+        with output.redirect_console(lambda message, stream: lines.append((message, stream))):
+            self.log('Checking location 1000001')
+
+        self.assertEqual(lines, [('Checking location 1000001', self.stream)])
+        self.assertEqual(self.console(), '')
+
+        # The console is written directly again after the progress bar
+        self.log('Done')
+        self.assertEqual(lines, [('Checking location 1000001', self.stream)])
+        self.assertEqual(self.console(), 'Done\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
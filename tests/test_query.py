@@ -0,0 +1,118 @@
+"""Tests of the queries over the available rides."""
+import logging
+import random
+import unittest
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from helpers import sweep
+from helpers.query import RideIndex, RideQuery, parse_cost
+from helpers.ride import Ride
+from web import server
+
+RIDES = [
+    Ride('2026-10-20', '08:00', 'Farsta', 'Körprov B', '800 kr'),
+    Ride('2026-11-01', '09:30', 'Farsta', 'Körprov B', '800 kr'),
+    Ride('2026-11-02', '10:15', 'Farsta', 'Körprov B', '800 kr'),
+]
+
+
+def matches(ride: Ride, query: RideQuery, cost: int | None) -> bool:
+    """Check whether a ride with a parsed cost matches the filters of a query without any index."""
+    return (
+        (query.locations is None or ride.location in query.locations)
+        and (query.names is None or ride.name in query.names)
+        and (query.start_date is None or ride.date >= query.start_date)
+        and (query.end_date is None or ride.date <= query.end_date)
+        and (query.max_cost is None or (cost is not None and cost <= query.max_cost))
+    )
+
+
+class RideIndexTest(unittest.TestCase):
+    """The indexed queries find the same rides as a linear scan."""
+
+    def test_linear_scan(self) -> None:
+        """Random queries over random rides match the rides found by checking every ride."""
+        generator = random.Random(2026)
+        dates = [f'2026-{month:02}-{day:02}' for month in (10, 11, 12) for day in range(1, 29)]
+        locations = [f'Location {i}' for i in range(12)]
+        names = ['Körprov B', 'Körprov A', 'Kunskapsprov B']
+        costs = ['325 kr', '800 kr', '1 040 kr', 'Gratis']
+        rides = [
+            Ride(
+                generator.choice(dates),
+                f'{generator.randrange(7, 18):02}:{generator.choice((0, 15, 30, 45)):02}',
+                generator.choice(locations),
+                generator.choice(names),
+                generator.choice(costs),
+            )
+            for _ in range(1500)
+        ]
+        index = RideIndex(rides)
+        expected_order = [(ride, parse_cost(ride.cost)) for ride in sorted(rides)]
+
+        def sample(values: list[str]) -> list[str] | None:
+            """Pick no filter, or a few values including some that have no rides."""
+            if generator.random() < 0.4:
+                return None
+            return generator.sample(values + ['Unknown'], generator.randrange(0, 4))
+
+        for _ in range(2000):
+            start_date, end_date = (generator.choice(dates + [None]) for _ in range(2))
+            query = RideQuery(
+                locations=sample(locations),
+                names=sample(names),
+                start_date=start_date,
+                end_date=end_date,
+                max_cost=generator.choice((None, 0, 500, 900, 2000)),
+                limit=generator.choice((None, 0, 1, 5, 50)),
+            )
+            expected = [ride for ride, cost in expected_order if matches(ride, query, cost)]
+
+            # The earliest ride ignores the limit of the query
+            self.assertEqual(index.earliest(query), next(iter(expected), None), query)
+            if query.limit is not None:
+                expected = expected[:query.limit]
+            self.assertEqual(index.query(query), expected, query)
+
+
+class QueryEndpointTest(unittest.IsolatedAsyncioTestCase):
+    """The dates of a query are validated and compared as dates."""
+
+    async def asyncSetUp(self) -> None:
+        logger = logging.getLogger('test_query')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+
+        web_server = server.WebServer(server.Snapshot(), logger)
+        web_server.apply(sweep.SweepTarget('Körprov', 1000001), RIDES)
+        self.client = TestClient(TestServer(web_server.app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self) -> None:
+        await self.client.close()
+
+    async def query(self, **params) -> tuple[int, list[str]]:
+        """Send a query and return the status and the dates of the rides."""
+        response = await self.client.get('/query', params=params)
+        if response.status != 200:
+            return response.status, []
+        return response.status, [ride['date'] for ride in (await response.json())['rides']]
+
+    async def test_date_range(self) -> None:
+        """Both dates are included."""
+        self.assertEqual(await self.query(**{'from': '2026-10-21', 'to': '2026-11-01'}), (200, ['2026-11-01']))
+
+    async def test_basic_format(self) -> None:
+        """A date without dashes is compared as a date, not as a string."""
+        self.assertEqual(await self.query(to='20261101'), (200, ['2026-10-20', '2026-11-01']))
+
+    async def test_malformed_date(self) -> None:
+        """A date that does not exist or is incomplete is answered with 400."""
+        for params in ({'from': 'bad'}, {'to': '2026-13-01'}, {'from': '2026-10'}):
+            with self.subTest(params=params):
+                self.assertEqual(await self.query(**params), (400, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+"""Tests of the request budget of the adaptive polling scheduler."""
+import unittest
+
+from helpers import io, scheduler
+
+
+class RequestBudgetTest(unittest.TestCase):
+    """The request budget must be positive, also when given as 0 on the command line."""
+
+    def test_positive_budget(self) -> None:
+        """A positive budget lets the first poll go out immediately."""
+        poll_scheduler = scheduler.PollScheduler(['a'], 60, 1, 600, 3600, clock=lambda: 0.0)
+        self.assertEqual(poll_scheduler.time_until_next(), 0.0)
+
+    def test_non_positive_budget(self) -> None:
+        """A budget of zero or less is rejected instead of dividing by zero later."""
+        for requests_per_hour in (0, -1):
+            with self.subTest(requests_per_hour=requests_per_hour), self.assertRaises(ValueError):
+                scheduler.PollScheduler(['a'], 60, 1, 600, requests_per_hour)
+
+    def test_option_zero(self) -> None:
+        """A budget of zero given on the command line is not replaced by the configured one."""
+        config = {'requests_per_hour': 600}
+        self.assertEqual(io.get_option(0, config, 'requests_per_hour', 1200), 0)
+        self.assertEqual(io.get_option(None, config, 'requests_per_hour', 1200), 600)
+        self.assertEqual(io.get_option(None, {}, 'requests_per_hour', 1200), 1200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+"""Tests of the retries and rejections of batched sweep requests."""
+import asyncio
+import logging
+import types
+import unittest
+
+import modes
+from api.exceptions import BatchRejected, HTTPStatus
+from api.metrics import Metrics
+from api.retry import RetryPolicy
+from helpers import async_sweep, sweep
+from variables import constants
+
+TARGETS = [sweep.SweepTarget('Körprov', location_id) for location_id in (1000001, 1000002, 1000003)]
+
+
+def create_bundle(location_id: int) -> dict:
+    """Create a bundle with one occasion in a location."""
+    return {'occasions': [{
+        'locationId': location_id,
+        'date': '2023-02-01',
+        'time': '08:00',
+        'locationName': f'Location {location_id}',
+        'name': 'Körprov B',
+        'cost': '800 kr',
+    }]}
+
+
+class FakeServer:
+    """A server whose batched requests fail with a 503 a number of times, or are always rejected."""
+
+    def __init__(self, failures: int = 0, reject: bool = False) -> None:
+        self.failures = failures
+        self.reject = reject
+        self.batch_calls = 0
+
+    def answer_batch(self, location_ids: list[int]) -> dict[int, list[dict]]:
+        """Answer a batched request."""
+        self.batch_calls += 1
+        if self.reject:
+            raise BatchRejected(location_ids, 'nearbyLocationIds is not supported')
+        if self.batch_calls <= self.failures:
+            raise HTTPStatus(503)
+        return {location_id: [create_bundle(location_id)] for location_id in location_ids}
+
+
+class FakeAPI:
+    """An API answered by a `FakeServer`."""
+
+    def __init__(self, server: FakeServer) -> None:
+        self.server = server
+        self.batching = True
+
+    def get_available_dates_batch(self, location_ids: list[int], **_options) -> dict[int, list[dict]]:
+        """Request a batch of locations."""
+        return self.server.answer_batch(location_ids)
+
+    def get_available_dates(self, location_id: int, **_options) -> list[dict]:
+        """Request a single location."""
+        return [create_bundle(location_id)]
+
+
+class AsyncFakeAPI:
+    """The asyncio counterpart of `FakeAPI`."""
+
+    def __init__(self, server: FakeServer) -> None:
+        self.server = server
+        self.batching = True
+
+    async def get_available_dates_batch(self, location_ids: list[int], **_options) -> dict[int, list[dict]]:
+        """Request a batch of locations."""
+        return self.server.answer_batch(location_ids)
+
+    async def get_available_dates(self, location_id: int, **_options) -> list[dict]:
+        """Request a single location."""
+        return [create_bundle(location_id)]
+
+
+class SweepTestCase(unittest.TestCase):
+    """Sweep the targets in batches of three without logging."""
+
+    def setUp(self) -> None:
+        self.logger = logging.getLogger('test_sweep')
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+
+    def sweep(self, api: FakeAPI, retry_policy: RetryPolicy) -> dict:
+        """Sweep the targets with the threaded engine."""
+        return dict(sweep.iter_locations(api, TARGETS, self.logger, retry_policy, max_workers=1, batch_size=3))
+
+    def sweep_async(self, api: AsyncFakeAPI, retry_policy: RetryPolicy) -> dict:
+        """Sweep the targets with the asyncio engine."""
+        async def collect() -> dict:
+            return {
+                target: rides
+                async for target, rides in async_sweep.iter_locations(api, TARGETS, self.logger, retry_policy, batch_size=3)
+            }
+
+        return asyncio.run(collect())
+
+
+class BatchRetryTest(SweepTestCase):
+    """Retrying a batched request logs and counts the retry for every target of the batch."""
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        # The parts of the runtime used by `Runtime.log_retry`
+        self.runtime = types.SimpleNamespace(metrics=Metrics(), logger=self.logger)
+        self.retry_options = {
+            'max_attempts': 3,
+            'base_delay': 0,
+            'on_retry': lambda *args: modes.Runtime.log_retry(self.runtime, *args),
+        }
+
+    def assert_retries(self, retries: int) -> None:
+        """Check the number of retries counted for every target."""
+        for target in TARGETS:
+            examination_type_id = constants.examination_dict[target.exam_type]
+            self.assertEqual(self.runtime.metrics.retries.value(target.location_id, examination_type_id), retries)
+
+    def test_batch_retry(self) -> None:
+        """The batch succeeds on its second attempt."""
+        server = FakeServer(failures=1)
+        results = self.sweep(FakeAPI(server), RetryPolicy(**self.retry_options))
+
+        self.assertEqual(server.batch_calls, 2)
+        self.assertEqual(set(results), set(TARGETS))
+        self.assertTrue(all(len(rides) == 1 for rides in results.values()))
+        self.assert_retries(1)
+
+    def test_failed_batch(self) -> None:
+        """The batch gives up after its attempts without stopping the sweep."""
+        results = self.sweep(FakeAPI(FakeServer(failures=3)), RetryPolicy(**self.retry_options))
+
+        self.assertEqual(results, {target: None for target in TARGETS})
+        self.assert_retries(2)
+
+    def test_async_batch_retry(self) -> None:
+        """The asyncio batch succeeds on its second attempt."""
+        server = FakeServer(failures=1)
+        results = self.sweep_async(AsyncFakeAPI(server), async_sweep.create_retry_policy(**self.retry_options))
+
+        self.assertEqual(server.batch_calls, 2)
+        self.assertEqual(set(results), set(TARGETS))
+        self.assert_retries(1)
+
+
+class RejectedBatchTest(SweepTestCase):
+    """A rejected batch is requested one location at a time, and batching is turned off."""
+
+    def test_rejected_batch(self) -> None:
+        """The threaded engine falls back to one request per location."""
+        api = FakeAPI(FakeServer(reject=True))
+        results = self.sweep(api, RetryPolicy(base_delay=0))
+
+        self.assertEqual(api.server.batch_calls, 1)
+        self.assertFalse(api.batching)
+        self.assertEqual(set(results), set(TARGETS))
+        self.assertTrue(all(len(rides) == 1 for rides in results.values()))
+
+    def test_async_rejected_batch(self) -> None:
+        """The asyncio engine falls back to one request per location."""
+        api = AsyncFakeAPI(FakeServer(reject=True))
+        results = self.sweep_async(api, async_sweep.create_retry_policy(base_delay=0))
+
+        self.assertEqual(api.server.batch_calls, 1)
+        self.assertFalse(api.batching)
+        self.assertEqual(set(results), set(TARGETS))
+        self.assertTrue(all(len(rides) == 1 for rides in results.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
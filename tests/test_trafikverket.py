@@ -0,0 +1,88 @@
+"""Tests of the handling of invalid response bodies by the API clients."""
+import asyncio
+import logging
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from api.async_trafikverket import AsyncTrafikverketAPI
+from api.exceptions import InvalidPayload
+from api.retry import RetryPolicy
+from api.trafikverket import TrafikverketAPI
+from helpers import async_sweep, sweep
+
+API_OPTIONS = {
+    'cookies': {},
+    'proxy': None,
+    'useragent': 'test',
+    'ssn': '19700101-0000',
+}
+
+
+class MaintenanceHandler(BaseHTTPRequestHandler):
+    """Answer every request with a 200 response and an HTML maintenance page."""
+
+    def do_POST(self) -> None:
+        """Answer a request for the rides of a location."""
+        self.server.request_count += 1
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = b'<html>Maintenance</html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class InvalidPayloadTest(unittest.TestCase):
+    """A successful response whose body is not JSON is an error the retry policy handles."""
+
+    def setUp(self) -> None:
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), MaintenanceHandler)
+        self.server.request_count = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address
+        self.base_url = f'http://{host}:{port}'
+
+        self.logger = logging.getLogger('test_trafikverket')
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_html_body(self) -> None:
+        """The threaded client retries the HTML body, then reports the location as failed."""
+        api = TrafikverketAPI(**API_OPTIONS, base_url=self.base_url)
+        with self.assertRaises(InvalidPayload):
+            api.get_available_dates(1000001)
+
+        # The sweep retries the location, then reports it as failed and carries on
+        self.server.request_count = 0
+        retry_policy = RetryPolicy(max_attempts=3, base_delay=0)
+        target = sweep.SweepTarget('Körprov', 1000001)
+        self.assertEqual(list(sweep.iter_locations(api, [target], self.logger, retry_policy)), [(target, None)])
+        self.assertEqual(self.server.request_count, 3)
+
+    def test_async_html_body(self) -> None:
+        """The asyncio client retries the HTML body, then reports the location as failed."""
+        retry_policy = async_sweep.create_retry_policy(max_attempts=3, base_delay=0)
+        target = sweep.SweepTarget('Körprov', 1000001)
+
+        async def run() -> list:
+            async with AsyncTrafikverketAPI(**API_OPTIONS, base_url=self.base_url) as api:
+                with self.assertRaises(InvalidPayload):
+                    await api.get_available_dates(1000001)
+                self.server.request_count = 0
+                return [result async for result in async_sweep.iter_locations(api, [target], self.logger, retry_policy)]
+
+        self.assertEqual(asyncio.run(run()), [(target, None)])
+        self.assertEqual(self.server.request_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
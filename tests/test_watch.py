@@ -0,0 +1,93 @@
+"""Tests of the matching of ride events against watch profiles."""
+import random
+import unittest
+
+from helpers import diff, query, watch
+from helpers.ride import Ride
+
+DATES = [f'2026-{month:02}-{day:02}' for month in (10, 11, 12) for day in range(1, 29)]
+LOCATIONS = {1000000 + i: f'Location {i}' for i in range(10)}
+NAMES = ['Körprov B', 'Körprov A', 'Kunskapsprov B']
+COSTS = ['325 kr', '800 kr', '1 040 kr', 'Gratis']
+
+
+def matches(profile: watch.WatchProfile, event: diff.RideEvent, exam_type: str) -> bool:
+    """Check every filter of a profile against an event without any index."""
+    ride = event.ride
+    cost = query.parse_cost(ride.cost)
+    return (
+        (profile.locations is None or event.location_id in profile.locations or ride.location in profile.locations)
+        and (profile.start_date is None or ride.date >= profile.start_date)
+        and (profile.end_date is None or ride.date <= profile.end_date)
+        and (profile.exam_type is None or profile.exam_type == exam_type)
+        and (profile.names is None or ride.name in profile.names)
+        and (profile.max_cost is None or (cost is not None and cost <= profile.max_cost))
+        and event.type in profile.events
+    )
+
+
+class ProfileMatcherTest(unittest.TestCase):
+    """The indexed matcher finds the same matches as checking every profile."""
+
+    def setUp(self) -> None:
+        self.generator = random.Random(2026)
+
+    def create_profile(self, number: int) -> watch.WatchProfile:
+        """Create a random profile, leaving every filter out at times."""
+        generator = self.generator
+
+        def maybe(value):
+            return value if generator.random() < 0.6 else None
+
+        # Watch the locations by ID, by name, or both
+        locations = generator.sample(sorted(LOCATIONS), generator.randrange(1, 4))
+        locations = [location if generator.random() < 0.5 else LOCATIONS[location] for location in locations]
+
+        start_date, end_date = sorted(generator.sample(DATES, 2))
+        return watch.WatchProfile(
+            name=f'Watcher {number}',
+            locations=maybe(frozenset(locations)),
+            start_date=maybe(start_date),
+            end_date=maybe(generator.choice((end_date, start_date))),
+            exam_type=maybe(generator.choice(('Körprov', 'Kunskapsprov'))),
+            names=maybe(frozenset(generator.sample(NAMES, generator.randrange(1, 3)))),
+            max_cost=maybe(generator.choice((0, 500, 900, 2000))),
+            events=frozenset(generator.sample(list(diff.EventType), generator.randrange(1, 4))),
+        )
+
+    def create_event(self) -> diff.RideEvent:
+        """Create a random event."""
+        generator = self.generator
+        location_id = generator.choice(sorted(LOCATIONS))
+        ride = Ride(
+            generator.choice(DATES),
+            '08:00',
+            LOCATIONS[location_id],
+            generator.choice(NAMES),
+            generator.choice(COSTS),
+        )
+        return diff.RideEvent(generator.choice(list(diff.EventType)), location_id, ride)
+
+    def test_brute_force(self) -> None:
+        """The matches of random profiles and events are the ones found by checking every profile."""
+        profiles = [self.create_profile(number) for number in range(60)]
+        matcher = watch.ProfileMatcher(profiles)
+
+        for exam_type in ('Körprov', 'Kunskapsprov'):
+            events = [self.create_event() for _ in range(1500)]
+            expected = [
+                watch.Match(profile, event)
+                for event in events
+                for profile in profiles
+                if matches(profile, event, exam_type)
+            ]
+            self.assertTrue(expected)
+            self.assertEqual(matcher.match(events, exam_type), expected)
+
+    def test_no_profiles(self) -> None:
+        """Without profiles nothing matches."""
+        self.assertEqual(watch.ProfileMatcher([]).match([self.create_event()], 'Körprov'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,43 @@
-MAX_ATTEMPTS = 10
-WAIT_TIME = 2
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_DELAY = 0.5
+BACKOFF_MAX_DELAY = 8
+CIRCUIT_FAILURE_THRESHOLD = 3
+CIRCUIT_COOLDOWN = 600
+MAX_WORKERS = 8
+MAX_ASYNC_REQUESTS = 100
+BATCH_SIZE = 1
+POLLING_FREQUENCY = 1200
+MIN_POLLING_INTERVAL = 60
+MAX_POLLING_INTERVAL = 3600
+REQUESTS_PER_HOUR = 1000
+FULL_POLLING_INTERVAL = 21600
+CACHE_TTL = 30
+CACHE_MAX_ENTRIES = 1024
+TOP_RIDES = 50
+WEB_HOST = '127.0.0.1'
+WEB_PORT = 8080
+WEB_SWEEP_INTERVAL = 300
+METRICS_HOST = '127.0.0.1'
+PROXY_FAILURE_THRESHOLD = 3
+PROXY_MAX_ERROR_RATE = 0.5
+PROXY_MIN_REQUESTS = 10
+PROXY_COOLDOWN = 60
+GOVERNOR_INITIAL_RATE = 5
+GOVERNOR_MIN_RATE = 0.5
+GOVERNOR_MAX_RATE = 50
+GOVERNOR_ADDITIVE_INCREASE = 0.5
+GOVERNOR_DECREASE_FACTOR = 0.5
+GOVERNOR_LATENCY_TOLERANCE = 2.0
+LOCATION_EMPTY_SWEEPS = 10
+LOCATION_ERROR_SWEEPS = 3
+LOCATION_SLOW_INTERVAL = 21600
+NOTIFY_BATCH_SIZE = 100
+NOTIFY_BATCH_WINDOW = 2
+NOTIFY_QUEUE_SIZE = 1000
+NOTIFY_MAX_ATTEMPTS = 3
+NOTIFY_CLOSE_TIMEOUT = 10
+LOG_MAX_BYTES = 10485760
+LOG_BACKUP_COUNT = 5
 
 examination_dict = {
     'Kunskapsprov': 3,
@@ -4,7 +4,11 @@ from pathlib import Path
 working_directory = Path.cwd()
 project_directory = Path(__file__).parent.parent
 logging_directory = working_directory / 'log'
+profiling_directory = working_directory / 'profiles'
 
 # Create Path objects representing the file paths
 config_file = working_directory / 'config.json'
+snapshot_database = working_directory / 'snapshots.db'
+watch_profiles = working_directory / 'watch_profiles.json'
+location_index = working_directory / 'location_index.json'
 valid_locations_path = project_directory / 'data' / 'valid_locations.json'
@@ -0,0 +1,472 @@
+"""Asynchronous web server for the "Start web server" mode.
+
+The server keeps the latest snapshot of the available rides in memory and is
+fed by a sweep running in the background. Every request is answered from
+memory, so no page view ever causes a request to Trafikverket:
+
+- `GET /` serves a small page that shows the rides and keeps them up to date.
+- `GET /rides.json` serves the snapshot as JSON. The body is serialized and
+  compressed once per change and shared by all clients, and an ETag lets
+  clients revalidate it with a 304 response.
+- `GET /query` answers queries over the snapshot, for example
+  `/query?location=Örebro&to=2023-03-01&max_cost=900&limit=1`, from an
+  index that is built once per change.
+- `GET /events` streams the added, removed and changed rides to the browser
+  as Server-Sent Events.
+- `GET /metrics` serves the metrics of the requests and sweeps in the
+  Prometheus text format.
+
+A single event loop serves all clients, so one process can keep thousands of
+viewers connected.
+"""
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Callable, Iterable
+
+from aiohttp import web
+
+from api.metrics import CONTENT_TYPE, Metrics
+from helpers.diff import DiffEngine, RideEvent
+from helpers.query import RideIndex, RideQuery
+from helpers.ride import Ride
+from helpers.sweep import SweepTarget
+from variables import constants
+
+# The number of event messages buffered for each viewer before it is
+# disconnected for being too slow. It will reconnect and refetch the snapshot.
+SUBSCRIBER_QUEUE_SIZE = 256
+
+# The number of seconds between keep-alive comments on idle event streams
+HEARTBEAT_INTERVAL = 15
+
+# The number of rides returned by a query without a limit
+DEFAULT_QUERY_LIMIT = 100
+
+INDEX_PAGE = '''<!DOCTYPE html>
+<html lang="sv">
+<head>
+<meta charset="utf-8">
+<title>Available rides</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; }
+td, th { padding: 0.2em 0.8em; text-align: left; }
+tr.added { background: #dfd; }
+</style>
+</head>
+<body>
+<h1>Available rides</h1>
+<p id="status">Loading...</p>
+<table>
+<thead><tr><th>Date</th><th>Time</th><th>Location</th><th>Name</th><th>Cost</th></tr></thead>
+<tbody id="rides"></tbody>
+</table>
+<script>
+const FIELDS = ['date', 'time', 'location', 'name', 'cost'];
+const rides = new Map();
+const key = ride => [ride.date, ride.time, ride.location, ride.name].join('|');
+
+function render(added) {
+    const body = document.getElementById('rides');
+    body.replaceChildren(...[...rides.values()]
+        .sort((a, b) => key(a) < key(b) ? -1 : 1)
+        .map(ride => {
+            const row = document.createElement('tr');
+            if (added && added.has(key(ride))) row.className = 'added';
+            for (const field of FIELDS) row.insertCell().textContent = ride[field];
+            return row;
+        }));
+    document.getElementById('status').textContent =
+        `${rides.size} rides, updated ${new Date().toLocaleTimeString()}`;
+}
+
+async function load() {
+    const snapshot = await (await fetch('rides.json')).json();
+    rides.clear();
+    for (const ride of snapshot.rides) rides.set(key(ride), ride);
+    render();
+}
+
+const events = new EventSource('events');
+events.onopen = load;
+events.onmessage = message => {
+    const added = new Set();
+    for (const event of JSON.parse(message.data)) {
+        if (event.type === 'removed') {
+            rides.delete(key(event.ride));
+        } else {
+            rides.set(key(event.ride), event.ride);
+            if (event.type === 'added') added.add(key(event.ride));
+        }
+    }
+    render(added);
+};
+</script>
+</body>
+</html>
+'''
+
+
+class Snapshot:
+    """The latest known rides of every location and exam type, serialized on demand.
+
+    The JSON body and the query index are only rebuilt when a request comes
+    in after the rides changed, so a sweep updating every location costs one
+    rebuild instead of one per location.
+
+    Attributes:
+        version: A number that is incremented every time the rides change.
+        updated_at: The UNIX time of the last change.
+    """
+
+    def __init__(self, initial_state: dict[SweepTarget, Iterable[Ride]] = None) -> None:
+        """Initialize the Snapshot object.
+
+        Args:
+            initial_state: The last known rides of each location and exam type.
+        """
+        self.version = 0
+        self.updated_at = time.time()
+        self._diff_engine = DiffEngine(initial_state)
+
+        # Distinguishes the versions of this process from those of earlier runs
+        self._instance = uuid.uuid4().hex[:8]
+
+        # The serialized snapshot and the query index, or None if the rides changed since
+        self._rendered: tuple[str, bytes, bytes] | None = None
+        self._index: RideIndex | None = None
+
+    def __len__(self) -> int:
+        """Return the number of rides in the snapshot."""
+        return len(self._diff_engine)
+
+    def rides(self) -> Iterable[Ride]:
+        """Iterate over the rides in the snapshot."""
+        return self._diff_engine.rides()
+
+    @property
+    def etag(self) -> str:
+        """The entity tag of the current version of the snapshot."""
+        return f'"{self._instance}-{self.version}"'
+
+    def update(self, target: SweepTarget, rides: Iterable[Ride]) -> list[RideEvent]:
+        """Replace the rides of a polled location.
+
+        Args:
+            target: The polled location and exam type.
+            rides: The rides found in the location.
+
+        Returns:
+            The events for the rides that were added, removed or changed. Their
+            location_id is the target.
+        """
+        events = self._diff_engine.update(target, rides)
+        if events:
+            self.version += 1
+            self.updated_at = time.time()
+            self._rendered = None
+            self._index = None
+        return events
+
+    def index(self) -> RideIndex:
+        """Return the query index of the rides in the snapshot."""
+        if self._index is None:
+            self._index = RideIndex(self.rides())
+        return self._index
+
+    def render(self) -> tuple[str, bytes, bytes]:
+        """Return the ETag, JSON body and gzip-compressed JSON body of the snapshot."""
+        if self._rendered is None:
+            body = json.dumps({
+                'version': self.version,
+                'updated_at': self.updated_at,
+                'rides': [ride._asdict() for ride in sorted(self.rides())],
+            }, ensure_ascii=False, separators=(',', ':')).encode()
+            self._rendered = (self.etag, body, gzip.compress(body, compresslevel=6))
+
+        return self._rendered
+
+
+def parse_date(value: str | None) -> str | None:
+    """Parse a date of a query, so that it compares with the dates of the rides.
+
+    Args:
+        value: The date in ISO format, or None.
+
+    Returns:
+        The date in the format 'YYYY-MM-DD', or None.
+
+    Raises:
+        ValueError: If the date is malformed.
+    """
+    if value is None:
+        return None
+    return datetime.date.fromisoformat(value).isoformat()
+
+
+def encode_events(events: list[RideEvent], event_id: int) -> bytes:
+    """Encode the events of one update as a single Server-Sent Events message.
+
+    Args:
+        events: The events to encode, with the target as their location_id.
+        event_id: The ID of the message, the version of the snapshot after
+            the update.
+
+    Returns:
+        The encoded message.
+    """
+    data = json.dumps([
+        {
+            'type': event.type.value,
+            'exam_type': event.location_id.exam_type,
+            'location_id': event.location_id.location_id,
+            'ride': event.ride._asdict(),
+        }
+        for event in events
+    ], ensure_ascii=False, separators=(',', ':'))
+    return f'id: {event_id}\ndata: {data}\n\n'.encode()
+
+
+class EventBroadcaster:
+    """Fan out encoded event messages to every connected viewer.
+
+    Every message is encoded once and put in the queue of each viewer. A
+    viewer whose queue is full is disconnected instead of slowing down the
+    others. Must only be used from the event loop of the server.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE) -> None:
+        """Initialize the EventBroadcaster object.
+
+        Args:
+            queue_size: The number of messages buffered for each viewer.
+        """
+        self._queue_size = queue_size
+        self._subscribers: set[asyncio.Queue] = set()
+
+    def __len__(self) -> int:
+        """Return the number of connected viewers."""
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Register a viewer and return the queue of its messages.
+
+        A None message means that the viewer fell behind and must disconnect.
+        """
+        messages = asyncio.Queue(self._queue_size + 1)
+        self._subscribers.add(messages)
+        return messages
+
+    def unsubscribe(self, messages: asyncio.Queue) -> None:
+        """Unregister a viewer."""
+        self._subscribers.discard(messages)
+
+    def publish(self, message: bytes) -> None:
+        """Send a message to every viewer."""
+        for messages in list(self._subscribers):
+            if messages.qsize() >= self._queue_size:
+                # Leave room for the message telling the viewer to disconnect
+                self.unsubscribe(messages)
+                messages.put_nowait(None)
+            else:
+                messages.put_nowait(message)
+
+
+class WebServer:
+    """Serve the snapshot of the available rides and stream its changes.
+
+    Attributes:
+        snapshot: The rides served to the viewers.
+        broadcaster: The event streams of the connected viewers.
+        metrics: The metrics of the requests, sweeps and changes.
+        app: The aiohttp application.
+    """
+
+    def __init__(self, snapshot: Snapshot, logger: logging.Logger, metrics: Metrics = None) -> None:
+        """Initialize the WebServer object.
+
+        Args:
+            snapshot: The rides served to the viewers.
+            logger: The logger used to report the state of the server.
+            metrics: The metrics served on `/metrics`. Defaults to a new
+                Metrics object.
+        """
+        self.snapshot = snapshot
+        self.broadcaster = EventBroadcaster()
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._logger = logger
+        self._runner: web.AppRunner | None = None
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get('/', self.handle_index),
+            web.get('/rides.json', self.handle_rides),
+            web.get('/query', self.handle_query),
+            web.get('/events', self.handle_events),
+            web.get('/metrics', self.handle_metrics),
+        ])
+
+    def apply(self, target: SweepTarget, rides: Iterable[Ride]) -> list[RideEvent]:
+        """Update the rides of a polled location and notify the viewers.
+
+        Must be called from the event loop of the server.
+
+        Args:
+            target: The polled location and exam type.
+            rides: The rides found in the location.
+
+        Returns:
+            The events for the rides that were added, removed or changed.
+        """
+        events = self.snapshot.update(target, rides)
+        if events:
+            self.metrics.record_events(events, constants.examination_dict[target.exam_type])
+            self.broadcaster.publish(encode_events(events, self.snapshot.version))
+        return events
+
+    async def start(self, host: str, port: int) -> None:
+        """Start listening for requests.
+
+        Args:
+            host: The address to listen on.
+            port: The port to listen on.
+        """
+        # Skip the access log, every viewer polls and streams continuously
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._logger.info('Serving the available rides on http://%s:%s/', host, port)
+
+    async def stop(self) -> None:
+        """Disconnect all viewers and stop listening."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_index(self, request: web.Request) -> web.Response:
+        """Serve the page showing the rides."""
+        return web.Response(text=INDEX_PAGE, content_type='text/html')
+
+    async def handle_rides(self, request: web.Request) -> web.Response:
+        """Serve the snapshot as JSON, or 304 if the client has the current version."""
+        etag, body, compressed_body = self.snapshot.render()
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+
+        if etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers=headers)
+
+        # Send the body that was compressed once for every client
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            body = compressed_body
+
+        headers['Vary'] = 'Accept-Encoding'
+        return web.Response(body=body, content_type='application/json', headers=headers)
+
+    async def handle_query(self, request: web.Request) -> web.Response:
+        """Answer a query over the snapshot.
+
+        The query parameters are location and name, which can be repeated,
+        from and to, the first and last date, max_cost and limit.
+        """
+        etag = self.snapshot.etag
+        if etag in request.headers.get('If-None-Match', ''):
+            return web.Response(status=304, headers={'ETag': etag})
+
+        params = request.query
+        try:
+            query = RideQuery(
+                locations=params.getall('location', None),
+                names=params.getall('name', None),
+                start_date=parse_date(params.get('from')),
+                end_date=parse_date(params.get('to')),
+                max_cost=int(params['max_cost']) if 'max_cost' in params else None,
+                limit=int(params.get('limit', DEFAULT_QUERY_LIMIT)),
+            )
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=f'Invalid query: {e}') from e
+
+        rides = self.snapshot.index().query(query)
+        return web.json_response(
+            {'version': self.snapshot.version, 'rides': [ride._asdict() for ride in rides]},
+            headers={'ETag': etag, 'Cache-Control': 'no-cache'},
+            dumps=lambda data: json.dumps(data, ensure_ascii=False, separators=(',', ':')),
+        )
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        """Serve the metrics in the Prometheus text format."""
+        return web.Response(body=self.metrics.render(), headers={'Content-Type': CONTENT_TYPE})
+
+    async def handle_events(self, request: web.Request) -> web.StreamResponse:
+        """Stream the changes of the rides as Server-Sent Events."""
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        await response.prepare(request)
+
+        messages = self.broadcaster.subscribe()
+        try:
+            # Tell the browser how long to wait before reconnecting
+            await response.write(b'retry: 5000\n\n')
+
+            while 1:
+                try:
+                    message = await asyncio.wait_for(messages.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    # Keep the connection open through proxies
+                    message = b': keep-alive\n\n'
+
+                # The viewer fell behind, it reconnects and refetches the snapshot
+                if message is None:
+                    break
+
+                await response.write(message)
+        except ConnectionResetError:
+            pass
+        finally:
+            self.broadcaster.unsubscribe(messages)
+
+        return response
+
+
+async def sweep_forever(
+    server: WebServer,
+    sweep: Callable[[], AsyncIterator[tuple[SweepTarget, list[Ride] | None]]],
+    interval: float,
+    logger: logging.Logger,
+) -> None:
+    """Keep the snapshot of the server up to date by sweeping in the background.
+
+    Args:
+        server: The server to update.
+        sweep: A function starting a sweep, returning the target and rides of
+            every location as soon as it completes. The rides are None if the
+            location could not be retrieved, in which case it keeps its
+            previous rides.
+        interval: The number of seconds between the start of two sweeps.
+        logger: The logger used to report the sweeps.
+    """
+    while 1:
+        start_time = time.monotonic()
+
+        changes = 0
+        async for target, rides in sweep():
+            if rides is not None:
+                changes += len(server.apply(target, rides))
+
+        sweep_time = time.monotonic() - start_time
+        server.metrics.sweep_duration.observe(sweep_time)
+        logger.debug(
+            'Swept in %.2fs: %s rides, %s changes, %s viewers',
+            sweep_time, len(server.snapshot), changes, len(server.broadcaster)
+        )
+
+        # Wait until the next sweep is due
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - start_time)))